@@ -1,605 +1,1602 @@
+import time
+
+# Start-up report: when importing this module began, so create_app can report the import cost
+_IMPORT_STARTED = time.perf_counter()
+
+import csv
+import hashlib
+import logging
 import math
-import sys
-import pandas as pd
-from flask import Flask, render_template, request, jsonify, send_file
-from io import BytesIO
-
-app = Flask(__name__)
-
-# Conversion factor
-GALLONS_TO_LITERS = 3.785411784 # 1 US gallon = 3.785411784 liters [2, 3, 5, 10, 13]
-
-# Approximate volumes of water bodies in Liters.
-# These ranges are illustrative and designed to provide distinct categories for comparison.
-# Sourced from various search results and general knowledge to provide a wide range.
-WATER_BODY_VOLUMES = {
-    "a small pond": {
-        "min": 0,
-        "max": 1.0 * (10**7), # Up to 10 million liters (10,000 m³) approx. for a large pond [8, 30, 31, 32, 43, 45]
-    },
-    "a large pond or a small lake": {
-        "min": 1.0 * (10**7),
-        "max": 1.0 * (10**9), # Up to 1 billion liters (1 million m³)
-    },
-    "a medium-sized lake": {
-        "min": 1.0 * (10**9),
-        "max": 1.0 * (10**12), # Up to 1 trillion liters (1 billion m³)
-    },
-    "a large lake (e.g., Lake Tahoe)": {
-        "min": 1.0 * (10**12),
-        "max": 1.0 * (10**15), # Up to 1 quadrillion liters (1 trillion m³) - Lake Tahoe ~1.47 x 10^14 L (39 trillion gallons) [19, 38, 42]
-    },
-    "a Great Lake (e.g., Lake Superior)": {
-        "min": 1.0 * (10**15),
-        "max": 1.0 * (10**17), # Up to 100 quadrillion liters (100 trillion m³) - Lake Superior ~1.21 x 10^16 L (3 quadrillion gallons) [6, 9, 21, 34, 35, 39, 40]
-    },
-    "an entire sea (e.g., Mediterranean Sea)": {
-        "min": 1.0 * (10**17),
-        "max": 1.0 * (10**19), # Up to 10 quintillion liters (10 exaliters) - Mediterranean Sea ~3.75 x 10^18 L (3.75 quintillion liters) [20, 36, 37, 41, 44]
-    },
-    "an entire ocean (e.g., Pacific Ocean)": {
-        "min": 1.0 * (10**19),
-        "max": 1.0 * (10**21), # Up to 1 sextillion liters - Pacific Ocean ~7.02 x 10^20 L (702 quintillion liters) [11, 17, 22, 26, 29]
-    }
-}
+import os
+import sqlite3
+import tempfile
+import threading
+import numpy as np
+from collections import OrderedDict, namedtuple
+from flask import Blueprint, Flask, Response, current_app, render_template, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
+from io import StringIO
+from calculator import (
+    calculate_columns,
+    calculate_rows,
+    CALCULATION_CHUNK_SIZE,
+    fill_time_matrix,
+    find_milestones,
+    finite_json,
+    GALLONS_TO_LITERS,
+    iter_calculation_column_chunks,
+    parse_calculation_inputs,
+    parse_fill_rate,
+    row_fields,
+    perform_batch_calculation,
+    perform_calculation,
+    REFERENCE_INDEX,
+    TIME_UNIT_SECONDS,
+    volume_series,
+)
+from metrics import (
+    METRICS,
+    process_memory,
+    request_timings,
+    server_timing_header,
+    stage,
+    start_request_timings,
+)
+from exports import (
+    EXPORT_COLUMNS,
+    export_columns,
+    EXPORT_FILENAME,
+    EXPORT_FORMATS,
+    ExportJobQueue,
+    ExportQueueFull,
+    load_export_libraries,
+    PARQUET_AVAILABLE,
+)
+from profiling import format_report, PROFILER
+
+try:
+    import fcntl
+except ImportError: # Cross-worker request coalescing needs flock, so it is Unix only
+    fcntl = None
+
+# Every route is registered on this blueprint; create_app() builds the Flask app around it
+bp = Blueprint("compounder", __name__)
+# The same logger as app.logger (Flask names it after the app), but usable outside a request
+logger = logging.getLogger(__name__)
+
+# Windowed requests only ever compute one window, so the series itself may be much longer.
+MAX_WINDOWED_ITERATIONS = 1_000_000_000
+WINDOW_DEFAULT_LIMIT = 100
+WINDOW_MAX_LIMIT = 1000
+# Most scenarios accepted by /calculate_batch
+MAX_BATCH_SCENARIOS = 1000
+
+# Bumped whenever the calculation or export output changes, so stale cache entries are never served.
+# The reference table's fingerprint is part of it, as a different WVC_REFERENCE_CATALOG changes
+# the descriptions and fill times.
+CALCULATION_VERSION = f"3-{REFERENCE_INDEX.fingerprint}"
+
+
+class FiniteJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that writes non-finite floats (e.g. overflowed volumes) as null, since bare
+    Infinity and NaN are not valid JSON and clients' parsers reject them. Values are encoded
+    directly and only walked and copied when the encoder finds a non-finite float.
+    """
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault("allow_nan", False)
+        try:
+            return super().dumps(obj, **kwargs)
+        except ValueError:
+            return super().dumps(finite_json(obj), **kwargs)
+
+
+def calculation_cache_key(kind, inputs):
+    """
+    Returns a cache key for a validated calculation. Inputs that produce identical output
+    normalize to the same key, e.g. "1000" and "1e3", or a fill rate without a time unit.
+    """
+    rate_key = None
+    if inputs.time_rate_liters_per_unit and inputs.time_unit:
+        try:
+            rate_key = repr(float(inputs.time_rate_liters_per_unit))
+        except ValueError:
+            rate_key = "invalid"
+    return "|".join([
+        kind,
+        CALCULATION_VERSION,
+        repr(inputs.initial_volume),
+        'gallons' if inputs.unit == 'gallons' else 'litres',
+        str(inputs.iterations),
+        str(rate_key),
+        str(inputs.time_unit) if rate_key else "",
+        inputs.magnitude,
+        ",".join(inputs.fields or ()),
+        inputs.rule.text if inputs.rule else "",
+    ])
+
+
+class SQLiteCacheStore:
+    """
+    Shared cache backing store in a local SQLite file, so every gunicorn worker on the
+    host sees the others' results. Each thread gets its own connection. Total size is kept
+    under max_bytes by evicting the least recently used rows. Hits only write back their access
+    time when it is more than ACCESS_GRANULARITY seconds old, so reads from all workers do not
+    queue on SQLite's write lock. Connections are never carried across a fork: a forked worker
+    (e.g. under gunicorn --preload) opens its own.
+    """
+
+    PRUNE_EVERY = 64
+    # Seconds of accessed_at precision kept for LRU eviction
+    ACCESS_GRANULARITY = 60
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+        os.register_at_fork(after_in_child=self._forget_connections)
+
+    def _forget_connections(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            if now - row[2] >= self.ACCESS_GRANULARITY:
+                connection.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(row[0])
+
+    def set(self, key, value, expires_at):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), expires_at, time.time()),
+            )
+            with self.lock:
+                self.writes += 1
+                prune = self.writes % self.PRUNE_EVERY == 0
+            if prune:
+                self._prune(connection)
+
+    def _prune(self, connection):
+        connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in connection.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class ResultCache:
+    """
+    Bounded in-process LRU cache of rendered results (JSON bodies, export files) with a TTL.
+    Memory is bounded by max_entries and max_bytes; values over max_entry_bytes are not cached.
+    An optional shared store (SQLiteCacheStore) is consulted on local misses and written through.
+    """
+
+    def __init__(self, max_entries, max_bytes, max_entry_bytes, ttl_seconds, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self.entries = OrderedDict() # key -> (value, expires_at)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "stores": 0}
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[0]
+                self._remove(key)
+
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared result cache read failed: {e}")
+                value = None
+            if value is not None:
+                with self.lock:
+                    self.counters["shared_hits"] += 1
+                    self._insert(key, value, now + self.ttl_seconds)
+                return value
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        if len(value) > self.max_entry_bytes:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        with self.lock:
+            self.counters["stores"] += 1
+            self._insert(key, value, expires_at)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared result cache write failed: {e}")
+
+    def _insert(self, key, value, expires_at):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (value, expires_at)
+        self.total_bytes += len(value)
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.counters["evictions"] += 1
+
+    def _remove(self, key):
+        value, _ = self.entries.pop(key)
+        self.total_bytes -= len(value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.total_bytes, shared=self.store is not None)
+
+
+def _build_result_cache():
+    max_bytes = int(os.environ.get("WVC_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    sqlite_path = os.environ.get("WVC_CACHE_SQLITE_PATH")
+    return ResultCache(
+        max_entries=int(os.environ.get("WVC_CACHE_MAX_ENTRIES", 512)),
+        max_bytes=max_bytes,
+        max_entry_bytes=int(os.environ.get("WVC_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)),
+        ttl_seconds=float(os.environ.get("WVC_CACHE_TTL_SECONDS", 3600)),
+        store=SQLiteCacheStore(sqlite_path, int(os.environ.get("WVC_CACHE_SHARED_MAX_BYTES", max_bytes * 4))) if sqlite_path else None,
+    )
+
 
-PLANET_VOLUMES = {
-    "Planet Mars": 1.6318 * (10**23), # Mars Volume ~1.6318 x 10^11 km³ = 1.6318 x 10^23 L [1, 7, 14, 27, 28]
-    "Planet Earth": 1.083 * (10**24), # Earth Volume ~1.083 x 10^12 km³ = 1.083 x 10^24 L [1, 4, 8, 12, 15, 18, 23]
-    "Planet Jupiter": 1.4313 * (10**27) # Jupiter Volume ~1.4313 x 10^15 km³ = 1.4313 x 10^27 L [1, 4, 6, 12, 16, 24, 25]
+RESULT_CACHE = _build_result_cache()
+
+# Admission control. Every calculation's cost is estimated from its inputs before any work
+# starts and admitted against per-worker budgets, so cheap requests of any length go through
+# and bursts of expensive ones queue briefly or get 429.
+
+# Estimated CPU microseconds per row to compute each field
+FIELD_ROW_COST_US = {
+    "iteration": 0.2,
+    "volume_liters_raw": 0.1,
+    "volume_liters": 2.6,
+    "volume_gallons": 2.9,
+    "description": 2.9,
+    "time_to_fill": 1.0,
+    "time_to_fill_seconds": 0.2,
+    "volume_log10": 0.2,
+    "volume_cubic_meters": 0.1,
+    "volume_cubic_kilometers": 0.1,
+    "volume_acre_feet": 0.1,
+    "volume_imperial_gallons": 0.1,
+}
+# Estimated CPU microseconds per field per row to assemble and encode each output
+OUTPUT_FIELD_COST_US = {
+    "rows": 1.0,
+    "columnar": 0.5,
+    "ndjson": 1.7,
+    "csv": 1.0,
+    "xlsx": 18.0,
+    "parquet": 1.2,
 }
+# Outputs sent as they are produced hold only one chunk of rows in memory at a time
+STREAMED_OUTPUTS = {"ndjson", "csv", "xlsx", "parquet"}
+# Approximate bytes per field per row while a result is held in memory (objects plus encoded body)
+FIELD_ROW_BYTES = 200
+# Estimated CPU microseconds per row of a custom rule's series, including a window's prefix
+RULE_ROW_COST_US = 0.05
+# Estimated CPU microseconds and held bytes per cell of a /api/fill_times matrix
+FILL_TIME_CELL_COST_US = 0.5
+FILL_TIME_CELL_BYTES = 100
+# Approximate encoded bytes per field per row of a JSON result body (rows, the larger format)
+FIELD_BODY_BYTES = 48
+
+CalculationCost = namedtuple("CalculationCost", ["cpu_seconds", "memory_bytes"])
+
+
+def estimate_calculation_cost(inputs, output="rows", start=0, stop=None):
+    """
+    Estimates the CPU time and peak memory of producing iterations start+1..stop (all of them
+    by default) of a validated calculation in the given output, from the rows, the selected
+    fields and the output format alone.
+    """
+    stop = inputs.iterations if stop is None else stop
+    rows = max(stop - start, 0)
+    fields = row_fields(inputs)
+    row_cost = sum(FIELD_ROW_COST_US[field] for field in fields) + len(fields) * OUTPUT_FIELD_COST_US[output]
+    cpu_us = rows * row_cost + (stop * RULE_ROW_COST_US if inputs.rule is not None else 0)
+    held_rows = min(rows, CALCULATION_CHUNK_SIZE) if output in STREAMED_OUTPUTS else rows
+    return CalculationCost(cpu_us / 1e6, held_rows * len(fields) * FIELD_ROW_BYTES)
+
+
+def estimate_body_bytes(inputs, start=0, stop=None):
+    """
+    Estimates the size of the JSON body of iterations start+1..stop (all of them by default) of
+    a validated calculation, to tell whether RESULT_CACHE could store it.
+    """
+    stop = inputs.iterations if stop is None else stop
+    return max(stop - start, 0) * len(row_fields(inputs)) * FIELD_BODY_BYTES
+
+
+def estimate_fill_times_cost(inputs):
+    """
+    Estimates the CPU time and peak memory of a /api/fill_times matrix for validated inputs.
+    """
+    cells = inputs.iterations * len(REFERENCE_INDEX.reference_names)
+    return CalculationCost(cells * FILL_TIME_CELL_COST_US / 1e6, cells * FILL_TIME_CELL_BYTES)
+
+
+class CalculationTooExpensive(ValueError):
+    """
+    Raised for a calculation whose estimated cost exceeds a whole worker budget, so it could never be admitted.
+    """
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a calculation cannot be admitted in time; answered with 429 and Retry-After.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    The budget held by one admitted calculation. release() is idempotent, so streamed responses
+    can release both when their generator finishes and when the response is closed.
+    """
+
+    def __init__(self, controller, cost):
+        self.controller = controller
+        self.cost = cost
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.cost)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Per-worker admission control over estimated calculation costs. A calculation is admitted
+    while the estimated CPU seconds and memory of everything in flight stay within budget;
+    otherwise it waits up to queue_timeout_seconds for budget to free up, with at most
+    max_queued calculations waiting. Calculations larger than a whole budget are refused outright.
+    """
+
+    def __init__(self, cpu_budget_seconds, memory_budget_bytes, queue_timeout_seconds, max_queued):
+        self.cpu_budget_seconds = cpu_budget_seconds
+        self.memory_budget_bytes = memory_budget_bytes
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.max_queued = max_queued
+        self.condition = threading.Condition()
+        self.cpu_in_flight = 0.0
+        self.memory_in_flight = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.too_expensive = 0
+
+    def _fits(self, cost):
+        return (self.cpu_in_flight + cost.cpu_seconds <= self.cpu_budget_seconds
+                and self.memory_in_flight + cost.memory_bytes <= self.memory_budget_bytes)
+
+    def _retry_after(self):
+        return max(1, math.ceil(self.cpu_in_flight))
+
+    def admit(self, cost):
+        """
+        Admits a calculation of the given cost and returns its AdmissionTicket, waiting for budget
+        if needed. Raises CalculationTooExpensive or AdmissionRejected.
+        """
+        if cost.cpu_seconds > self.cpu_budget_seconds or cost.memory_bytes > self.memory_budget_bytes:
+            with self.condition:
+                self.too_expensive += 1
+            raise CalculationTooExpensive(
+                f"This calculation is too large to run (estimated {cost.cpu_seconds:,.1f} CPU seconds and "
+                f"{cost.memory_bytes / 2**20:,.0f} MiB; the limits are {self.cpu_budget_seconds:,.1f} seconds and "
+                f"{self.memory_budget_bytes / 2**20:,.0f} MiB). Request fewer iterations or fields, or use a streamed or columnar format."
+            )
+        with self.condition:
+            if not self._fits(cost):
+                if self.waiting >= self.max_queued:
+                    self.rejected += 1
+                    raise AdmissionRejected("The server is busy. Please retry shortly.", self._retry_after())
+                self.waiting += 1
+                self.queued += 1
+                try:
+                    with stage("admission_wait"):
+                        fits = self.condition.wait_for(lambda: self._fits(cost), timeout=self.queue_timeout_seconds)
+                finally:
+                    self.waiting -= 1
+                if not fits:
+                    self.rejected += 1
+                    raise AdmissionRejected("The server is busy. Please retry shortly.", self._retry_after())
+            self.cpu_in_flight += cost.cpu_seconds
+            self.memory_in_flight += cost.memory_bytes
+            self.in_flight += 1
+            self.admitted += 1
+        return AdmissionTicket(self, cost)
+
+    def release(self, cost):
+        with self.condition:
+            self.cpu_in_flight -= cost.cpu_seconds
+            self.memory_in_flight -= cost.memory_bytes
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "cpu_budget_seconds": self.cpu_budget_seconds,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "cpu_seconds_in_flight": self.cpu_in_flight,
+                "memory_bytes_in_flight": self.memory_in_flight,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "too_expensive": self.too_expensive,
+            }
 
-def format_large_number_spoken(num, unit_str="Liters"):
-    """
-    Formats a large number into a human-readable string using terms like
-    million, billion, trillion, quadrillion, quintillion, sextillion, septillion, etc.
-    Handles 'Infinity' and very small numbers.
-    """
-    if num == float('inf'):
-        return "Infinity"
-    if num < 0:
-        return f"Invalid (Negative) Volume {unit_str}"
-    if num == 0:
-        return f"0 {unit_str}"
-    if num < 1:
-        return f"{num:,.6f} {unit_str}" # For very small volumes, keep decimal format
-
-    # Define suffixes for powers of 1000
-    # The list is now sorted by value in descending order, making the lookup correct.
-    suffixes = [
-        (10**303, "Centillion"), # Approx. 10^303 to cover near float max
-        (10**273, "NovemNovemDecillion"), # Using a more consistent naming for extreme numbers
-        (10**270, "OctoNovemDecillion"),
-        (10**267, "SeptenNovemDecillion"),
-        (10**264, "SexNovemDecillion"),
-        (10**261, "QuinNovemDecillion"),
-        (10**258, "QuattuorNovemDecillion"),
-        (10**255, "TreNovemDecillion"),
-        (10**252, "DuoNovemDecillion"),
-        (10**249, "UnNovemDecillion"),
-        (10**246, "NovemDecillion"),
-        (10**243, "OctoDecillion"),
-        (10**240, "SeptenDecillion"),
-        (10**237, "SexDecillion"),
-        (10**234, "QuinDecillion"),
-        (10**231, "QuattuorDecillion"),
-        (10**228, "TreDecillion"),
-        (10**225, "DuoDecillion"),
-        (10**222, "UnDecillion"),
-        (10**219, "Vigintillion"), # 10^3 * 73
-        (10**216, "Novemsexagintillion"),
-        (10**213, "Octosexagintillion"),
-        (10**210, "Septensexagintillion"),
-        (10**207, "Sexsexagintillion"),
-        (10**204, "Quinsexagintillion"),
-        (10**201, "Quattuorsexagintillion"),
-        (10**198, "Tresexagintillion"),
-        (10**195, "Duosexagintillion"),
-        (10**192, "Unsexagintillion"),
-        (10**189, "Sexagintillion"), # 10^3 * 63
-        (10**186, "Novemquinquagintillion"),
-        (10**183, "Octoquinquagintillion"),
-        (10**180, "Septenquinquagintillion"),
-        (10**177, "Sexquinquagintillion"),
-        (10**174, "Quinquinquagintillion"),
-        (10**171, "Quattuorquinquagintillion"),
-        (10**168, "Trequinquagintillion"),
-        (10**165, "Duoquinquagintillion"),
-        (10**162, "Unquinquagintillion"),
-        (10**159, "Quinquagintillion"), # 10^3 * 53
-        (10**156, "Novemquadragintillion"),
-        (10**153, "Octoquadragintillion"),
-        (10**150, "Septenquadragintillion"),
-        (10**147, "Sexquadragintillion"),
-        (10**144, "Quinquadragintillion"),
-        (10**141, "Quattuorquadragintillion"),
-        (10**138, "Trequadragintillion"),
-        (10**135, "Duoquadragintillion"),
-        (10**132, "Unquadragintillion"),
-        (10**129, "Quadragintillion"), # 10^3 * 43
-        (10**126, "Novemtrigintillion"),
-        (10**123, "Octotrigintillion"),
-        (10**120, "Septentrigintillion"),
-        (10**117, "Sextrigintillion"),
-        (10**114, "Quintrigintillion"),
-        (10**111, "Quattuortrigintillion"),
-        (10**108, "Tretrigintillion"),
-        (10**105, "Duotrigintillion"),
-        (10**102, "Untrigintillion"),
-        (10**99, "Trigintillion"), # 10^3 * 33
-        (10**96, "Novemvigintillion"),
-        (10**93, "Octovigintillion"),
-        (10**90, "Septenvigintillion"),
-        (10**87, "Sexvigintillion"),
-        (10**84, "Quinvigintillion"),
-        (10**81, "Quattuorvigintillion"),
-        (10**78, "Trevigintillion"),
-        (10**75, "Duovigintillion"),
-        (10**72, "Unvigintillion"),
-        (10**69, "Vigintillion"), # 10^3 * 23
-        (10**66, "Novemdecillion"),
-        (10**63, "Octodecillion"),
-        (10**60, "Septendecillion"),
-        (10**57, "Sexdecillion"),
-        (10**54, "Quindecillion"),
-        (10**51, "Quattuordecillion"),
-        (10**48, "Tredecillion"),
-        (10**45, "Duodecillion"),
-        (10**42, "Undecillion"),
-        (10**39, "Decillion"),
-        (10**36, "Nonillion"),
-        (10**33, "Octillion"),
-        (10**30, "Septillion"),
-        (10**27, "Sextillion"),
-        (10**24, "Quintillion"),
-        (10**21, "Quadrillion"),
-        (10**18, "Trillion"),
-        (10**15, "Billion"),
-        (10**12, "Million"),
-        (10**9, "Thousand") # This should be 10^3, i.e., 10^9 should be Billion, 10^12 Trillion etc.
-    ]
-
-    # Re-evaluating suffixes for correct powers of 1000
-    # Standard long scale:
-    # 10^0: None
-    # 10^3: Thousand
-    # 10^6: Million
-    # 10^9: Billion
-    # 10^12: Trillion
-    # 10^15: Quadrillion
-    # 10^18: Quintillion
-    # 10^21: Sextillion
-    # 10^24: Septillion
-    # 10^27: Octillion
-    # 10^30: Nonillion
-    # 10^33: Decillion
-    # ... and so on, each increment of 3 in the exponent gets a new suffix.
-
-    # Corrected and expanded suffixes list
-    suffixes = [
-        (10**303, "Centillion"), # 10^(3*101)
-        (10**300, "NovemNovemDecillion"), # 10^(3*100) - Placeholder for very large numbers
-        (10**297, "OctoNovemDecillion"), # 10^(3*99)
-        (10**294, "SeptenNovemDecillion"), # 10^(3*98)
-        (10**291, "SexNovemDecillion"),
-        (10**288, "QuinNovemDecillion"),
-        (10**285, "QuattuorNovemDecillion"),
-        (10**282, "TreNovemDecillion"),
-        (10**279, "DuoNovemDecillion"),
-        (10**276, "UnNovemDecillion"),
-        (10**273, "NovemOctogintillion"), # 10^(3*91)
-        (10**270, "OctoOctogintillion"),
-        (10**267, "SeptenOctogintillion"),
-        (10**264, "SexOctogintillion"),
-        (10**261, "QuinOctogintillion"),
-        (10**258, "QuattuorOctogintillion"),
-        (10**255, "TreOctogintillion"),
-        (10**252, "DuoOctogintillion"),
-        (10**249, "UnOctogintillion"),
-        (10**246, "Octogintillion"), # 10^(3*82)
-        (10**243, "Septuagintillion"), # 10^(3*81)
-        (10**240, "Sexagintillion"), # 10^(3*80)
-        (10**237, "Quinquagintillion"), # 10^(3*79)
-        (10**234, "Quadragintillion"), # 10^(3*78)
-        (10**231, "Trigintillion"), # 10^(3*77)
-        (10**228, "Vigintillion"), # 10^(3*76)
-        (10**225, "Decillion"), # 10^(3*75)
-        (10**222, "Nonillion"), # 10^(3*74)
-        (10**219, "Octillion"), # 10^(3*73)
-        (10**216, "Septillion"), # 10^(3*72)
-        (10**213, "Sextillion"), # 10^(3*71)
-        (10**210, "Quintillion"), # 10^(3*70)
-        (10**18, "Quintillion"), # Standard quintillion is 10^18. This was the source of error.
-        (10**15, "Quadrillion"),
-        (10**12, "Trillion"),
-        (10**9, "Billion"),
-        (10**6, "Million"),
-        (10**3, "Thousand")
-    ]
-    
-    # Re-correcting the suffixes to be standard and comprehensive:
-    # A standard list of numerical suffixes (short scale is common in US/Canada, long scale in Europe).
-    # We are using the "short scale" where each new suffix is 1000 times the previous one.
-    # 10^3 = Thousand
-    # 10^6 = Million
-    # 10^9 = Billion
-    # 10^12 = Trillion
-    # 10^15 = Quadrillion
-    # 10^18 = Quintillion
-    # 10^21 = Sextillion
-    # 10^24 = Septillion
-    # 10^27 = Octillion
-    # 10^30 = Nonillion
-    # 10^33 = Decillion
-    # ... and so on. We need to extend this systematically.
-    
-    suffixes = []
-    # Base units
-    suffixes.append((10**0, "")) # For numbers less than 1000
-    suffixes.append((10**3, "Thousand"))
-    suffixes.append((10**6, "Million"))
-    suffixes.append((10**9, "Billion"))
-    suffixes.append((10**12, "Trillion"))
-    suffixes.append((10**15, "Quadrillion"))
-    suffixes.append((10**18, "Quintillion"))
-    suffixes.append((10**21, "Sextillion"))
-    suffixes.append((10**24, "Septillion"))
-    suffixes.append((10**27, "Octillion"))
-    suffixes.append((10**30, "Nonillion"))
-    suffixes.append((10**33, "Decillion"))
-    suffixes.append((10**36, "Undecillion"))
-    suffixes.append((10**39, "Duodecillion"))
-    suffixes.append((10**42, "Tredecillion"))
-    suffixes.append((10**45, "Quattuordecillion"))
-    suffixes.append((10**48, "Quindecillion"))
-    suffixes.append((10**51, "Sexdecillion"))
-    suffixes.append((10**54, "Septendecillion"))
-    suffixes.append((10**57, "Octodecillion"))
-    suffixes.append((10**60, "Novemdecillion"))
-    suffixes.append((10**63, "Vigintillion")) # 10^3 * 21 = 10^63
-    # We can continue this pattern up to the float limit if needed.
-    # Python's float max is around 1.79e308.
-    # The suffix for 10^303 is Centillion.
-    suffixes.append((10**66, "Unvigintillion"))
-    suffixes.append((10**69, "Duovigintillion"))
-    suffixes.append((10**72, "Trevigintillion"))
-    suffixes.append((10**75, "Quattuorvigintillion"))
-    suffixes.append((10**78, "Quinvigintillion"))
-    suffixes.append((10**81, "Sexvigintillion"))
-    suffixes.append((10**84, "Septenvigintillion"))
-    suffixes.append((10**87, "Octovigintillion"))
-    suffixes.append((10**90, "Novemvigintillion"))
-    suffixes.append((10**93, "Trigintillion")) # 10^3 * 31
-    suffixes.append((10**96, "Untrigintillion"))
-    suffixes.append((10**99, "Duotrigintillion"))
-    suffixes.append((10**102, "Tretrigintillion"))
-    suffixes.append((10**105, "Quattuortrigintillion"))
-    suffixes.append((10**108, "Quinquatrigintillion"))
-    suffixes.append((10**111, "Sexatrigintillion"))
-    suffixes.append((10**114, "Septentrigintillion"))
-    suffixes.append((10**117, "Octotrigintillion"))
-    suffixes.append((10**120, "Novemtrigintillion"))
-    suffixes.append((10**123, "Quadragintillion")) # 10^3 * 41
-    suffixes.append((10**153, "Quinquagintillion")) # 10^3 * 51
-    suffixes.append((10**183, "Sexagintillion")) # 10^3 * 61
-    suffixes.append((10**213, "Septuagintillion")) # 10^3 * 71
-    suffixes.append((10**243, "Octogintillion")) # 10^3 * 81
-    suffixes.append((10**273, "Nonagintillion")) # 10^3 * 91
-    suffixes.append((10**303, "Centillion")) # 10^3 * 101
-
-    # Sort suffixes in descending order of their value (important for correct lookup)
-    suffixes.sort(key=lambda x: x[0], reverse=True)
-
-    for value, suffix in suffixes:
-        if num >= value:
-            # Round to two decimal places for the magnitude
-            # Using max(1, value) to prevent division by zero if suffix value is 0 (though it shouldn't be for non-empty suffix)
-            # Also, handle cases where num is exactly the value to avoid showing "1.00 Thousand Liters" for 1000 Liters, etc.
-            if value == 1: # For numbers less than 1000, no suffix
-                return f"{num:,.2f} {unit_str}"
+
+ADMISSION = AdmissionController(
+    cpu_budget_seconds=float(os.environ.get("WVC_ADMISSION_CPU_SECONDS", 30)),
+    memory_budget_bytes=int(float(os.environ.get("WVC_ADMISSION_MEMORY_MB", 1024)) * 2**20),
+    queue_timeout_seconds=float(os.environ.get("WVC_ADMISSION_QUEUE_SECONDS", 5)),
+    max_queued=int(os.environ.get("WVC_ADMISSION_MAX_QUEUED", 16)),
+)
+
+
+@bp.app_errorhandler(AdmissionRejected)
+def admission_rejected(error):
+    response = jsonify({"error": str(error)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+# Request coalescing. Identical requests that arrive while the same calculation or export is
+# still in flight share it instead of computing it again: whole bodies through SingleFlight.do,
+# streamed responses through a SharedStream that every identical request reads from the start.
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class _StreamReader:
+    """
+    One response's view of a SharedStream. close() is idempotent and also works before the
+    first chunk is read, so it can be registered with Response.call_on_close.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.shared.next_chunk(self)
+
+    def close(self):
+        self.shared.leave(self)
+
+
+class SharedStream:
+    """
+    Fans one generator of chunks out to any number of readers, each of which gets every chunk
+    from the start. Whichever reader is furthest ahead pulls the next chunk from the source; the
+    chunks are kept for readers that are behind. Readers can join until more than
+    max_joinable_bytes have been produced; after that, chunks every reader has passed are dropped.
+    on_close runs exactly once: when the source is exhausted or fails, or when the last reader
+    leaves before that, in which case the source is closed.
+    """
+
+    def __init__(self, source, on_close=None, max_joinable_bytes=0):
+        self.source = source
+        self.on_close = on_close
+        self.max_joinable_bytes = max_joinable_bytes
+        self.lock = threading.Lock()
+        self.chunks = []
+        self.first = 0
+        self.produced_bytes = 0
+        self.positions = {}
+        self.finished = False
+        self.error = None
+        self.closed = False
+
+    def join(self):
+        """
+        Returns a new reader positioned at the first chunk, or None if the stream can no longer be joined.
+        """
+        with self.lock:
+            if (self.closed and not self.finished) or self.first > 0 or self.produced_bytes > self.max_joinable_bytes:
+                return None
+            reader = _StreamReader(self)
+            self.positions[reader] = 0
+            return reader
+
+    def next_chunk(self, reader):
+        with self.lock:
+            index = self.positions.get(reader)
+            if index is None:
+                raise StopIteration
+            if index - self.first == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                if self.finished:
+                    raise StopIteration
+                try:
+                    chunk = next(self.source)
+                except StopIteration:
+                    self.finished = True
+                    self._close()
+                    raise
+                except Exception as e:
+                    self.error = e
+                    self._close()
+                    raise
+                self.chunks.append(chunk)
+                self.produced_bytes += len(chunk)
+            chunk = self.chunks[index - self.first]
+            self.positions[reader] = index + 1
+            self._trim()
+            return chunk
+
+    def leave(self, reader):
+        with self.lock:
+            if self.positions.pop(reader, None) is None:
+                return
+            if not self.positions and not self.finished and self.error is None:
+                self._close()
+            self._trim()
+
+    def _trim(self):
+        if self.produced_bytes <= self.max_joinable_bytes or not self.positions:
+            return
+        passed = min(self.positions.values()) - self.first
+        if passed > 0:
+            del self.chunks[:passed]
+            self.first += passed
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.finished and self.error is None:
+            self.source.close()
+        if self.on_close is not None:
+            self.on_close()
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight work within a worker process, keyed by normalized cache keys.
+    do() runs compute once for any number of concurrent callers with the same key, and every
+    caller gets the same value or the same exception. stream() does the same for streamed
+    responses through SharedStream.
+
+    With lock_dir set, computations are also coordinated across worker processes: the caller that
+    computes first takes an exclusive flock on one of lock_stripes lock files chosen by the key,
+    and a caller in another worker that has to wait for that lock calls recheck (typically a
+    shared-cache lookup) before computing itself. Threads of one worker take turns on a stripe
+    under a per-process lock first, so the flock only ever waits for other workers. Callers pass
+    across_workers=False for results that could not be shared (e.g. too large to cache), which
+    are then computed at once instead of waiting for another worker only to compute them again.
+    """
+
+    def __init__(self, lock_dir=None, lock_stripes=256):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.lock_stripes = lock_stripes
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.streams = {}
+        self.computed = 0
+        self.coalesced = 0
+        self.streams_started = 0
+        self.streams_coalesced = 0
+        self.cross_worker_waits = 0
+        self.cross_worker_hits = 0
+        self.stripe_locks = None
+        if self.lock_dir is not None:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            self.stripe_locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    def do(self, key, compute, recheck=None, across_workers=True):
+        """
+        Returns compute() for key, sharing one call among concurrent callers with the same key.
+        """
+        with self.lock:
+            flight = self.calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.calls[key] = _Flight()
+                self.computed += 1
             else:
-                rounded_num = round(num / value, 2)
-                return f"{rounded_num:,.2f} {suffix} {unit_str}"
-
-    return f"{num:,.2f} {unit_str}" # Fallback for very small numbers (should be caught by num < 1) or if list exhausted
-
-
-def describe_volume(volume_liters):
-    """
-    Compares the given volume in liters to known water body volumes and celestial bodies
-    and returns a descriptive string.
-    """
-    if volume_liters <= 0:
-        return "No volume or invalid volume."
-    if volume_liters == float('inf'):
-        return "This volume is astronomically large, far exceeding all known water bodies and even the largest planets in our solar system."
-
-    # First check water bodies
-    for description, limits in WATER_BODY_VOLUMES.items():
-        if limits["min"] <= volume_liters < limits["max"]:
-            return f"This volume could fill {description}."
-    
-    # Then check planets
-    if volume_liters < PLANET_VOLUMES["Planet Mars"]:
-        return "This volume is larger than all Earth's oceans, but less than the volume of Planet Mars."
-    elif volume_liters < PLANET_VOLUMES["Planet Earth"]:
-        # Calculate percentage of Mars's volume
-        percentage_of_mars = (volume_liters / PLANET_VOLUMES['Planet Mars']) * 100
-        return f"This volume could fill approximately {percentage_of_mars:.2f}% of Planet Mars's volume."
-    elif volume_liters < PLANET_VOLUMES["Planet Jupiter"]:
-        # Calculate percentage of Earth's volume
-        percentage_of_earth = (volume_liters / PLANET_VOLUMES['Planet Earth']) * 100
-        return f"This volume could fill approximately {percentage_of_earth:.2f}% of Planet Earth's volume."
-    else:
-        # Calculate percentage of Jupiter's volume
-        percentage_of_jupiter = (volume_liters / PLANET_VOLUMES['Planet Jupiter']) * 100
-        return f"This volume could fill approximately {percentage_of_jupiter:.2f}% of Planet Jupiter's volume (or even more)!"
-
-
-def calculate_time_to_fill(current_volume, target_volume, rate_per_unit_time_liters, unit_time):
-    """
-    Calculates the estimated time to fill a target volume given a current volume and a rate.
-    Returns a formatted string or "N/A" if not applicable or calculation is impossible.
-    """
-    if current_volume >= target_volume:
-        return "Already filled or exceeded."
-    if rate_per_unit_time_liters <= 0:
-        return "Rate must be positive."
-    if target_volume == float('inf') or current_volume == float('inf'):
-        return "N/A (Target or current volume is infinite)"
-
-    remaining_volume = target_volume - current_volume
-    if remaining_volume <= 0:
-        return "Already filled or exceeded."
-
-    time_units = remaining_volume / rate_per_unit_time_liters
-
-    if unit_time == "second":
-        # Convert seconds to more readable units
-        if time_units < 60:
-            return f"~{time_units:.2f} seconds"
-        elif time_units < 3600:
-            return f"~{time_units / 60:.2f} minutes"
-        elif time_units < 86400:
-            return f"~{time_units / 3600:.2f} hours"
-        elif time_units < 31536000: # seconds in a year
-            return f"~{time_units / 86400:.2f} days"
-        else:
-            return f"~{time_units / 31536000:.2f} years"
-    elif unit_time == "minute":
-        if time_units < 60:
-            return f"~{time_units:.2f} minutes"
-        elif time_units < 1440:
-            return f"~{time_units / 60:.2f} hours"
-        elif time_units < 525600:
-            return f"~{time_units / 1440:.2f} days"
-        else:
-            return f"~{time_units / 525600:.2f} years"
-    elif unit_time == "hour":
-        if time_units < 24:
-            return f"~{time_units:.2f} hours"
-        elif time_units < 8760: # hours in a year
-            return f"~{time_units / 24:.2f} days"
-        else:
-            return f"~{time_units / 8760:.2f} years"
-    elif unit_time == "day":
-        if time_units < 365:
-            return f"~{time_units:.2f} days"
-        else:
-            return f"~{time_units / 365:.2f} years"
-    elif unit_time == "year":
-        return f"~{time_units:.2f} years"
-    else:
-        return "N/A (Invalid time unit)"
+                self.coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            if across_workers:
+                flight.value = self._compute_across_workers(key, compute, recheck)
+            else:
+                flight.value = compute()
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            flight.event.set()
+
+    def _compute_across_workers(self, key, compute, recheck):
+        if self.lock_dir is None:
+            return compute()
+        stripe = int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:8], 16) % self.lock_stripes
+        # flock locks belong to the open file, so two threads of this worker would block each
+        # other on it as if they were different workers
+        with self.stripe_locks[stripe], open(os.path.join(self.lock_dir, f"flight-{stripe:03d}.lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker holds this stripe; once it is done the result may already be shared
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                with self.lock:
+                    self.cross_worker_waits += 1
+                value = recheck() if recheck is not None else None
+                if value is not None:
+                    with self.lock:
+                        self.cross_worker_hits += 1
+                    return value
+            # The lock is released when the file is closed
+            return compute()
+
+    def stream(self, key, open_stream):
+        """
+        Returns a reader for the stream with the given key: a new reader of an identical stream
+        already in flight if it can still be joined, or else the first reader of open_stream(),
+        a new SharedStream. The key is claimed before open_stream() runs (it may wait for
+        admission), so identical requests arriving meanwhile wait for that stream and join it,
+        or get the error it failed to open with, instead of each opening their own.
+        """
+        while True:
+            with self.lock:
+                entry = self.streams.get(key)
+                if entry is None:
+                    opening = self.streams[key] = _Flight()
+                    break
+            if isinstance(entry, _Flight):
+                entry.event.wait()
+                if entry.error is not None:
+                    with self.lock:
+                        self.streams_coalesced += 1
+                    raise entry.error
+                shared = entry.value
+            else:
+                shared = entry
+            reader = shared.join()
+            if reader is not None:
+                with self.lock:
+                    self.streams_coalesced += 1
+                return reader
+            # Too far along to join: start a new stream, unless another caller already has
+            with self.lock:
+                if self.streams.get(key) in (entry, shared):
+                    opening = self.streams[key] = _Flight()
+                    break
+
+        try:
+            shared = open_stream()
+        except BaseException as e:
+            opening.error = e
+            with self.lock:
+                if self.streams.get(key) is opening:
+                    del self.streams[key]
+            opening.event.set()
+            raise
+        on_close = shared.on_close
+
+        def forget():
+            with self.lock:
+                if self.streams.get(key) is shared:
+                    del self.streams[key]
+            if on_close is not None:
+                on_close()
+        shared.on_close = forget
+        reader = shared.join()
+        with self.lock:
+            if self.streams.get(key) is opening:
+                self.streams[key] = shared
+            self.streams_started += 1
+        opening.value = shared
+        opening.event.set()
+        return reader
+
+    def stats(self):
+        with self.lock:
+            return {
+                "computed": self.computed,
+                "coalesced": self.coalesced,
+                "streams_started": self.streams_started,
+                "streams_coalesced": self.streams_coalesced,
+                "cross_worker": self.lock_dir is not None,
+                "cross_worker_waits": self.cross_worker_waits,
+                "cross_worker_hits": self.cross_worker_hits,
+                "deduplicated": self.coalesced + self.streams_coalesced + self.cross_worker_hits,
+                "in_flight": len(self.calls),
+                "streams_in_flight": len(self.streams),
+            }
+
+
+SINGLE_FLIGHT = SingleFlight(lock_dir=os.environ.get("WVC_SINGLE_FLIGHT_LOCK_DIR") or None)
 
 
-def perform_calculation(initial_volume_str, unit, iterations_str, time_rate_liters_per_unit=None, time_unit=None):
+def _shared_stream(key, cost, make_chunks):
     """
-    Performs the water volume compounding calculation.
-    Returns a list of dictionaries with results or raises ValueError for invalid input.
-    Includes raw volume for charting (even if not used on frontend, kept for consistency/future).
+    Returns a reader for a streamed response: joins an identical stream already in flight, or
+    admits cost and starts a new SharedStream of make_chunks(), holding the admission until the
+    stream finishes or is abandoned. The caller must register reader.close with the response.
     """
+    def open_stream():
+        ticket = ADMISSION.admit(cost)
+        try:
+            return SharedStream(make_chunks(), on_close=ticket.release, max_joinable_bytes=RESULT_CACHE.max_entry_bytes)
+        except BaseException:
+            ticket.release()
+            raise
+    return SINGLE_FLIGHT.stream(key, open_stream)
+
+
+# Request timing. Each request records its stage timings (see metrics.py) and gets them back as a
+# Server-Timing header; its latency, status and body size go to the /metrics counters. For
+# streamed responses the header and latency cover the time to the first byte, while the stages
+# computed as the body is sent still reach the histograms.
+
+
+@bp.before_app_request
+def _start_request_timing():
+    request.environ["wvc.request_start"] = time.perf_counter()
+    start_request_timings()
+
+
+def _count_streamed_bytes(chunks, labels):
+    sent = 0
     try:
-        initial_volume = float(initial_volume_str)
-        iterations = int(iterations_str)
-
-        if initial_volume <= 0 or iterations <= 0:
-            raise ValueError("Initial volume and iterations must be positive numbers.")
-        if iterations > 100:
-            raise ValueError("Number of iterations cannot exceed 100 to prevent performance issues and ensure reasonable output.")
-
-        # Convert initial volume to liters
-        if unit == 'gallons':
-            initial_volume_liters = initial_volume * GALLONS_TO_LITERS
-        else: # litres
-            initial_volume_liters = initial_volume
-
-        results = []
-        current_volume_liters_raw = 0
-
-        # Max float value for `sys.float_info.max` is approx 1.797e+308
-        MAX_FLOAT_HALF = sys.float_info.max / 2
-
-        # First iteration: initial_volume * initial_volume
-        if iterations >= 1:
-            if initial_volume_liters == 0:
-                current_volume_liters_raw = 0
-            elif abs(initial_volume_liters) > math.sqrt(sys.float_info.max):
-                current_volume_liters_raw = float('inf')
-            else:
-                current_volume_liters_raw = initial_volume_liters * initial_volume_liters
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        METRICS.increment("response_bytes_total", labels, sent)
+        if hasattr(chunks, "close"):
+            chunks.close()
 
-            time_to_fill_str = "N/A"
-            if time_rate_liters_per_unit and time_unit:
-                try:
-                    rate_val = float(time_rate_liters_per_unit)
-                    target_fill_volume = 0
-                    if current_volume_liters_raw < WATER_BODY_VOLUMES["a small pond"]["max"]:
-                        target_fill_volume = WATER_BODY_VOLUMES["a small pond"]["max"]
-                    elif current_volume_liters_raw < WATER_BODY_VOLUMES["a large pond or a small lake"]["max"]:
-                        target_fill_volume = WATER_BODY_VOLUMES["a large pond or a small lake"]["max"]
-                    elif current_volume_liters_raw < WATER_BODY_VOLUMES["a medium-sized lake"]["max"]:
-                        target_fill_volume = WATER_BODY_VOLUMES["a medium-sized lake"]["max"]
-                    elif current_volume_liters_raw < WATER_BODY_VOLUMES["a large lake (e.g., Lake Tahoe)"]["max"]:
-                        target_fill_volume = WATER_BODY_VOLUMES["a large lake (e.g., Lake Tahoe)"]["max"]
-                    elif current_volume_liters_raw < WATER_BODY_VOLUMES["a Great Lake (e.g., Lake Superior)"]["max"]:
-                        target_fill_volume = WATER_BODY_VOLUMES["a Great Lake (e.g., Lake Superior)"]["max"]
-                    elif current_volume_liters_raw < WATER_BODY_VOLUMES["an entire sea (e.g., Mediterranean Sea)"]["max"]:
-                        target_fill_volume = WATER_BODY_VOLUMES["an entire sea (e.g., Mediterranean Sea)"]["max"]
-                    elif current_volume_liters_raw < WATER_BODY_VOLUMES["an entire ocean (e.g., Pacific Ocean)"]["max"]:
-                        target_fill_volume = WATER_BODY_VOLUMES["an entire ocean (e.g., Pacific Ocean)"]["max"]
-                    elif current_volume_liters_raw < PLANET_VOLUMES["Planet Mars"]:
-                        target_fill_volume = PLANET_VOLUMES["Planet Mars"]
-                    elif current_volume_liters_raw < PLANET_VOLUMES["Planet Earth"]:
-                        target_fill_volume = PLANET_VOLUMES["Planet Earth"]
-                    elif current_volume_liters_raw < PLANET_VOLUMES["Planet Jupiter"]:
-                        target_fill_volume = PLANET_VOLUMES["Planet Jupiter"]
-
-                    if target_fill_volume > 0 and current_volume_liters_raw != float('inf'):
-                         time_to_fill_str = calculate_time_to_fill(current_volume_liters_raw, target_fill_volume, rate_val, time_unit)
-                except ValueError:
-                    time_to_fill_str = "Invalid rate"
-
-
-            results.append({
-                "iteration": 1,
-                "volume_liters_raw": current_volume_liters_raw, # Kept for potential future use or debugging
-                "volume_liters": format_large_number_spoken(current_volume_liters_raw, "Liters"),
-                "volume_gallons": format_large_number_spoken(current_volume_liters_raw / GALLONS_TO_LITERS, "Gallons") if current_volume_liters_raw != float('inf') else "Infinity",
-                "description": describe_volume(current_volume_liters_raw),
-                "time_to_fill": time_to_fill_str
-            })
-
-        # Subsequent iterations: compound by 100% (multiply by 2)
-        for i in range(2, iterations + 1):
-            if current_volume_liters_raw == float('inf'): # Once it's infinity, it stays infinity
-                results.append({
-                    "iteration": i,
-                    "volume_liters_raw": float('inf'),
-                    "volume_liters": "Infinity",
-                    "volume_gallons": "Infinity",
-                    "description": describe_volume(float('inf')),
-                    "time_to_fill": "N/A"
-                })
-                continue
-
-            # Check for potential overflow before multiplying by 2
-            if current_volume_liters_raw > MAX_FLOAT_HALF:
-                current_volume_liters_raw = float('inf')
+
+@bp.after_app_request
+def _record_request_timing(response):
+    timings = request_timings()
+    started = request.environ.get("wvc.request_start")
+    if timings is None or started is None or not METRICS.enabled:
+        return response
+    elapsed = time.perf_counter() - started
+    labels = (("endpoint", request.endpoint or "unknown"),)
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    METRICS.observe("request_seconds", labels, elapsed)
+    METRICS.increment("requests_total", labels + (("status", str(response.status_code)),))
+    if not response.is_streamed:
+        METRICS.increment("response_bytes_total", labels, response.content_length or 0)
+    elif not response.direct_passthrough:
+        response.response = _count_streamed_bytes(response.response, labels)
+    return response
+
+
+# Memory profiling (see profiling.py). Off unless MEMORY_PROFILING (WVC_MEMORY_PROFILING) is
+# "header", which profiles requests sent with an "X-Memory-Profile: 1" header, or "all". A profile
+# covers the request and its whole response body, so it ends when the response is closed. The
+# response carries the report's ID in X-Memory-Profile-Id; the report is logged and served by
+# /memory_profiles/<id> on the worker that handled the request. A request that arrives while
+# another one is being profiled in the same worker is not profiled.
+MEMORY_PROFILING_MODES = ("off", "header", "all")
+MEMORY_PROFILE_HEADER = "X-Memory-Profile"
+# Debug routes that are never profiled themselves
+UNPROFILED_ENDPOINTS = {"compounder.memory_profiles", "compounder.memory_profile"}
+
+
+def _memory_profile_requested():
+    mode = current_app.config["MEMORY_PROFILING"]
+    if mode == "header":
+        return request.headers.get(MEMORY_PROFILE_HEADER) == "1"
+    return mode == "all"
+
+
+@bp.before_app_request
+def _start_memory_profile():
+    if request.endpoint in UNPROFILED_ENDPOINTS or not _memory_profile_requested():
+        return
+    profile = PROFILER.start(f"{request.method} {request.path}")
+    if profile is not None:
+        request.environ["wvc.memory_profile"] = profile
+
+
+def _finish_memory_profile(profile):
+    logger.info(format_report(PROFILER.finish(profile)))
+
+
+@bp.after_app_request
+def _attach_memory_profile(response):
+    profile = request.environ.pop("wvc.memory_profile", None)
+    if profile is not None:
+        response.headers[f"{MEMORY_PROFILE_HEADER}-Id"] = profile.id
+        response.call_on_close(lambda: _finish_memory_profile(profile))
+    return response
+
+
+@bp.teardown_app_request
+def _abandon_memory_profile(exc):
+    # Only left here when no response was made (an unhandled exception)
+    profile = request.environ.pop("wvc.memory_profile", None)
+    if profile is not None:
+        _finish_memory_profile(profile)
+
+
+# max-age (seconds) sent with cacheable GET API responses
+API_CACHE_MAX_AGE = int(os.environ.get("WVC_API_CACHE_MAX_AGE", 86400))
+
+
+# Response layouts: a list of row objects, or one array per field
+RESULT_FORMATS = ("rows", "columnar")
+
+
+def _result_format(values):
+    """
+    Returns the requested response layout from the format field, "rows" by default.
+    """
+    result_format = values.get('format') or 'rows'
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"Unknown format '{result_format}'. Use one of: {', '.join(RESULT_FORMATS)}.")
+    return result_format
+
+
+def columnar_payload(columns):
+    """
+    Wraps columnar results for a response: the field order (JSON objects are sent with sorted
+    keys), the number of rows and one array per field.
+    """
+    return {
+        "fields": list(columns),
+        "length": len(columns["iteration"]),
+        "columns": columns,
+    }
+
+
+def _calculation_kind(result_format):
+    return "calculate" if result_format == "rows" else f"calculate_{result_format}"
+
+
+def calculation_etag(inputs, result_format="rows"):
+    """
+    Returns the strong ETag for a calculation: a hash of its normalized cache key,
+    which already includes CALCULATION_VERSION.
+    """
+    return hashlib.sha256(calculation_cache_key(_calculation_kind(result_format), inputs).encode('utf-8')).hexdigest()[:32]
+
+
+def _calculation_body(inputs, result_format="rows"):
+    """
+    Returns the JSON body for a validated calculation, from RESULT_CACHE when possible.
+    Cache misses are coalesced with identical calculations in flight and admitted against
+    ADMISSION first.
+    """
+    cache_key = calculation_cache_key(_calculation_kind(result_format), inputs)
+    body = RESULT_CACHE.get(cache_key)
+    if body is not None:
+        return body
+
+    def compute():
+        columnar = result_format == "columnar"
+        with ADMISSION.admit(estimate_calculation_cost(inputs, result_format)):
+            results = perform_calculation(
+                inputs.initial_volume, inputs.unit, inputs.iterations, inputs.time_rate_liters_per_unit, inputs.time_unit, inputs.magnitude, inputs.fields,
+                columnar=columnar, rule=inputs.rule.text if inputs.rule else None,
+            )
+            with stage("serialize"):
+                body = jsonify(columnar_payload(results) if columnar else results).get_data()
+        RESULT_CACHE.set(cache_key, body)
+        return body
+    # A body too large to cache could not be handed to another worker through the shared cache
+    shareable = estimate_body_bytes(inputs) <= RESULT_CACHE.max_entry_bytes
+    return SINGLE_FLIGHT.do(cache_key, compute, recheck=lambda: RESULT_CACHE.get(cache_key), across_workers=shareable)
+
+
+def _cache_stream(chunks, key):
+    """
+    Passes export chunks through unchanged and stores the complete file in RESULT_CACHE
+    once the stream finishes, unless it grows past the per-entry limit.
+    """
+    collected = []
+    size = 0
+    for chunk in chunks:
+        if collected is not None:
+            size += len(chunk)
+            if size <= RESULT_CACHE.max_entry_bytes:
+                collected.append(chunk)
             else:
-                current_volume_liters_raw *= 2 # 100% increase means multiplying by 2
+                collected = None
+        yield chunk
+    if collected is not None:
+        RESULT_CACHE.set(key, b"".join(collected))
 
-            time_to_fill_str = "N/A"
-            if time_rate_liters_per_unit and time_unit:
-                try:
-                    rate_val = float(time_rate_liters_per_unit)
-                    target_fill_volume = 0
-                    
-                    # Determine target for time_to_fill based on current volume
-                    if current_volume_liters_raw != float('inf'):
-                        # Find the next water body/planet volume that is larger than current_volume_liters_raw
-                        sorted_comparison_targets = sorted(
-                            list(WATER_BODY_VOLUMES.values()) + list(map(lambda v: {"max": v}, PLANET_VOLUMES.values())),
-                            key=lambda x: x["max"]
-                        )
-                        for target in sorted_comparison_targets:
-                            if current_volume_liters_raw < target["max"]:
-                                target_fill_volume = target["max"]
-                                break
-                    
-                    if target_fill_volume > 0 and current_volume_liters_raw < target_fill_volume:
-                        time_to_fill_str = calculate_time_to_fill(current_volume_liters_raw, target_fill_volume, rate_val, time_unit)
-                except ValueError:
-                    time_to_fill_str = "Invalid rate"
-
-
-            results.append({
-                "iteration": i,
-                "volume_liters_raw": current_volume_liters_raw,
-                "volume_liters": format_large_number_spoken(current_volume_liters_raw, "Liters"),
-                "volume_gallons": format_large_number_spoken(current_volume_liters_raw / GALLONS_TO_LITERS, "Gallons") if current_volume_liters_raw != float('inf') else "Infinity",
-                "description": describe_volume(current_volume_liters_raw),
-                "time_to_fill": time_to_fill_str
-            })
-        return results
 
-    except ValueError as e:
-        raise e
-    except Exception as e:
-        app.logger.error(f"An unexpected error occurred during calculation: {e}", exc_info=True)
-        raise Exception("An internal error occurred during calculation.")
+# Streaming rows start with a small chunk so the first rows arrive quickly, then grow to the regular size.
+NDJSON_FIRST_CHUNK_SIZE = 64
+
+
+def _wants_ndjson():
+    """
+    True when the client asked for a streamed NDJSON response, either with an
+    Accept: application/x-ndjson header or a stream=ndjson form field.
+    """
+    if request.values.get('stream') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+
+def stream_ndjson_rows(inputs, dumps):
+    """
+    Yields the rows of a validated calculation as newline-delimited JSON, one encoded block
+    per computed chunk, encoding each row with dumps (the app's JSON encoder, taken while the
+    request is active, as the body is sent after it). The first block is small so
+    time-to-first-row does not depend on the number of iterations.
+    """
+    start, stop = 0, min(NDJSON_FIRST_CHUNK_SIZE, inputs.iterations)
+    while start < inputs.iterations:
+        rows = calculate_rows(inputs, start, stop)
+        with stage("serialize"):
+            block = "".join(dumps(row) + "\n" for row in rows).encode('utf-8')
+        yield block
+        start, stop = stop, min(stop + CALCULATION_CHUNK_SIZE, inputs.iterations)
 
 
-@app.route('/')
+def _ndjson_response(inputs):
+    cache_key = calculation_cache_key("calculate_ndjson", inputs)
+    cached_body = RESULT_CACHE.get(cache_key)
+    if cached_body is not None:
+        return Response(cached_body, mimetype='application/x-ndjson')
+    dumps = current_app.json.dumps
+
+    def generate(chunks):
+        try:
+            yield from chunks
+        except Exception as e:
+            # The status code is already sent, so report the failure as a final NDJSON line
+            logger.error(f"An unexpected error occurred while streaming results: {e}", exc_info=True)
+            yield (dumps({"error": "An internal error occurred during calculation."}) + "\n").encode('utf-8')
+
+    reader = _shared_stream(cache_key, estimate_calculation_cost(inputs, "ndjson"), lambda: _cache_stream(stream_ndjson_rows(inputs, dumps), cache_key))
+    response = Response(generate(reader), mimetype='application/x-ndjson')
+    response.call_on_close(reader.close)
+    return response
+
+
+@bp.route('/')
 def index():
     """Renders the main page of the application."""
     # No longer passing comparison_lines_json as charts are removed
-    return render_template('index.html')
+    return render_template('index.html', parquet_available=PARQUET_AVAILABLE)
 
-@app.route('/calculate', methods=['POST'])
+@bp.route('/calculate', methods=['POST'])
 def calculate_volume():
     """
     Handles the calculation of compounded water volume based on user input.
-    Returns results as JSON.
+    Returns results as JSON: a list of rows, or with format=columnar one array per field.
     """
     initial_volume = request.form['initial_volume']
     unit = request.form['unit']
     iterations = request.form['iterations']
     time_rate_liters_per_unit = request.form.get('time_rate')
     time_unit = request.form.get('time_unit')
+    magnitude = request.form.get('magnitude') or 'float'
+    fields = request.form.get('fields')
+    rule = request.form.get('rule')
+    growth_percent = request.form.get('growth_percent')
 
     try:
-        results = perform_calculation(initial_volume, unit, iterations, time_rate_liters_per_unit, time_unit)
-        return jsonify(results)
+        inputs = parse_calculation_inputs(initial_volume, unit, iterations, time_rate_liters_per_unit, time_unit, magnitude, fields=fields, rule=rule, growth_percent=growth_percent)
+        result_format = _result_format(request.form)
+        if result_format == "rows" and _wants_ndjson():
+            return _ndjson_response(inputs)
+        return Response(_calculation_body(inputs, result_format), mimetype='application/json')
+    except AdmissionRejected:
+        raise
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/export_excel', methods=['POST'])
-def export_excel():
+def _inputs_from_args(args, max_iterations=None):
+    return parse_calculation_inputs(
+        args.get('initial_volume', ''),
+        args.get('unit', 'litres'),
+        args.get('iterations', ''),
+        args.get('time_rate'),
+        args.get('time_unit'),
+        args.get('magnitude') or 'float',
+        max_iterations=max_iterations,
+        fields=args.get('fields'),
+        rule=args.get('rule'),
+        growth_percent=args.get('growth_percent'),
+    )
+
+
+def _cacheable_json_response(etag, make_body):
     """
-    Exports the calculation results to an Excel file.
+    Builds a response for an idempotent GET API: answers If-None-Match with 304 before
+    calling make_body, and marks the response public with a strong ETag.
     """
-    initial_volume = request.form['initial_volume_excel']
-    unit = request.form['unit_excel']
-    iterations = request.form['iterations_excel']
-    time_rate_liters_per_unit = request.form.get('time_rate_excel')
-    time_unit = request.form.get('time_unit_excel')
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            response = Response(make_body(), mimetype='application/json')
+        except AdmissionRejected:
+            raise
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = API_CACHE_MAX_AGE
+    return response
 
 
-    try:
-        results = perform_calculation(initial_volume, unit, iterations, time_rate_liters_per_unit, time_unit)
-
-        # Create a Pandas DataFrame
-        df = pd.DataFrame(results)
-        
-        # Rename columns for better Excel readability
-        df.rename(columns={
-            'iteration': 'Iteration',
-            'volume_liters': 'Volume (Litres)',
-            'volume_gallons': 'Volume (Gallons)',
-            'description': 'Comparison',
-            'time_to_fill': 'Time to Fill (Estimate)'
-        }, inplace=True)
-
-        # Drop the raw volume column before export - this is correct for Excel
-        df.drop(columns=['volume_liters_raw'], inplace=True)
-
-        # Create an in-memory BytesIO object to save the Excel file
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Water Volume Compounding')
-        output.seek(0) # Go to the beginning of the stream
-
-        return send_file(output, as_attachment=True, download_name='water_volume_compounding_results.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+def estimate_batch_cost(scenarios):
+    """
+    Sums the estimated costs of a batch's scenarios. Scenarios that fail validation cost nothing,
+    as they only produce an error entry.
+    """
+    cpu_seconds = memory_bytes = 0
+    for scenario in scenarios:
+        try:
+            inputs = _inputs_from_args(scenario)
+        except (AttributeError, TypeError, ValueError):
+            continue
+        cost = estimate_calculation_cost(inputs)
+        cpu_seconds += cost.cpu_seconds
+        memory_bytes += cost.memory_bytes
+    return CalculationCost(cpu_seconds, memory_bytes)
+
+
+@bp.route('/calculate_batch', methods=['POST'])
+def calculate_batch():
+    """
+    Calculates many scenarios in one request. Accepts a JSON list of scenario objects
+    (or {"scenarios": [...]}) or a CSV body with a header row using the /calculate field names.
+    Returns {"scenarios": [...]} aligned with the input, each entry holding either
+    "results" or a per-scenario "error".
+    """
+    if request.mimetype == 'text/csv':
+        scenarios = list(csv.DictReader(StringIO(request.get_data(as_text=True))))
+    else:
+        payload = request.get_json(silent=True)
+        scenarios = payload.get('scenarios') if isinstance(payload, dict) else payload
+
+    if not isinstance(scenarios, list):
+        return jsonify({"error": "Send a JSON list of scenarios (or {\"scenarios\": [...]}) or a CSV body with a header row."}), 400
+    if len(scenarios) > MAX_BATCH_SCENARIOS:
+        return jsonify({"error": f"A batch cannot contain more than {MAX_BATCH_SCENARIOS:,} scenarios."}), 400
 
+    try:
+        with ADMISSION.admit(estimate_batch_cost(scenarios)):
+            outcomes = perform_batch_calculation(scenarios)
+            with stage("serialize"):
+                return jsonify({"scenarios": outcomes})
+    except AdmissionRejected:
+        raise
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        app.logger.error(f"An unexpected error occurred during Excel export: {e}", exc_info=True)
-        return jsonify({"error": "An internal server error occurred during export. Please try again later."}), 500
+        logger.error(f"An unexpected error occurred during batch calculation: {e}", exc_info=True)
+        return jsonify({"error": "An internal error occurred during calculation."}), 500
+
+
+@bp.route('/api/calculate', methods=['GET'])
+def api_calculate():
+    """
+    Idempotent GET form of /calculate taking the same fields as query parameters.
+    The output is a pure function of the inputs, so responses carry a strong ETag derived
+    from the normalized inputs and a long-lived Cache-Control header; conditional requests
+    are answered with 304 before any calculation runs.
+    """
+    try:
+        inputs = _inputs_from_args(request.args)
+        result_format = _result_format(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return _cacheable_json_response(calculation_etag(inputs, result_format), lambda: _calculation_body(inputs, result_format))
+
+
+@bp.route('/api/calculate_window', methods=['GET'])
+def api_calculate_window():
+    """
+    Returns rows offset+1..offset+limit of a series without computing the rows before them,
+    since every iteration has a closed form. Server cost depends only on limit, which is
+    what lets index.html page through very large series. With format=columnar the window
+    carries "fields", "length" and "columns" instead of "rows".
+    """
+    try:
+        inputs = _inputs_from_args(request.args, max_iterations=MAX_WINDOWED_ITERATIONS)
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', WINDOW_DEFAULT_LIMIT))
+        if offset < 0 or limit <= 0:
+            raise ValueError("Offset must not be negative and limit must be positive.")
+        if limit > WINDOW_MAX_LIMIT:
+            raise ValueError(f"Limit cannot exceed {WINDOW_MAX_LIMIT:,} rows per window.")
+        result_format = _result_format(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    stop = min(offset + limit, inputs.iterations)
+    window_key = f"{calculation_cache_key('window', inputs)}|{offset}|{stop}|{result_format}"
+
+    def compute():
+        window = {"total_iterations": inputs.iterations, "offset": offset, "limit": limit}
+        with ADMISSION.admit(estimate_calculation_cost(inputs, result_format, offset, stop)):
+            if result_format == "columnar":
+                columns = calculate_columns(inputs, offset, stop) if offset < stop else {field: [] for field in row_fields(inputs)}
+                window.update(columnar_payload(columns))
+            else:
+                window["rows"] = calculate_rows(inputs, offset, stop) if offset < stop else []
+            with stage("serialize"):
+                body = jsonify(window).get_data()
+        RESULT_CACHE.set(window_key, body)
+        return body
+
+    def make_body():
+        body = RESULT_CACHE.get(window_key)
+        if body is None:
+            shareable = estimate_body_bytes(inputs, offset, stop) <= RESULT_CACHE.max_entry_bytes
+            body = SINGLE_FLIGHT.do(window_key, compute, recheck=lambda: RESULT_CACHE.get(window_key), across_workers=shareable)
+        return body
+
+    etag = hashlib.sha256(window_key.encode('utf-8')).hexdigest()[:32]
+    return _cacheable_json_response(etag, make_body)
+
+
+@bp.route('/api/milestones', methods=['GET'])
+def api_milestones():
+    """
+    Returns, for every water body and planet, the first iteration that reaches its volume and,
+    when time_rate and time_unit are given, the time to fill it at that rate. Takes
+    initial_volume and unit as query parameters.
+    """
+    try:
+        initial_volume = float(request.args.get('initial_volume', ''))
+        if initial_volume <= 0:
+            raise ValueError("Initial volume must be a positive number.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    unit = 'gallons' if request.args.get('unit') == 'gallons' else 'litres'
+    initial_volume_liters = initial_volume * GALLONS_TO_LITERS if unit == 'gallons' else initial_volume
+    time_rate_liters_per_unit = request.args.get('time_rate')
+    time_unit = request.args.get('time_unit')
+
+    milestone_key = "|".join(["milestones", CALCULATION_VERSION, repr(initial_volume), unit, str(time_rate_liters_per_unit), str(time_unit)])
+
+    def make_body():
+        return jsonify({
+            "initial_volume_liters": initial_volume_liters,
+            "milestones": find_milestones(initial_volume_liters, time_rate_liters_per_unit, time_unit),
+        }).get_data()
+
+    return _cacheable_json_response(hashlib.sha256(milestone_key.encode('utf-8')).hexdigest()[:32], make_body)
+
+
+@bp.route('/api/fill_times', methods=['GET'])
+def api_fill_times():
+    """
+    Returns the numeric seconds to fill every water body and planet from every iteration's
+    volume, as an iterations × references matrix (null where a body is already filled).
+    Takes the /api/calculate query parameters; time_rate and time_unit are required.
+    Nothing is formatted, so charting clients get the whole matrix in one vectorized pass.
+    """
+    try:
+        inputs = _inputs_from_args(request.args)
+        rate, rate_error = parse_fill_rate(inputs.time_rate_liters_per_unit, inputs.time_unit)
+        if rate_error or rate is None or inputs.time_unit not in TIME_UNIT_SECONDS:
+            raise ValueError(f"A numeric time_rate and a time_unit ({', '.join(TIME_UNIT_SECONDS)}) are required.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def compute():
+        with ADMISSION.admit(estimate_fill_times_cost(inputs)):
+            volumes = volume_series(inputs, inputs.iterations)
+            with stage("fill_time"):
+                seconds = fill_time_matrix(volumes, rate, inputs.time_unit)
+            with stage("serialize"):
+                return jsonify({
+                    "time_unit": inputs.time_unit,
+                    "references": [
+                        {"name": name, "kind": kind, "volume_liters": volume}
+                        for name, kind, volume in zip(REFERENCE_INDEX.reference_names, REFERENCE_INDEX.reference_kinds, REFERENCE_INDEX.reference_volumes.tolist())
+                    ],
+                    "iterations": list(range(1, inputs.iterations + 1)),
+                    "seconds": np.where(np.isnan(seconds), None, seconds).tolist(),
+                }).get_data()
+
+    fill_times_key = calculation_cache_key("fill_times", inputs)
+    etag = hashlib.sha256(fill_times_key.encode('utf-8')).hexdigest()[:32]
+    # The matrix is never cached, so another worker's could not be reused
+    return _cacheable_json_response(etag, lambda: SINGLE_FLIGHT.do(fill_times_key, compute, across_workers=False))
+
+
+def _export_inputs():
+    """
+    Parses the export form fields (initial_volume_excel, unit_excel, ...) into validated inputs.
+    Without a field selection only the default export columns are computed.
+    Raises ValueError for invalid input.
+    """
+    fields = request.form.get('fields_excel') or request.form.get('fields')
+    return parse_calculation_inputs(
+        request.form.get('initial_volume_excel', ''),
+        request.form.get('unit_excel', 'litres'),
+        request.form.get('iterations_excel', ''),
+        request.form.get('time_rate_excel'),
+        request.form.get('time_unit_excel'),
+        request.form.get('magnitude_excel') or 'float',
+        fields=fields or [key for key, _ in EXPORT_COLUMNS],
+        rule=request.form.get('rule_excel'),
+        growth_percent=request.form.get('growth_percent_excel'),
+    )
+
+
+def _export(export_format):
+    """
+    Streams the calculation results as an attachment in the given export format.
+    Rows are generated lazily and the file is sent in chunks, so memory stays flat for large exports.
+    """
+    if export_format == "parquet" and not PARQUET_AVAILABLE:
+        return jsonify({"error": "Parquet export requires the optional pyarrow package."}), 501
+
+    try:
+        inputs = _export_inputs()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    columns = export_columns(inputs.fields)
+
+    stream_export, mimetype = EXPORT_FORMATS[export_format]
+    headers = {"Content-Disposition": f"attachment; filename={EXPORT_FILENAME}.{export_format}"}
+
+    # Identical exports are served byte for byte from the result cache
+    cache_key = calculation_cache_key(f"export_{export_format}", inputs)
+    cached_file = RESULT_CACHE.get(cache_key)
+    if cached_file is not None:
+        return Response(cached_file, mimetype=mimetype, headers=headers)
+
+    def generate(chunks):
+        try:
+            yield from chunks
+        except Exception as e:
+            # Headers are already sent at this point, so the client sees a truncated download
+            logger.error(f"An unexpected error occurred during {export_format} export: {e}", exc_info=True)
+            raise
+
+    # Identical exports in flight share one file as it is written
+    try:
+        reader = _shared_stream(
+            cache_key,
+            estimate_calculation_cost(inputs, export_format),
+            lambda: _cache_stream(stream_export(iter_calculation_column_chunks(inputs), columns), cache_key),
+        )
+    except CalculationTooExpensive as e:
+        return jsonify({"error": str(e)}), 400
+    response = Response(generate(reader), mimetype=mimetype, headers=headers)
+    response.call_on_close(reader.close)
+    return response
+
+
+@bp.route('/cache_stats')
+def cache_stats():
+    """
+    Returns the result cache hit/miss counters and current size as JSON.
+    """
+    return jsonify(RESULT_CACHE.stats())
+
+
+@bp.route('/metrics')
+def metrics():
+    """
+    Returns the per-stage latency histograms, request latencies and row and byte counters in
+    the Prometheus text format, summed over all processes when WVC_METRICS_DIR is set.
+    """
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/coalescing_stats')
+def coalescing_stats():
+    """
+    Returns the request coalescing counters as JSON: how many computations and streams ran and
+    how many identical requests shared them instead ("deduplicated").
+    """
+    return jsonify(SINGLE_FLIGHT.stats())
+
+
+@bp.route('/admission_stats')
+def admission_stats():
+    """
+    Returns the admission control budgets, what is currently in flight and the admitted,
+    queued and rejected counters as JSON.
+    """
+    return jsonify(ADMISSION.stats())
+
+
+EXPORT_JOBS = ExportJobQueue(
+    spool_dir=os.environ.get("WVC_EXPORT_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "wvc_exports"),
+    workers=int(os.environ.get("WVC_EXPORT_WORKERS", max(1, (os.cpu_count() or 1) // 2))),
+    max_pending=int(os.environ.get("WVC_EXPORT_MAX_PENDING", 32)),
+    ttl_seconds=float(os.environ.get("WVC_EXPORT_TTL_SECONDS", 3600)),
+)
+# Seconds a client should wait before polling a pending export job again
+EXPORT_JOB_POLL_SECONDS = 1
+
+
+def _export_job_payload(job):
+    """
+    Returns the public view of an export job, with its status and download URLs.
+    """
+    payload = {key: job[key] for key in ("id", "format", "status", "submitted_at", "started_at", "finished_at", "size", "error") if key in job}
+    payload["status_url"] = f"/export_jobs/{job['id']}"
+    if job["status"] == "done":
+        payload["download_url"] = f"/export_jobs/{job['id']}/download"
+    return payload
+
+
+@bp.route('/export_jobs', methods=['POST'])
+def submit_export_job():
+    """
+    Queues an export in the background and returns its job right away with 202 Accepted.
+    Takes the export form fields plus format (xlsx, csv or parquet; xlsx by default).
+    Poll the status URL until the job is done, then fetch the download URL.
+    """
+    export_format = request.form.get('format') or 'xlsx'
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown export format '{export_format}'. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+    if export_format == "parquet" and not PARQUET_AVAILABLE:
+        return jsonify({"error": "Parquet export requires the optional pyarrow package."}), 501
+
+    try:
+        inputs = _export_inputs()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Identical exports map to the same job, so a resubmission reuses the spooled file
+    job_id = hashlib.sha256(calculation_cache_key(f"export_{export_format}", inputs).encode('utf-8')).hexdigest()[:32]
+    try:
+        # Concurrent identical submissions queue the job once
+        job = SINGLE_FLIGHT.do(f"export_job|{job_id}", lambda: EXPORT_JOBS.submit(job_id, export_format, inputs, export_columns(inputs.fields)))
+    except ExportQueueFull as e:
+        raise AdmissionRejected(str(e), EXPORT_JOB_POLL_SECONDS)
+    response = jsonify(_export_job_payload(job))
+    response.status_code = 202
+    response.headers["Location"] = f"/export_jobs/{job_id}"
+    return response
+
+
+@bp.route('/export_jobs/<job_id>')
+def export_job_status(job_id):
+    """
+    Returns an export job's status: queued, running, done (with a download URL) or failed (with an error).
+    """
+    job = EXPORT_JOBS.status(job_id) if job_id.isalnum() else None
+    if job is None:
+        return jsonify({"error": "No such export job. Jobs expire after a while; submit the export again."}), 404
+    response = jsonify(_export_job_payload(job))
+    if job["status"] in ("queued", "running"):
+        response.headers["Retry-After"] = str(EXPORT_JOB_POLL_SECONDS)
+    return response
+
+
+@bp.route('/export_jobs/<job_id>/download')
+def download_export_job(job_id):
+    """
+    Sends a finished export job's file as an attachment; 409 while the job is still pending.
+    """
+    job = EXPORT_JOBS.status(job_id) if job_id.isalnum() else None
+    if job is None or (job["status"] == "done" and not os.path.exists(EXPORT_JOBS.file_path(job))):
+        return jsonify({"error": "No such export job. Jobs expire after a while; submit the export again."}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": f"The export failed: {job.get('error')}"}), 500
+    if job["status"] != "done":
+        response = jsonify({"error": "The export is not finished yet.", "status": job["status"]})
+        response.status_code = 409
+        response.headers["Retry-After"] = str(EXPORT_JOB_POLL_SECONDS)
+        return response
+    return send_file(
+        EXPORT_JOBS.file_path(job),
+        mimetype=EXPORT_FORMATS[job["format"]][1],
+        as_attachment=True,
+        download_name=f"{EXPORT_FILENAME}.{job['format']}",
+    )
+
+
+@bp.route('/export_jobs_stats')
+def export_jobs_stats():
+    """
+    Returns the number of spooled export jobs in each state as JSON.
+    """
+    return jsonify(EXPORT_JOBS.stats())
+
+
+@bp.route('/memory_profiles')
+def memory_profiles():
+    """
+    Lists this worker's recent memory profile reports as JSON, newest first, without their
+    allocation sites. Only available when memory profiling is enabled.
+    """
+    if current_app.config["MEMORY_PROFILING"] == "off":
+        return jsonify({"error": "Memory profiling is not enabled (set WVC_MEMORY_PROFILING)."}), 404
+    return jsonify(PROFILER.recent())
+
+
+@bp.route('/memory_profiles/<profile_id>')
+def memory_profile(profile_id):
+    """
+    Returns one memory profile report as JSON: peak and retained bytes, live bytes after each
+    stage and the top allocation sites at the high-water mark and at the end.
+    """
+    report = PROFILER.get(profile_id) if current_app.config["MEMORY_PROFILING"] != "off" else None
+    if report is None:
+        return jsonify({"error": "Unknown memory profile. Reports are kept by the worker that served the request."}), 404
+    return jsonify(report)
+
+
+@bp.route('/export_excel', methods=['POST'])
+def export_excel():
+    """
+    Exports the calculation results to an Excel file.
+    """
+    return _export("xlsx")
+
+
+@bp.route('/export_csv', methods=['POST'])
+def export_csv():
+    """
+    Exports the calculation results to a CSV file.
+    """
+    return _export("csv")
+
+
+@bp.route('/export_parquet', methods=['POST'])
+def export_parquet():
+    """
+    Exports the calculation results to a Parquet file (requires pyarrow).
+    """
+    return _export("parquet")
+
+
+# Application factory. Everything above is per-process state built once at import: the reference
+# tables and formatters (calculator.py), the result cache, the admission budgets and the
+# coalescing tables. A preloading server (gunicorn --preload, the default in gunicorn.conf.py)
+# imports this module and builds the app once in its master process, then forks the workers,
+# which share all of it copy-on-write and start serving without rebuilding it. The export
+# libraries are the exception: unless PRELOAD_EXPORT_LIBRARIES is set, each worker still imports
+# openpyxl (and pyarrow) on its first export that needs them.
+
+# Start-up report served by /startup_stats, filled in by create_app
+STARTUP = {}
+
+
+@bp.route('/startup_stats')
+def startup_stats():
+    """
+    Returns the start-up report as JSON: seconds spent importing the app and in create_app(),
+    resident memory right after (bytes), and this worker's memory now. preloaded is true when
+    this worker was forked from the process that built the app.
+    """
+    return jsonify(dict(STARTUP, worker_pid=os.getpid(), preloaded=STARTUP.get("pid") != os.getpid(), current=process_memory()))
+
+
+def create_app(config=None):
+    """
+    Builds the Flask app: registers the routes and compiles the page template, so the first
+    request does not pay for it. config updates app.config. With PRELOAD_EXPORT_LIBRARIES (off
+    unless WVC_PRELOAD_EXPORT_LIBRARIES=1 is set) openpyxl and pyarrow are imported now, for
+    preloaded workers to share, rather than by the first export that needs them.
+    MEMORY_PROFILING (default: WVC_MEMORY_PROFILING, or "off") is one of MEMORY_PROFILING_MODES;
+    when it is on, the app logs at INFO so the profile reports are seen.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.json = FiniteJSONProvider(app)
+    app.config["PRELOAD_EXPORT_LIBRARIES"] = os.environ.get("WVC_PRELOAD_EXPORT_LIBRARIES") == "1"
+    app.config["MEMORY_PROFILING"] = os.environ.get("WVC_MEMORY_PROFILING", "off")
+    app.config.update(config or {})
+    if app.config["MEMORY_PROFILING"] not in MEMORY_PROFILING_MODES:
+        raise ValueError(f"MEMORY_PROFILING must be one of {', '.join(MEMORY_PROFILING_MODES)}.")
+    if app.config["MEMORY_PROFILING"] != "off" and not app.logger.level:
+        app.logger.setLevel(logging.INFO)
+    app.register_blueprint(bp)
+    app.jinja_env.get_template('index.html')
+    if app.config["PRELOAD_EXPORT_LIBRARIES"]:
+        load_export_libraries()
+
+    STARTUP.update(
+        pid=os.getpid(),
+        import_seconds=STARTUP.get("import_seconds", started - _IMPORT_STARTED),
+        create_app_seconds=time.perf_counter() - started,
+        export_libraries_loaded=bool(app.config["PRELOAD_EXPORT_LIBRARIES"]),
+        **process_memory(),
+    )
+    app.logger.info(
+        f"App ready in {(STARTUP['import_seconds'] + STARTUP['create_app_seconds']) * 1000:.0f} ms "
+        f"(import {STARTUP['import_seconds'] * 1000:.0f} ms), RSS {(STARTUP['rss_bytes'] or 0) / 2**20:.1f} MiB"
+    )
+    return app
+
+
+# Module-level app for `gunicorn app:app` and `flask run`; `gunicorn "app:create_app()"` works too
+app = create_app()
 
 
 if __name__ == '__main__':
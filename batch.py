@@ -0,0 +1,199 @@
+"""
+Headless batch runner for the Water Volume Compounder.
+
+Reads scenarios (objects with the /calculate field names: initial_volume, unit, iterations,
+time_rate, time_unit, magnitude, fields, rule, growth_percent) from a CSV file with a header row
+or a JSONL file, or from stdin, and writes each scenario's rows or error as they are computed.
+Scenarios are read lazily in chunks;
+each chunk is one perform_batch_calculation pass in a worker process, and only a bounded number of
+chunks is in flight, so memory stays flat however long the input is. Output keeps the input order.
+Only the calculation core is imported, never Flask.
+
+Example:
+    python batch.py scenarios.csv --output results.jsonl
+    cat scenarios.jsonl | python batch.py - --input-format jsonl --output-format csv > results.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from calculator import ROW_FIELDS, finite_json, perform_batch_calculation
+
+BATCH_INPUT_FORMATS = ("csv", "jsonl")
+BATCH_OUTPUT_FORMATS = ("jsonl", "csv")
+BATCH_CHUNK_SIZE = 200
+# Row columns written by CSV output, after the scenario number
+BATCH_CSV_COLUMNS = list(ROW_FIELDS) + ["error"]
+
+
+def read_scenarios(stream, input_format):
+    """
+    Yields scenario dicts from a text stream one at a time. Blank JSONL lines are skipped; a line
+    that is not valid JSON is yielded as is, so it fails as its own scenario instead of the run.
+    """
+    if input_format == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line.rstrip("\n")
+
+
+def iter_chunks(scenarios, chunk_size):
+    scenarios = iter(scenarios)
+    while True:
+        chunk = list(islice(scenarios, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_batch_chunk(scenarios):
+    """
+    Computes one chunk of scenarios. A chunk that fails as a whole (e.g. it would exceed the
+    batch row limit) is split in half until each part succeeds, so a scenario that still fails
+    on its own becomes that scenario's error instead of failing the run.
+    """
+    try:
+        return perform_batch_calculation(scenarios)
+    except Exception as e:
+        if len(scenarios) == 1:
+            return [{"error": str(e)}]
+        middle = len(scenarios) // 2
+        return run_batch_chunk(scenarios[:middle]) + run_batch_chunk(scenarios[middle:])
+
+
+class JsonlWriter:
+    """
+    Writes one line per scenario: {"scenario": n, "results": rows} or {"scenario": n, "error": message}.
+    Non-finite floats (overflowed volumes) are written as null, as in the web app's JSON.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, number, outcome):
+        record = dict(scenario=number, **outcome)
+        try:
+            line = json.dumps(record, allow_nan=False)
+        except ValueError:
+            line = json.dumps(finite_json(record), allow_nan=False)
+        self.stream.write(line + "\n")
+
+
+class CsvWriter:
+    """
+    Writes one row per result row, tagged with its scenario number; a failed scenario is one row
+    with only the error column set.
+    """
+
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, fieldnames=["scenario"] + BATCH_CSV_COLUMNS, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, number, outcome):
+        if "error" in outcome:
+            self.writer.writerow({"scenario": number, "error": outcome["error"]})
+            return
+        for row in outcome["results"]:
+            self.writer.writerow(dict(row, scenario=number))
+
+
+BATCH_WRITERS = {
+    "jsonl": JsonlWriter,
+    "csv": CsvWriter,
+}
+
+
+def run_batch(scenarios, writer, chunk_size=BATCH_CHUNK_SIZE, workers=None, progress=None):
+    """
+    Computes scenarios (any iterable) chunk by chunk on a process pool and hands each outcome to
+    writer.write(scenario_number, outcome) in input order. At most two chunks per worker are in
+    flight at once. progress, if given, is called with the number of scenarios written so far
+    after every chunk. Returns a (scenarios, errors) count.
+    """
+    workers = workers or os.cpu_count() or 1
+    written = 0
+    errors = 0
+
+    def write_chunk(outcomes):
+        nonlocal written, errors
+        for outcome in outcomes:
+            written += 1
+            errors += "error" in outcome
+            writer.write(written, outcome)
+        if progress:
+            progress(written)
+
+    chunks = iter_chunks(scenarios, chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            write_chunk(run_batch_chunk(chunk))
+        return written, errors
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(run_batch_chunk, chunk))
+            if len(in_flight) >= 2 * workers:
+                write_chunk(in_flight.popleft().result())
+        while in_flight:
+            write_chunk(in_flight.popleft().result())
+    return written, errors
+
+
+def _detect_input_format(path):
+    return "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Water Volume Compounder scenarios from a CSV or JSONL file without the web app.")
+    parser.add_argument("input", help="Scenario file (.csv, .jsonl), or - for stdin.")
+    parser.add_argument("--input-format", choices=BATCH_INPUT_FORMATS, help="Defaults to the input file extension (csv for stdin).")
+    parser.add_argument("--output", default="-", help="Output file, or - for stdout (default).")
+    parser.add_argument("--output-format", choices=BATCH_OUTPUT_FORMATS, help="Defaults to the output file extension (jsonl for stdout).")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE, help="Scenarios per worker task.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core).")
+    parser.add_argument("--quiet", action="store_true", help="Do not report progress on stderr.")
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("Chunk size must be positive.")
+
+    input_format = args.input_format or ("csv" if args.input == "-" else _detect_input_format(args.input))
+    output_format = args.output_format or ("csv" if args.output.endswith(".csv") else "jsonl")
+    source = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+
+    def report(count):
+        sys.stderr.write(f"\r{count:,} scenarios")
+        sys.stderr.flush()
+
+    try:
+        written, errors = run_batch(
+            read_scenarios(source, input_format),
+            BATCH_WRITERS[output_format](sink),
+            args.chunk_size,
+            args.workers,
+            None if args.quiet else report,
+        )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    if not args.quiet:
+        sys.stderr.write(f"\r{written:,} scenarios, {errors:,} failed\n")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
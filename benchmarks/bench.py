@@ -0,0 +1,383 @@
+"""
+Benchmarks for the Water Volume Compounder.
+
+Four modes:
+    micro    times the calculation core in-process: perform_calculation across iteration counts
+             and number modes, and the per-value helpers (format_large_number_spoken,
+             describe_volume, calculate_time_to_fill) and their vectorized forms across magnitudes.
+    http     starts gunicorn locally with each requested worker count and drives /calculate and
+             /export_excel from concurrent client threads, recording throughput and latency
+             percentiles. Every request uses a distinct initial volume, so the result cache
+             never answers for the calculation under test (use --repeat-inputs to measure hits).
+    startup  imports the app in fresh interpreters and records the import and create_app() time,
+             the whole process's wall time and its resident memory (median of --runs), which is
+             what every cold start and every non-preloaded gunicorn worker pays.
+    compare  compares two result files and flags every benchmark that got worse by more than
+             the threshold; the exit status is 1 if any did.
+
+Results are saved as JSON ({"kind", "meta", "results": {name: {"value", "unit", "better"}}}),
+so a run saved as a baseline can be compared with any later one, and micro, http and startup can
+compare against a baseline right after running with --baseline.
+
+Example:
+    python benchmarks/bench.py micro --output benchmarks/results/baseline-micro.json
+    python benchmarks/bench.py micro --baseline benchmarks/results/baseline-micro.json
+    python benchmarks/bench.py http --workers 1 2 4 --duration 10 --output http.json
+    python benchmarks/bench.py startup --runs 10 --baseline benchmarks/results/baseline-startup.json
+    python benchmarks/bench.py compare baseline.json http.json --threshold 0.15
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from calculator import (
+    calculate_time_to_fill,
+    describe_volume,
+    fill_time_columns,
+    format_large_number_spoken,
+    format_large_numbers_spoken,
+    perform_calculation,
+    REFERENCE_INDEX,
+)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+DEFAULT_THRESHOLD = 0.10
+MICRO_ITERATIONS = (10, 100, 1_000, 10_000, 100_000)
+MICRO_MAGNITUDES = (1e3, 1e9, 1e15, 1e21, 1e27, 1e100)
+MICRO_VECTOR_SIZE = 100_000
+HTTP_WORKERS = (1, 2, 4)
+HTTP_STARTUP_TIMEOUT = 30
+STARTUP_RUNS = 5
+# Run in a fresh interpreter by the startup mode; prints the app's start-up report as JSON
+STARTUP_PROBE = "import json, app; print(json.dumps(app.STARTUP))"
+
+
+def _run_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _result(value, unit, better, **extra):
+    return dict(value=value, unit=unit, better=better, **extra)
+
+
+def time_call(function, min_time=0.2, repeat=5):
+    """
+    Returns the median and best seconds per call of function() over repeat timing runs, each
+    looping enough calls to last at least min_time / repeat seconds.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_time / repeat:
+            break
+        number *= 2
+    per_call = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return statistics.median(per_call), min(per_call)
+
+
+def micro_cases(quick=False):
+    """
+    Yields (name, function, rows) for every microbenchmark; rows is the number of result rows or
+    values one call produces, for per-row figures.
+    """
+    iteration_counts = MICRO_ITERATIONS[:3] if quick else MICRO_ITERATIONS
+    for magnitude in ("float", "log10"):
+        for iterations in iteration_counts:
+            yield (
+                f"perform_calculation/{magnitude}/{iterations}",
+                lambda iterations=iterations, magnitude=magnitude: perform_calculation("3", "litres", str(iterations), "5", "hour", magnitude),
+                iterations,
+            )
+
+    for value in MICRO_MAGNITUDES:
+        yield f"format_large_number_spoken/{value:.0e}", lambda value=value: format_large_number_spoken(value), 1
+        yield f"describe_volume/{value:.0e}", lambda value=value: describe_volume(value), 1
+    for unit in ("second", "hour", "year"):
+        yield f"calculate_time_to_fill/{unit}", lambda unit=unit: calculate_time_to_fill(1e6, 2.5e9, 5.0, unit), 1
+
+    # Vectorized forms over a spread of magnitudes, as one calculation chunk would pass them
+    size = MICRO_VECTOR_SIZE // 10 if quick else MICRO_VECTOR_SIZE
+    volumes = np.logspace(0, 30, size)
+    fill_targets = REFERENCE_INDEX.next_fill_targets(volumes)
+    yield f"format_large_numbers_spoken/{size}", lambda: format_large_numbers_spoken(volumes), size
+    yield f"describe_many/{size}", lambda: REFERENCE_INDEX.describe_many(volumes), size
+    yield f"fill_time_columns/{size}", lambda: fill_time_columns(volumes, fill_targets, 5.0, None, "hour"), size
+
+
+def run_micro(args):
+    results = {}
+    for name, function, rows in micro_cases(args.quick):
+        median, best = time_call(function, args.min_time, args.repeat)
+        results[name] = _result(median, "s", "lower", best=best, per_row=median / rows, rows=rows)
+        print(f"{name:<48} {median * 1e6:>12.2f} us  ({median / rows * 1e9:>10.1f} ns/row)", file=sys.stderr)
+    return {"kind": "micro", "meta": _run_metadata(), "results": results}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, port, extra_env=None):
+    """
+    Starts gunicorn serving app:app on 127.0.0.1:port and waits until it answers.
+    """
+    env = dict(os.environ, **(extra_env or {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", os.path.join(ROOT, "gunicorn.conf.py"), "--workers", str(workers),
+         "--bind", f"127.0.0.1:{port}", "--chdir", ROOT, "--log-level", "warning", "app:app"],
+        env=env,
+    )
+    deadline = time.monotonic() + HTTP_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}.")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/cache_stats")
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_gunicorn(process)
+    raise RuntimeError(f"gunicorn did not start within {HTTP_STARTUP_TIMEOUT} seconds.")
+
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def http_scenarios(args):
+    """
+    Returns {name: (path, make_form)} for the load-tested routes; make_form(i) gives the form of
+    the i-th request.
+    """
+    def volume(i):
+        return "3" if args.repeat_inputs else str(1000 + i)
+
+    return {
+        "calculate": ("/calculate", lambda i: {
+            "initial_volume": volume(i), "unit": "litres", "iterations": str(args.iterations),
+            "time_rate": "5", "time_unit": "hour",
+        }),
+        "export_excel": ("/export_excel", lambda i: {
+            "initial_volume_excel": volume(i), "unit_excel": "litres", "iterations_excel": str(args.export_iterations),
+            "time_rate_excel": "5", "time_unit_excel": "hour",
+        }),
+    }
+
+
+def drive_load(port, path, make_form, concurrency, duration):
+    """
+    Sends POST requests from concurrency threads for duration seconds and returns the latency of
+    every successful request, the status code counts and the elapsed time.
+    """
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(sys.maxsize))
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            body = urlencode(make_form(next(counter)))
+            started = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                connection.request("POST", path, body, {"Content-Type": "application/x-www-form-urlencoded"})
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                status = response.status
+            except OSError:
+                status = "error"
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+
+def _percentile(values, fraction):
+    return float(np.percentile(values, fraction * 100)) if values else None
+
+
+def run_http(args):
+    results = {}
+    scenarios = http_scenarios(args)
+    for workers in args.workers:
+        port = _free_port()
+        process = start_gunicorn(workers, port)
+        try:
+            for name in args.scenarios:
+                path, make_form = scenarios[name]
+                drive_load(port, path, make_form, args.concurrency, args.warmup)
+                latencies, statuses, elapsed = drive_load(port, path, make_form, args.concurrency, args.duration)
+                prefix = f"http/{name}/workers={workers}"
+                results[f"{prefix}/throughput"] = _result(len(latencies) / elapsed, "req/s", "higher", statuses={str(k): v for k, v in statuses.items()})
+                for label, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                    results[f"{prefix}/{label}"] = _result(_percentile(latencies, fraction), "s", "lower")
+                print(
+                    f"{prefix:<40} {len(latencies) / elapsed:>9.1f} req/s  p50 {_format_ms(_percentile(latencies, 0.5))}  "
+                    f"p95 {_format_ms(_percentile(latencies, 0.95))}  p99 {_format_ms(_percentile(latencies, 0.99))}  statuses {statuses}",
+                    file=sys.stderr,
+                )
+        finally:
+            stop_gunicorn(process)
+    meta = dict(_run_metadata(), concurrency=args.concurrency, duration=args.duration, iterations=args.iterations,
+                export_iterations=args.export_iterations, repeat_inputs=args.repeat_inputs)
+    return {"kind": "http", "meta": meta, "results": results}
+
+
+def run_startup(args):
+    """
+    Imports the app in args.runs fresh interpreters and reports the median of each start-up figure.
+    """
+    reports = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+        reports.append(dict(json.loads(completed.stdout.splitlines()[-1]), process_seconds=time.perf_counter() - started))
+
+    results = {}
+    for key, unit in (("process_seconds", "s"), ("import_seconds", "s"), ("create_app_seconds", "s"), ("rss_bytes", "B"), ("peak_rss_bytes", "B")):
+        values = [report[key] for report in reports if report.get(key) is not None]
+        value = statistics.median(values) if values else None
+        results[f"startup/{key}"] = _result(value, unit, "lower")
+        shown = "n/a" if value is None else (f"{value * 1000:.1f} ms" if unit == "s" else f"{value / 2**20:.1f} MiB")
+        print(f"{'startup/' + key:<48} {shown:>12}", file=sys.stderr)
+    return {"kind": "startup", "meta": dict(_run_metadata(), runs=args.runs), "results": results}
+
+
+def _format_ms(seconds):
+    return "    n/a" if seconds is None else f"{seconds * 1000:>7.1f} ms"
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the benchmarks present in both result dicts. Returns a list of
+    (name, baseline value, current value, relative change, regressed) where a positive change is
+    always an improvement, and regressed means it got worse by more than threshold.
+    """
+    rows = []
+    for name, base in baseline["results"].items():
+        result = current["results"].get(name)
+        if result is None or not base["value"] or result["value"] is None:
+            continue
+        change = (result["value"] - base["value"]) / base["value"]
+        if base["better"] == "lower":
+            change = -change
+        rows.append((name, base["value"], result["value"], change, change < -threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    for name, base, value, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<48} {base:>14.6g} -> {value:>14.6g}  {change:>+8.1%}  {flag}")
+    regressions = sum(regressed for *_, regressed in rows)
+    print(f"{len(rows)} benchmarks compared, {regressions} regressed by more than {threshold:.0%}.")
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Water Volume Compounder calculation core and web routes.")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    micro = modes.add_parser("micro", help="Microbenchmark the calculation core in-process.")
+    micro.add_argument("--quick", action="store_true", help="Fewer and smaller cases, for a fast check.")
+    micro.add_argument("--min-time", type=float, default=0.2, help="Seconds of timing per case.")
+    micro.add_argument("--repeat", type=int, default=5, help="Timing runs per case; the median is reported.")
+
+    load = modes.add_parser("http", help="Load-test /calculate and /export_excel on a local gunicorn.")
+    load.add_argument("--workers", type=int, nargs="+", default=list(HTTP_WORKERS), help="gunicorn worker counts to test.")
+    load.add_argument("--scenarios", nargs="+", choices=("calculate", "export_excel"), default=["calculate", "export_excel"])
+    load.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads.")
+    load.add_argument("--duration", type=float, default=10.0, help="Seconds of measured load per scenario.")
+    load.add_argument("--warmup", type=float, default=1.0, help="Seconds of unmeasured load before each scenario.")
+    load.add_argument("--iterations", type=int, default=100, help="Iterations per /calculate request.")
+    load.add_argument("--export-iterations", type=int, default=1000, help="Iterations per /export_excel request.")
+    load.add_argument("--repeat-inputs", action="store_true", help="Send identical inputs, so repeats are served from the result cache.")
+
+    startup = modes.add_parser("startup", help="Measure app start-up time and memory in fresh interpreters.")
+    startup.add_argument("--runs", type=int, default=STARTUP_RUNS, help="Interpreters to start; the median is reported.")
+
+    for mode in (micro, load, startup):
+        mode.add_argument("--output", help="Save the results as JSON here (default: benchmarks/results/<mode>-<timestamp>.json).")
+        mode.add_argument("--baseline", help="Compare the results with this baseline file.")
+        mode.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative change counted as a regression (default 0.10).")
+
+    compare = modes.add_parser("compare", help="Compare two result files.")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative change counted as a regression (default 0.10).")
+
+    args = parser.parse_args(argv)
+    if args.mode == "compare":
+        baseline, current = load_results(args.baseline), load_results(args.current)
+    else:
+        current = {"micro": run_micro, "http": run_http, "startup": run_startup}[args.mode](args)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        save_results(current, args.output or os.path.join(RESULTS_DIR, f"{args.mode}-{stamp}.json"))
+        if not args.baseline:
+            return 0
+        baseline = load_results(args.baseline)
+    return 1 if print_comparison(compare_results(baseline, current, args.threshold), args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
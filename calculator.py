@@ -0,0 +1,1125 @@
+"""
+Calculation core for the Water Volume Compounder: reference volumes, number formatting,
+the vectorized series engine and result rows. It has no Flask dependency, so offline
+tools (sweeps, batch jobs) can import it directly; app.py serves it over HTTP.
+"""
+import bisect
+import csv
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import numpy as np
+from collections import namedtuple
+
+from metrics import count_rows, stage, timed
+from rules import compile_rule, growth_rule
+
+logger = logging.getLogger(__name__)
+
+# Conversion factor
+GALLONS_TO_LITERS = 3.785411784 # 1 US gallon = 3.785411784 liters [2, 3, 5, 10, 13]
+
+# Approximate volumes of water bodies in Liters.
+# These ranges are illustrative and designed to provide distinct categories for comparison.
+# Sourced from various search results and general knowledge to provide a wide range.
+WATER_BODY_VOLUMES = {
+    "a small pond": {
+        "min": 0,
+        "max": 1.0 * (10**7), # Up to 10 million liters (10,000 m³) approx. for a large pond [8, 30, 31, 32, 43, 45]
+    },
+    "a large pond or a small lake": {
+        "min": 1.0 * (10**7),
+        "max": 1.0 * (10**9), # Up to 1 billion liters (1 million m³)
+    },
+    "a medium-sized lake": {
+        "min": 1.0 * (10**9),
+        "max": 1.0 * (10**12), # Up to 1 trillion liters (1 billion m³)
+    },
+    "a large lake (e.g., Lake Tahoe)": {
+        "min": 1.0 * (10**12),
+        "max": 1.0 * (10**15), # Up to 1 quadrillion liters (1 trillion m³) - Lake Tahoe ~1.47 x 10^14 L (39 trillion gallons) [19, 38, 42]
+    },
+    "a Great Lake (e.g., Lake Superior)": {
+        "min": 1.0 * (10**15),
+        "max": 1.0 * (10**17), # Up to 100 quadrillion liters (100 trillion m³) - Lake Superior ~1.21 x 10^16 L (3 quadrillion gallons) [6, 9, 21, 34, 35, 39, 40]
+    },
+    "an entire sea (e.g., Mediterranean Sea)": {
+        "min": 1.0 * (10**17),
+        "max": 1.0 * (10**19), # Up to 10 quintillion liters (10 exaliters) - Mediterranean Sea ~3.75 x 10^18 L (3.75 quintillion liters) [20, 36, 37, 41, 44]
+    },
+    "an entire ocean (e.g., Pacific Ocean)": {
+        "min": 1.0 * (10**19),
+        "max": 1.0 * (10**21), # Up to 1 sextillion liters - Pacific Ocean ~7.02 x 10^20 L (702 quintillion liters) [11, 17, 22, 26, 29]
+    }
+}
+
+PLANET_VOLUMES = {
+    "Planet Mars": 1.6318 * (10**23), # Mars Volume ~1.6318 x 10^11 km³ = 1.6318 x 10^23 L [1, 7, 14, 27, 28]
+    "Planet Earth": 1.083 * (10**24), # Earth Volume ~1.083 x 10^12 km³ = 1.083 x 10^24 L [1, 4, 8, 12, 15, 18, 23]
+    "Planet Jupiter": 1.4313 * (10**27) # Jupiter Volume ~1.4313 x 10^15 km³ = 1.4313 x 10^27 L [1, 4, 6, 12, 16, 24, 25]
+}
+
+# Short-scale suffixes for powers of 1000 (each new suffix is 1000 times the previous one).
+# 10^0 has no suffix; above Quadragintillion only every tenth name is listed, so e.g. 10^150
+# is still expressed as a multiple of a Quadragintillion.
+# Python's float max is around 1.79e308, so the table stops at Centillion (10^303).
+NUMBER_SUFFIXES = [
+    (0, ""), # For numbers less than 1000
+    (3, "Thousand"),
+    (6, "Million"),
+    (9, "Billion"),
+    (12, "Trillion"),
+    (15, "Quadrillion"),
+    (18, "Quintillion"),
+    (21, "Sextillion"),
+    (24, "Septillion"),
+    (27, "Octillion"),
+    (30, "Nonillion"),
+    (33, "Decillion"),
+    (36, "Undecillion"),
+    (39, "Duodecillion"),
+    (42, "Tredecillion"),
+    (45, "Quattuordecillion"),
+    (48, "Quindecillion"),
+    (51, "Sexdecillion"),
+    (54, "Septendecillion"),
+    (57, "Octodecillion"),
+    (60, "Novemdecillion"),
+    (63, "Vigintillion"),
+    (66, "Unvigintillion"),
+    (69, "Duovigintillion"),
+    (72, "Trevigintillion"),
+    (75, "Quattuorvigintillion"),
+    (78, "Quinvigintillion"),
+    (81, "Sexvigintillion"),
+    (84, "Septenvigintillion"),
+    (87, "Octovigintillion"),
+    (90, "Novemvigintillion"),
+    (93, "Trigintillion"),
+    (96, "Untrigintillion"),
+    (99, "Duotrigintillion"),
+    (102, "Tretrigintillion"),
+    (105, "Quattuortrigintillion"),
+    (108, "Quinquatrigintillion"),
+    (111, "Sexatrigintillion"),
+    (114, "Septentrigintillion"),
+    (117, "Octotrigintillion"),
+    (120, "Novemtrigintillion"),
+    (123, "Quadragintillion"),
+    (153, "Quinquagintillion"),
+    (183, "Sexagintillion"),
+    (213, "Septuagintillion"),
+    (243, "Octogintillion"),
+    (273, "Nonagintillion"),
+    (303, "Centillion"),
+]
+
+
+def _build_suffix_lookup():
+    """
+    Expands NUMBER_SUFFIXES into one entry per power-of-1000 group, so the suffix for a number
+    is found by indexing with floor(log10(num) / 3) instead of scanning the table.
+    Returns (group_floors, divisors, suffixes): group_floors[k] is the smallest float that is
+    >= 10^(3k), so float comparisons against it agree exactly with comparing to the integer.
+    """
+    group_floors = []
+    divisors = []
+    suffixes = []
+    table_index = 0
+    for group in range(NUMBER_SUFFIXES[-1][0] // 3 + 1):
+        while table_index + 1 < len(NUMBER_SUFFIXES) and NUMBER_SUFFIXES[table_index + 1][0] <= group * 3:
+            table_index += 1
+        exponent, suffix = NUMBER_SUFFIXES[table_index]
+
+        floor_value = float(10**(group * 3))
+        if floor_value < 10**(group * 3):
+            floor_value = math.nextafter(floor_value, math.inf)
+        group_floors.append(floor_value)
+        divisors.append(float(10**exponent))
+        suffixes.append(suffix)
+    return np.array(group_floors), divisors, suffixes
+
+
+SUFFIX_GROUP_FLOORS, SUFFIX_DIVISORS, SUFFIX_NAMES = _build_suffix_lookup()
+_SUFFIX_GROUP_FLOORS_LIST = SUFFIX_GROUP_FLOORS.tolist()
+_MAX_SUFFIX_GROUP = len(SUFFIX_NAMES) - 1
+
+
+def _suffix_group(num):
+    """
+    Returns the power-of-1000 group index for num >= 1, correcting the log10 estimate
+    by one step when rounding puts num on the wrong side of a group boundary.
+    """
+    group = min(int(math.log10(num)) // 3, _MAX_SUFFIX_GROUP)
+    if num < _SUFFIX_GROUP_FLOORS_LIST[group]:
+        group -= 1
+    elif group < _MAX_SUFFIX_GROUP and num >= _SUFFIX_GROUP_FLOORS_LIST[group + 1]:
+        group += 1
+    return group
+
+
+def _format_with_suffix(num, group, unit_str):
+    if group == 0: # For numbers less than 1000, no suffix
+        return f"{num:,.2f} {unit_str}"
+    rounded_num = round(num / SUFFIX_DIVISORS[group], 2)
+    return f"{rounded_num:,.2f} {SUFFIX_NAMES[group]} {unit_str}"
+
+
+def format_large_number_spoken(num, unit_str="Liters"):
+    """
+    Formats a large number into a human-readable string using terms like
+    million, billion, trillion, quadrillion, quintillion, sextillion, septillion, etc.
+    Handles 'Infinity' and very small numbers.
+    """
+    if num == float('inf'):
+        return "Infinity"
+    if num < 0:
+        return f"Invalid (Negative) Volume {unit_str}"
+    if num == 0:
+        return f"0 {unit_str}"
+    if num < 1:
+        return f"{num:,.6f} {unit_str}" # For very small volumes, keep decimal format
+    if math.isnan(num):
+        return f"{num:,.2f} {unit_str}" # NaN matches no suffix
+
+    return _format_with_suffix(num, _suffix_group(num), unit_str)
+
+
+def format_large_numbers_spoken(values, unit_str="Liters"):
+    """
+    Batch variant of format_large_number_spoken for a NumPy array of volumes.
+    Suffix groups for the whole array are resolved in one vectorized pass; only the final
+    string formatting happens per element. Returns a list of strings.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    regular = np.isfinite(values) & (values >= 1)
+
+    groups = np.zeros(values.shape, dtype=np.int64)
+    if regular.any():
+        regular_values = values[regular]
+        estimate = np.minimum(np.floor(np.log10(regular_values) / 3).astype(np.int64), _MAX_SUFFIX_GROUP)
+        estimate -= regular_values < SUFFIX_GROUP_FLOORS[estimate]
+        next_group = np.minimum(estimate + 1, _MAX_SUFFIX_GROUP)
+        estimate += (estimate < _MAX_SUFFIX_GROUP) & (regular_values >= SUFFIX_GROUP_FLOORS[next_group])
+        groups[regular] = estimate
+
+    return [
+        _format_with_suffix(num, group, unit_str) if is_regular else format_large_number_spoken(num, unit_str)
+        for num, group, is_regular in zip(values.tolist(), groups.tolist(), regular.tolist())
+    ]
+
+
+LOG10_FLOAT_MAX = math.log10(sys.float_info.max)
+
+
+def format_log10_number(log10_value):
+    """
+    Formats a finite number given as its log10 magnitude in scientific notation,
+    e.g. 2.8 -> "6.31e+2". Used where the value itself no longer fits in a float.
+    """
+    exponent = math.floor(log10_value)
+    mantissa = round(10**(log10_value - exponent), 2)
+    if mantissa >= 10: # Rounding can carry into the next power of ten
+        mantissa /= 10
+        exponent += 1
+    return f"{mantissa:.2f}e{exponent:+d}"
+
+
+def format_log10_volume_spoken(log10_value, unit_str="Liters"):
+    """
+    Formats a volume given as its log10 magnitude. Values that fit in a float are formatted
+    exactly like format_large_number_spoken; larger ones use scientific notation.
+    """
+    if log10_value < LOG10_FLOAT_MAX or not math.isfinite(log10_value):
+        return format_large_number_spoken(10**log10_value, unit_str)
+    return f"{format_log10_number(log10_value)} {unit_str}"
+
+
+def format_log10_volumes_spoken(log10_values, unit_str="Liters"):
+    """
+    Batch variant of format_log10_volume_spoken for a NumPy array of log10 magnitudes.
+    """
+    log10_values = np.asarray(log10_values, dtype=np.float64)
+    in_float_range = log10_values < LOG10_FLOAT_MAX
+    formatted = [None] * len(log10_values)
+    if in_float_range.any():
+        positions = np.flatnonzero(in_float_range)
+        for position, text in zip(positions.tolist(), format_large_numbers_spoken(10**log10_values[positions], unit_str)):
+            formatted[position] = text
+    for position in np.flatnonzero(~in_float_range).tolist():
+        formatted[position] = format_log10_volume_spoken(float(log10_values[position]), unit_str)
+    return formatted
+
+
+INFINITE_VOLUME_DESCRIPTION = "This volume is astronomically large, far exceeding all known water bodies and even the largest planets in our solar system."
+
+
+class VolumeReferenceIndex:
+    """
+    Sorted, precomputed lookup over reference volumes, used both for the comparison text
+    (describe) and for the next time-to-fill target. Lookups are binary searches, so they
+    stay O(log n) for catalogs with thousands of bodies: single values bisect Python lists,
+    and the *_many variants resolve a whole series with a single searchsorted call.
+
+    water_bodies maps a description to {"min": ..., "max": ...} like WATER_BODY_VOLUMES;
+    where ranges overlap, the entry listed first wins. planets maps a name to a volume
+    like PLANET_VOLUMES. fingerprint is a short hash of both tables, which changes whenever a
+    description or fill target could.
+    """
+
+    def __init__(self, water_bodies, planets):
+        tables = [[[description, limits["min"], limits["max"]] for description, limits in water_bodies.items()], sorted(planets.items())]
+        self.fingerprint = hashlib.sha256(json.dumps(tables).encode('utf-8')).hexdigest()[:12]
+        self.water_descriptions = [f"This volume could fill {description}." for description in water_bodies]
+
+        # Split the water body ranges into disjoint intervals [boundaries[j], boundaries[j+1])
+        # and record which body owns each one. Painting in reverse order lets earlier
+        # entries overwrite later ones, matching a first-match scan over the dict.
+        mins = np.array([limits["min"] for limits in water_bodies.values()], dtype=np.float64)
+        maxes = np.array([limits["max"] for limits in water_bodies.values()], dtype=np.float64)
+        # owners[j] covers [boundaries[j-1], boundaries[j]); the first and last slots stand for
+        # "below every range" and "above every range" and stay -1.
+        self.boundaries = np.unique(np.concatenate([mins, maxes]))
+        self.owners = np.full(len(self.boundaries) + 1, -1, dtype=np.int64)
+        for body_index in range(len(mins) - 1, -1, -1):
+            lo, hi = np.searchsorted(self.boundaries, [mins[body_index], maxes[body_index]])
+            self.owners[lo + 1:hi + 1] = body_index
+
+        planet_items = sorted(planets.items(), key=lambda item: item[1])
+        self.planet_names = [name for name, _ in planet_items]
+        self.planet_volumes = np.array([volume for _, volume in planet_items], dtype=np.float64)
+
+        # Time-to-fill targets: every water body ceiling and every planet, ascending.
+        self.fill_targets = np.sort(np.concatenate([maxes, self.planet_volumes]))
+
+        # Every reference body by the volume that counts as filling it, ascending.
+        references = sorted(
+            [(limits["max"], "water", description) for description, limits in water_bodies.items()]
+            + [(volume, "planet", name) for name, volume in planet_items],
+            key=lambda reference: reference[0],
+        )
+        self.reference_volumes = np.array([volume for volume, _, _ in references], dtype=np.float64)
+        self.reference_kinds = [kind for _, kind, _ in references]
+        self.reference_names = [name for _, _, name in references]
+
+        # Python list copies for single-value lookups, where bisect on a list beats a NumPy call
+        self.boundary_list = self.boundaries.tolist()
+        self.owner_list = self.owners.tolist()
+        self.planet_volume_list = self.planet_volumes.tolist()
+        self.fill_target_list = self.fill_targets.tolist()
+
+    def _describe_planet(self, volume_liters, planet_index):
+        if planet_index == 0:
+            return f"This volume is larger than all Earth's oceans, but less than the volume of {self.planet_names[0]}."
+        name = self.planet_names[planet_index - 1]
+        percentage = (volume_liters / self.planet_volume_list[planet_index - 1]) * 100
+        if planet_index == len(self.planet_names):
+            return f"This volume could fill approximately {percentage:.2f}% of {name}'s volume (or even more)!"
+        return f"This volume could fill approximately {percentage:.2f}% of {name}'s volume."
+
+    def describe(self, volume_liters):
+        """
+        Returns the comparison text for a single volume in liters.
+        """
+        if volume_liters <= 0:
+            return "No volume or invalid volume."
+        if volume_liters == float('inf'):
+            return INFINITE_VOLUME_DESCRIPTION
+        owner = self.owner_list[bisect.bisect_right(self.boundary_list, volume_liters)]
+        if owner >= 0:
+            return self.water_descriptions[owner]
+        return self._describe_planet(volume_liters, bisect.bisect_right(self.planet_volume_list, volume_liters))
+
+    def describe_many(self, volumes):
+        """
+        Returns the comparison text for every volume in a NumPy array.
+        """
+        volumes = np.asarray(volumes, dtype=np.float64)
+        owners = self.owners[np.searchsorted(self.boundaries, volumes, side='right')].tolist()
+        planet_indexes = np.searchsorted(self.planet_volumes, volumes, side='right').tolist()
+
+        descriptions = []
+        for volume_liters, owner, planet_index in zip(volumes.tolist(), owners, planet_indexes):
+            if volume_liters <= 0:
+                descriptions.append("No volume or invalid volume.")
+            elif volume_liters == float('inf'):
+                descriptions.append(INFINITE_VOLUME_DESCRIPTION)
+            elif owner >= 0:
+                descriptions.append(self.water_descriptions[owner])
+            else:
+                descriptions.append(self._describe_planet(volume_liters, planet_index))
+        return descriptions
+
+    def describe_log10_many(self, log10_volumes):
+        """
+        Returns the comparison text for volumes given as log10 magnitudes. Volumes that fit in a
+        float are described exactly as describe_many would; larger ones are compared with the
+        largest planet, with the percentage in scientific notation.
+        """
+        log10_volumes = np.asarray(log10_volumes, dtype=np.float64)
+        in_float_range = log10_volumes < LOG10_FLOAT_MAX
+        descriptions = [None] * len(log10_volumes)
+        if in_float_range.any():
+            positions = np.flatnonzero(in_float_range)
+            for position, text in zip(positions.tolist(), self.describe_many(10**log10_volumes[positions])):
+                descriptions[position] = text
+
+        largest_name = self.planet_names[-1]
+        log10_largest = math.log10(self.planet_volumes[-1])
+        for position in np.flatnonzero(~in_float_range).tolist():
+            log10_value = float(log10_volumes[position])
+            if not math.isfinite(log10_value):
+                descriptions[position] = INFINITE_VOLUME_DESCRIPTION
+                continue
+            percentage = format_log10_number(log10_value - log10_largest + 2)
+            descriptions[position] = f"This volume could fill approximately {percentage}% of {largest_name}'s volume (or even more)!"
+        return descriptions
+
+    def next_fill_target(self, volume_liters):
+        """
+        Returns the smallest reference volume strictly larger than volume_liters, or 0 if there is none.
+        """
+        position = bisect.bisect_right(self.fill_target_list, volume_liters)
+        return self.fill_target_list[position] if position < len(self.fill_target_list) else 0
+
+    def next_fill_targets(self, volumes):
+        """
+        Vectorized next_fill_target: returns an array of targets, with 0 where none is larger.
+        """
+        positions = np.searchsorted(self.fill_targets, volumes, side='right')
+        padded_targets = np.append(self.fill_targets, 0.0)
+        return padded_targets[positions]
+
+
+def load_reference_catalog(path):
+    """
+    Builds a VolumeReferenceIndex from a user-supplied catalog file (.csv or .json) layered
+    on top of the built-in water bodies and planets.
+    Each record needs "name" and "volume_liters"; "kind" may be "water" (default) or "planet",
+    and water records may give "min_liters". A water body without min_liters describes
+    volumes from the next smaller catalog body up to its own volume. Catalog water bodies
+    take precedence over the built-in ranges where they overlap.
+    """
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as catalog_file:
+            records = json.load(catalog_file)
+    else:
+        with open(path, newline='', encoding='utf-8') as catalog_file:
+            records = list(csv.DictReader(catalog_file))
+
+    water_records = []
+    planets = dict(PLANET_VOLUMES)
+    for record in records:
+        name = str(record["name"]).strip()
+        volume = float(record["volume_liters"])
+        if volume <= 0:
+            raise ValueError(f"Reference volume for {name!r} must be positive.")
+        if (record.get("kind") or "water").strip().lower() == "planet":
+            planets[name] = volume
+        else:
+            min_liters = record.get("min_liters")
+            water_records.append((volume, name, float(min_liters) if min_liters not in (None, "") else None))
+
+    water_bodies = {}
+    previous_volume = 0
+    for volume, name, min_liters in sorted(water_records):
+        water_bodies[name] = {"min": previous_volume if min_liters is None else min_liters, "max": volume}
+        previous_volume = volume
+    for description, limits in WATER_BODY_VOLUMES.items():
+        water_bodies.setdefault(description, limits)
+
+    return VolumeReferenceIndex(water_bodies, planets)
+
+
+# Optional catalog of extra reference bodies (reservoirs, named lakes, ...), loaded once at startup.
+REFERENCE_CATALOG_PATH = os.environ.get("WVC_REFERENCE_CATALOG")
+if REFERENCE_CATALOG_PATH:
+    REFERENCE_INDEX = load_reference_catalog(REFERENCE_CATALOG_PATH)
+else:
+    REFERENCE_INDEX = VolumeReferenceIndex(WATER_BODY_VOLUMES, PLANET_VOLUMES)
+
+
+def describe_volume(volume_liters):
+    """
+    Compares the given volume in liters to known water body volumes and celestial bodies
+    and returns a descriptive string.
+    """
+    return REFERENCE_INDEX.describe(volume_liters)
+
+
+# Seconds per fill-rate time unit (a year is 365 days)
+TIME_UNIT_SECONDS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "year": 31536000,
+}
+
+# How a fill time, measured in the fill rate's own time unit, is shown: for each rate unit,
+# (upper bound, divisor, label) steps in increasing order.
+FILL_TIME_SCALES = {
+    "second": [(60, 1, "seconds"), (3600, 60, "minutes"), (86400, 3600, "hours"), (31536000, 86400, "days"), (math.inf, 31536000, "years")],
+    "minute": [(60, 1, "minutes"), (1440, 60, "hours"), (525600, 1440, "days"), (math.inf, 525600, "years")],
+    "hour": [(24, 1, "hours"), (8760, 24, "days"), (math.inf, 8760, "years")],
+    "day": [(365, 1, "days"), (math.inf, 365, "years")],
+    "year": [(math.inf, 1, "years")],
+}
+
+
+def parse_fill_rate(time_rate_liters_per_unit, time_unit):
+    """
+    Parses a fill rate once per calculation. Returns (rate, error): rate is None when no
+    rate or time unit was given, and error is "Invalid rate" when the rate is not a number.
+    Raises ValueError for a rate that is neither a number nor a string (e.g. a JSON list).
+    """
+    if time_rate_liters_per_unit is not None and (isinstance(time_rate_liters_per_unit, bool) or not isinstance(time_rate_liters_per_unit, (str, int, float))):
+        raise ValueError("The fill rate must be a number of liters per time unit.")
+    if not (time_rate_liters_per_unit and time_unit):
+        return None, None
+    try:
+        return float(time_rate_liters_per_unit), None
+    except ValueError:
+        return None, "Invalid rate"
+
+
+def fill_time_units(current_volumes, target_volumes, rate_per_unit_time_liters):
+    """
+    Vectorized numeric time to fill: (target - current) / rate, in the rate's own time unit.
+    Broadcasts current_volumes against target_volumes; NaN wherever calculate_time_to_fill
+    would not give a time (already filled, rate not positive, infinite volumes).
+    """
+    current_volumes = np.asarray(current_volumes, dtype=np.float64)
+    target_volumes = np.asarray(target_volumes, dtype=np.float64)
+    if not rate_per_unit_time_liters > 0:
+        return np.full(np.broadcast_shapes(current_volumes.shape, target_volumes.shape), np.nan)
+    with np.errstate(invalid='ignore'):
+        remaining = target_volumes - current_volumes
+        fillable = (current_volumes < target_volumes) & np.isfinite(current_volumes) & np.isfinite(target_volumes)
+        return np.where(fillable, remaining / rate_per_unit_time_liters, np.nan)
+
+
+def fill_time_seconds(current_volumes, target_volumes, rate_per_unit_time_liters, unit_time):
+    """
+    fill_time_units converted to seconds; all NaN for an unknown time unit.
+    """
+    seconds_per_unit = TIME_UNIT_SECONDS.get(unit_time, math.nan)
+    return fill_time_units(current_volumes, target_volumes, rate_per_unit_time_liters) * seconds_per_unit
+
+
+def fill_time_matrix(volumes, rate_per_unit_time_liters, unit_time):
+    """
+    Seconds to fill every reference body (columns, in REFERENCE_INDEX order) from every volume
+    in volumes (rows), in one vectorized pass with no string formatting. NaN where a body is
+    already filled or no time applies.
+    """
+    return fill_time_seconds(np.asarray(volumes, dtype=np.float64)[:, None], REFERENCE_INDEX.reference_volumes[None, :], rate_per_unit_time_liters, unit_time)
+
+
+def format_fill_time(time_units, unit_time):
+    """
+    Formats one numeric fill time (in the rate's time unit) for display, e.g. "~2.50 hours".
+    Scalar counterpart of format_fill_times, without NumPy.
+    """
+    scales = FILL_TIME_SCALES.get(unit_time)
+    if scales is None:
+        return "N/A (Invalid time unit)"
+    for limit, divisor, label in scales:
+        if time_units < limit:
+            break
+    return f"~{time_units / divisor:.2f} {label}"
+
+
+def format_fill_times(time_units, unit_time):
+    """
+    Formats numeric fill times (in the rate's time unit, as from fill_time_units) for display,
+    e.g. "~2.50 hours". Kept separate from the numeric computation so callers that only need
+    numbers never pay for it.
+    """
+    scales = FILL_TIME_SCALES.get(unit_time)
+    if scales is None:
+        return ["N/A (Invalid time unit)"] * len(time_units)
+    limits = np.array([limit for limit, _, _ in scales[:-1]])
+    steps = np.searchsorted(limits, time_units, side='right').tolist()
+    return [f"~{value / scales[step][1]:.2f} {scales[step][2]}" for value, step in zip(np.asarray(time_units).tolist(), steps)]
+
+
+def calculate_time_to_fill(current_volume, target_volume, rate_per_unit_time_liters, unit_time):
+    """
+    Calculates the estimated time to fill a target volume given a current volume and a rate.
+    Returns a formatted string or "N/A" if not applicable or calculation is impossible.
+    """
+    if current_volume >= target_volume:
+        return "Already filled or exceeded."
+    if rate_per_unit_time_liters <= 0:
+        return "Rate must be positive."
+    if target_volume == float('inf') or current_volume == float('inf'):
+        return "N/A (Target or current volume is infinite)"
+
+    remaining_volume = target_volume - current_volume
+    if remaining_volume <= 0:
+        return "Already filled or exceeded."
+    return format_fill_time(remaining_volume / rate_per_unit_time_liters, unit_time)
+
+
+def fill_time_columns(volumes, fill_targets, rate, rate_error, unit_time, formatted=True):
+    """
+    Computes the time_to_fill text and time_to_fill_seconds columns for an array of volumes
+    and their next fill targets. The seconds are computed for every row in one pass; only the
+    rows that have a time are formatted, and none at all unless formatted is set.
+    Seconds are None where no time applies.
+    """
+    count = len(volumes)
+    if rate_error:
+        return [rate_error] * count, [None] * count
+    texts = ["N/A"] * count
+    seconds = [None] * count
+    if rate is None:
+        return texts, seconds
+
+    fill_targets = np.asarray(fill_targets, dtype=np.float64)
+    # Rows with a next tier still above them; calculate_time_to_fill is only consulted for these.
+    pending = np.flatnonzero((fill_targets > 0) & (volumes < fill_targets))
+    if not len(pending):
+        return texts, seconds
+    if rate <= 0:
+        pending_texts = ["Rate must be positive."] * len(pending)
+    else:
+        units = fill_time_units(volumes[pending], fill_targets[pending], rate)
+        pending_texts = format_fill_times(units, unit_time) if formatted else []
+        if unit_time in TIME_UNIT_SECONDS:
+            for index, value in zip(pending.tolist(), (units * TIME_UNIT_SECONDS[unit_time]).tolist()):
+                seconds[index] = value
+    for index, text in zip(pending.tolist(), pending_texts):
+        texts[index] = text
+    return texts, seconds
+
+
+# Structural iteration cap. Whether a request this size may run is decided by the web app's
+# cost-based admission control, not by a fixed row count.
+MAX_ITERATIONS = 1_000_000
+MAGNITUDE_MODES = ("float", "log10")
+# Custom rules have no per-row closed form, so even a window computes the whole prefix
+MAX_RULE_ITERATIONS = 1_000_000
+# Most rows a single batch calculation may produce
+MAX_BATCH_ROWS = 1_000_000
+# Rows computed per block when a series is generated lazily (exports)
+CALCULATION_CHUNK_SIZE = 4096
+
+# Numeric volume columns in other units, available through fields=: (field, litres per unit)
+VOLUME_UNIT_COLUMNS = [
+    ("volume_cubic_meters", 1000.0),
+    ("volume_cubic_kilometers", 1e12),
+    ("volume_acre_feet", 1233481.83754752), # 43,560 cubic feet
+    ("volume_imperial_gallons", 4.54609),
+]
+# Litres to each unit above, so every requested unit column of a series is one (rows × units) product
+LITERS_TO_UNITS = 1.0 / np.array([liters_per_unit for _, liters_per_unit in VOLUME_UNIT_COLUMNS])
+
+# Row fields, in output order. Rows carry DEFAULT_ROW_FIELDS (plus volume_log10 in log10 mode)
+# unless a fields selection asks for others; "iteration" is always included.
+DEFAULT_ROW_FIELDS = ("iteration", "volume_liters_raw", "volume_liters", "volume_gallons", "description", "time_to_fill", "time_to_fill_seconds")
+ROW_FIELDS = DEFAULT_ROW_FIELDS + ("volume_log10",) + tuple(field for field, _ in VOLUME_UNIT_COLUMNS)
+
+
+def first_iteration_volume(initial_volume_liters):
+    """
+    Returns the iteration 1 volume, the squared initial volume, or inf if squaring overflows.
+    """
+    if abs(initial_volume_liters) > math.sqrt(sys.float_info.max):
+        return float('inf')
+    return initial_volume_liters * initial_volume_liters
+
+
+def compute_volume_series(initial_volume_liters, iterations, start=0):
+    """
+    Computes the raw volume (in liters) for iterations start+1..iterations in one array operation.
+    The series has the closed form V0² · 2^(i-1), so each element is the squared initial
+    volume scaled by a power of two. Values that overflow come out as inf.
+    """
+    first_volume = first_iteration_volume(initial_volume_liters)
+
+    # ldexp scales by exact powers of two, so this matches repeated doubling bit for bit,
+    # and anything past sys.float_info.max saturates to inf instead of wrapping or raising.
+    with np.errstate(over='ignore'):
+        return np.ldexp(first_volume, np.arange(start, iterations, dtype=np.int64))
+
+
+def compute_volume_log10_series(log10_initial_volume_liters, iterations, start=0):
+    """
+    Log-domain counterpart of compute_volume_series: returns log10 of the volume for
+    iterations start+1..iterations, i.e. 2·log10(V0) + (i-1)·log10(2). Never overflows, so it
+    stays meaningful for millions of iterations.
+    """
+    return 2 * log10_initial_volume_liters + np.arange(start, iterations, dtype=np.float64) * math.log10(2)
+
+
+def first_iterations_reaching(initial_volume_liters, target_volumes):
+    """
+    Inverse of compute_volume_series: for each target volume, returns the first iteration whose
+    volume is >= the target, found analytically with log2 rather than by generating the series.
+    initial_volume_liters may be a scalar or an array; it broadcasts against target_volumes, so an
+    (n, 1) column of initial volumes against T targets gives an (n, T) grid in one pass.
+    Returns an int64 array, with 0 where the target is never reached (the volume underflowed to zero).
+    """
+    target_volumes = np.asarray(target_volumes, dtype=np.float64)
+    initial_volume_liters = np.asarray(initial_volume_liters, dtype=np.float64)
+    with np.errstate(over='ignore'):
+        first_volume = np.where(np.abs(initial_volume_liters) > math.sqrt(sys.float_info.max), np.inf, initial_volume_liters * initial_volume_liters)
+    first_volume, target_volumes = np.broadcast_arrays(first_volume, target_volumes)
+
+    finite = (first_volume > 0) & np.isfinite(first_volume) & np.isfinite(target_volumes)
+    doublings = np.zeros(target_volumes.shape, dtype=np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        doublings[finite] = np.fmax(np.ceil(np.log2(target_volumes[finite]) - np.log2(first_volume[finite])), 0)
+    # log2 can be off by one ulp at exact powers of two; settle the boundary with exact ldexp checks.
+    with np.errstate(over='ignore', invalid='ignore'):
+        doublings += finite & (np.ldexp(first_volume, doublings) < target_volumes)
+        doublings -= finite & (doublings > 0) & (np.ldexp(first_volume, np.maximum(doublings - 1, 0)) >= target_volumes)
+
+    # An infinite target is reached when the series overflows; NaN is never reached.
+    overflow_doublings = np.maximum(1025 - np.frexp(first_volume)[1], 0)
+    reaches_inf = (target_volumes == np.inf) & (first_volume > 0) & np.isfinite(first_volume)
+    doublings[reaches_inf] = overflow_doublings[reaches_inf]
+    iterations = np.where(np.isnan(target_volumes) | np.isnan(first_volume), 0, doublings + 1)
+    # A series that underflowed to zero stays there, so only targets at or below zero are reached.
+    return np.where(first_volume <= 0, target_volumes <= first_volume, iterations).astype(np.int64)
+
+
+def find_milestones(initial_volume_liters, time_rate_liters_per_unit=None, time_unit=None):
+    """
+    For every reference body (each water body ceiling and each planet), returns the first iteration
+    at which the series reaches it and, given a fill rate, the time to fill it from empty at that rate.
+    Costs O(number of reference bodies), independent of how many iterations it takes.
+    """
+    iterations = first_iterations_reaching(initial_volume_liters, REFERENCE_INDEX.reference_volumes).tolist()
+
+    rate, rate_error = parse_fill_rate(time_rate_liters_per_unit, time_unit)
+    reference_volumes = REFERENCE_INDEX.reference_volumes
+    fill_units = fill_time_units(0.0, reference_volumes, rate).tolist() if rate is not None else [math.nan] * len(reference_volumes)
+    seconds_per_unit = TIME_UNIT_SECONDS.get(time_unit, math.nan)
+
+    milestones = []
+    reference_rows = zip(REFERENCE_INDEX.reference_names, REFERENCE_INDEX.reference_kinds, reference_volumes.tolist(), iterations, fill_units)
+    for name, kind, volume, iteration, units in reference_rows:
+        milestone = {
+            "name": name,
+            "kind": kind,
+            "volume_liters": volume,
+            "first_iteration": iteration or None,
+            "time_to_fill": "N/A",
+            "time_to_fill_units": None,
+            "time_to_fill_seconds": None,
+        }
+        if rate_error:
+            milestone["time_to_fill"] = rate_error
+        elif rate is not None:
+            milestone["time_to_fill"] = calculate_time_to_fill(0, volume, rate, time_unit)
+            if rate > 0:
+                milestone["time_to_fill_units"] = volume / rate
+            if not math.isnan(units * seconds_per_unit):
+                milestone["time_to_fill_seconds"] = units * seconds_per_unit
+        milestones.append(milestone)
+    return milestones
+
+
+CalculationInputs = namedtuple("CalculationInputs", [
+    "initial_volume",
+    "unit",
+    "iterations",
+    "initial_volume_liters",
+    "time_rate_liters_per_unit",
+    "time_unit",
+    "magnitude",
+    "fields",
+    "rule",
+], defaults=(None, None))
+
+
+def parse_row_fields(fields):
+    """
+    Normalizes a fields selection (a comma-separated string or a list of names) to a tuple in
+    ROW_FIELDS order, always including "iteration". Returns None when nothing was selected,
+    meaning the default fields. Raises ValueError for unknown or non-string names.
+    """
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    if not isinstance(fields, (list, tuple)) or not all(isinstance(field, str) for field in fields):
+        raise ValueError(f"Fields must be a comma-separated string or a list of field names: {', '.join(ROW_FIELDS)}.")
+    requested = {field.strip() for field in fields if field.strip()}
+    if not requested:
+        return None
+    unknown = sorted(requested.difference(ROW_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Use any of: {', '.join(ROW_FIELDS)}.")
+    requested.add("iteration")
+    return tuple(field for field in ROW_FIELDS if field in requested)
+
+
+def row_fields(inputs):
+    """
+    Returns the fields the rows of a validated calculation carry, in output order.
+    """
+    if inputs.fields:
+        return inputs.fields
+    return DEFAULT_ROW_FIELDS + ("volume_log10",) if inputs.magnitude == "log10" else DEFAULT_ROW_FIELDS
+
+
+def parse_compounding_rule(rule=None, growth_percent=None):
+    """
+    Returns the compiled custom compounding rule for a rule expression or a growth percentage,
+    or None for the built-in rule (square on iteration 1, then double).
+    """
+    if rule is not None and not isinstance(rule, str):
+        raise ValueError("A compounding rule must be an expression string, e.g. 'v * 1.05 + 1000'.")
+    if rule and growth_percent not in (None, ""):
+        raise ValueError("Give either a compounding rule or a growth percentage, not both.")
+    if rule:
+        return compile_rule(rule)
+    if growth_percent not in (None, ""):
+        return growth_rule(growth_percent)
+    return None
+
+
+@timed("parse")
+def parse_calculation_inputs(initial_volume_str, unit, iterations_str, time_rate_liters_per_unit=None, time_unit=None, magnitude="float", max_iterations=None, fields=None, rule=None, growth_percent=None):
+    """
+    Validates the raw calculation inputs and returns a CalculationInputs tuple.
+    Raises ValueError for invalid input, before any rows are computed.
+    max_iterations overrides the cap for callers that never build the whole series;
+    fields selects the row fields (see parse_row_fields); rule or growth_percent replace the
+    built-in compounding rule (see parse_compounding_rule).
+    """
+    initial_volume = float(initial_volume_str)
+    iterations = int(iterations_str)
+
+    if magnitude not in MAGNITUDE_MODES:
+        raise ValueError(f"Unknown magnitude mode '{magnitude}'. Use one of: {', '.join(MAGNITUDE_MODES)}.")
+    if max_iterations is None:
+        max_iterations = MAX_ITERATIONS
+    compounding_rule = parse_compounding_rule(rule, growth_percent)
+    # Only the rate's type is checked here; a non-numeric string is reported in the rows as "Invalid rate"
+    parse_fill_rate(time_rate_liters_per_unit, time_unit)
+    if compounding_rule is not None:
+        max_iterations = min(max_iterations, MAX_RULE_ITERATIONS)
+
+    if initial_volume <= 0 or iterations <= 0:
+        raise ValueError("Initial volume and iterations must be positive numbers.")
+    if iterations > max_iterations:
+        raise ValueError(f"Number of iterations cannot exceed {max_iterations:,} to prevent performance issues and ensure reasonable output.")
+
+    # Convert initial volume to liters
+    if unit == 'gallons':
+        initial_volume_liters = initial_volume * GALLONS_TO_LITERS
+    else: # litres
+        initial_volume_liters = initial_volume
+
+    return CalculationInputs(initial_volume, unit, iterations, initial_volume_liters, time_rate_liters_per_unit, time_unit, magnitude, parse_row_fields(fields), compounding_rule)
+
+
+@timed("series")
+def volume_series(inputs, stop, start=0):
+    """
+    Raw volumes of iterations start+1..stop of a validated calculation, under its compounding rule.
+    """
+    if inputs.rule is None:
+        return compute_volume_series(inputs.initial_volume_liters, stop, start)
+    return inputs.rule.series(inputs.initial_volume_liters, stop, start)
+
+
+@timed("series")
+def volume_log10_series(inputs, stop, start=0):
+    """
+    log10 of the volumes of iterations start+1..stop of a validated calculation, under its compounding rule.
+    """
+    log10_initial_volume_liters = math.log10(inputs.initial_volume) + (math.log10(GALLONS_TO_LITERS) if inputs.unit == 'gallons' else 0)
+    if inputs.rule is None:
+        return compute_volume_log10_series(log10_initial_volume_liters, stop, start)
+    return inputs.rule.log10_series(inputs.initial_volume_liters, log10_initial_volume_liters, stop, start)
+
+
+def volume_columns(volumes, fields=None):
+    """
+    Computes the derived columns for an array of raw volumes in vectorized passes: litres and
+    gallons text, comparison text and the next time-to-fill target, as a dict keyed by
+    volume_liters, volume_gallons, description and fill_targets. Only the columns that the
+    given row fields need are computed (all of them when fields is None). The array may hold
+    the rows of several calculations back to back, which is how batches share one pass.
+    """
+    fields = ROW_FIELDS if fields is None else fields
+    columns = {}
+    with stage("format"):
+        if "volume_liters" in fields:
+            columns["volume_liters"] = format_large_numbers_spoken(volumes, "Liters")
+        if "volume_gallons" in fields:
+            columns["volume_gallons"] = format_large_numbers_spoken(volumes / GALLONS_TO_LITERS, "Gallons")
+    if "description" in fields:
+        with stage("describe"):
+            columns["description"] = REFERENCE_INDEX.describe_many(volumes)
+    if "time_to_fill" in fields or "time_to_fill_seconds" in fields:
+        with stage("fill_time"):
+            columns["fill_targets"] = REFERENCE_INDEX.next_fill_targets(volumes)
+    return columns
+
+
+@timed("assemble")
+def assemble_columns(inputs, start, volumes, columns):
+    """
+    Builds the results for iterations start+1..start+len(volumes) of one validated calculation
+    from its raw volumes and the matching slice of volume_columns output, in columnar form:
+    a dict of one list per selected field, in row_fields order. Unselected fields are never built.
+    """
+    log_mode = inputs.magnitude == "log10"
+    fields = row_fields(inputs)
+    stop = start + len(volumes)
+    overflowed = np.isinf(volumes)
+
+    # Whether the row before each one had already overflowed
+    previous_overflowed = np.empty_like(overflowed)
+    previous_overflowed[1:] = overflowed[:-1]
+    if len(previous_overflowed):
+        previous_overflowed[0] = start > 0 and np.isinf(volume_series(inputs, start, start - 1)[0])
+
+    values = {"iteration": list(range(start + 1, stop + 1))}
+    if "volume_liters_raw" in fields:
+        values["volume_liters_raw"] = volumes.tolist()
+    for field in ("volume_liters", "volume_gallons", "description"):
+        if field in fields:
+            values[field] = list(columns[field])
+    unit_fields = [index for index, (field, _) in enumerate(VOLUME_UNIT_COLUMNS) if field in fields]
+    if unit_fields:
+        unit_values = volumes[:, None] * LITERS_TO_UNITS[unit_fields]
+        for position, index in enumerate(unit_fields):
+            values[VOLUME_UNIT_COLUMNS[index][0]] = unit_values[:, position].tolist()
+
+    if "time_to_fill" in fields or "time_to_fill_seconds" in fields:
+        # Time to fill the next tier above each row: parsed once, computed for all rows at once.
+        with stage("fill_time"):
+            rate, rate_error = parse_fill_rate(inputs.time_rate_liters_per_unit, inputs.time_unit)
+            values["time_to_fill"], values["time_to_fill_seconds"] = fill_time_columns(
+                volumes, columns["fill_targets"], rate, rate_error, inputs.time_unit, formatted="time_to_fill" in fields
+            )
+
+    beyond_float = np.flatnonzero(overflowed)
+    if log_mode or "volume_log10" in fields:
+        log10_volumes = volume_log10_series(inputs, stop, start)
+        values["volume_log10"] = log10_volumes.tolist()
+    if log_mode and len(beyond_float):
+        # Rows that still fit in a float keep their exact values; only the overflowed tail
+        # is formatted and described from the log10 magnitudes.
+        log10_beyond = log10_volumes[beyond_float]
+        beyond = beyond_float.tolist()
+        overflow_columns = {
+            "volume_liters": lambda: format_log10_volumes_spoken(log10_beyond, "Liters"),
+            "volume_gallons": lambda: format_log10_volumes_spoken(log10_beyond - math.log10(GALLONS_TO_LITERS), "Gallons"),
+            "description": lambda: REFERENCE_INDEX.describe_log10_many(log10_beyond),
+        }
+        for field, compute in overflow_columns.items():
+            if field in fields:
+                for index, value in zip(beyond, compute()):
+                    values[field][index] = value
+        for field in ("volume_liters_raw",) + tuple(VOLUME_UNIT_COLUMNS[index][0] for index in unit_fields):
+            if field in fields:
+                for index in beyond:
+                    values[field][index] = None
+    elif not log_mode:
+        # Once it's infinity, it stays infinity
+        infinite_row = {
+            "volume_liters_raw": float('inf'),
+            "volume_liters": "Infinity",
+            "volume_gallons": "Infinity",
+            "description": INFINITE_VOLUME_DESCRIPTION,
+            "time_to_fill": "N/A",
+            "time_to_fill_seconds": None,
+        }
+        for index in np.flatnonzero(previous_overflowed).tolist():
+            for field, value in infinite_row.items():
+                if field in fields:
+                    values[field][index] = value
+
+    return {field: values[field] for field in fields}
+
+
+@timed("rows")
+def columns_to_rows(columns):
+    """
+    Converts columnar results (a dict of equal-length lists) into the list of row dicts.
+    """
+    fields = list(columns)
+    return [dict(zip(fields, row)) for row in zip(*columns.values())]
+
+
+def assemble_rows(inputs, start, volumes, columns):
+    """
+    Row form of assemble_columns: a list of one dict per iteration.
+    """
+    return columns_to_rows(assemble_columns(inputs, start, volumes, columns))
+
+
+def calculate_columns(inputs, start, stop):
+    """
+    Builds the columnar results for iterations start+1..stop of a validated calculation.
+    Any slice of the series can be computed on its own, which is what lets exports
+    generate rows in bounded chunks.
+    """
+    volumes = volume_series(inputs, stop, start)
+    count_rows(len(volumes))
+    return assemble_columns(inputs, start, volumes, volume_columns(volumes, row_fields(inputs)))
+
+
+def calculate_rows(inputs, start, stop):
+    """
+    Builds the result rows for iterations start+1..stop of a validated calculation.
+    """
+    return columns_to_rows(calculate_columns(inputs, start, stop))
+
+
+def iter_calculation_column_chunks(inputs, chunk_size=None):
+    """
+    Lazily yields the columnar results of a validated calculation in blocks of at most
+    chunk_size iterations, so memory stays bounded for long series.
+    """
+    chunk_size = chunk_size or CALCULATION_CHUNK_SIZE
+    for start in range(0, inputs.iterations, chunk_size):
+        yield calculate_columns(inputs, start, min(start + chunk_size, inputs.iterations))
+
+
+def iter_calculation_chunks(inputs, chunk_size=None):
+    """
+    Lazily yields the result rows of a validated calculation as lists of at most
+    chunk_size rows, so memory stays bounded for long series.
+    """
+    for columns in iter_calculation_column_chunks(inputs, chunk_size):
+        yield columns_to_rows(columns)
+
+
+def iter_calculation_rows(inputs, chunk_size=None):
+    """
+    Lazily yields the result rows of a validated calculation one at a time.
+    """
+    for chunk in iter_calculation_chunks(inputs, chunk_size):
+        yield from chunk
+
+
+def perform_calculation(initial_volume_str, unit, iterations_str, time_rate_liters_per_unit=None, time_unit=None, magnitude="float", fields=None, columnar=False, rule=None, growth_percent=None):
+    """
+    Performs the water volume compounding calculation.
+    Returns a list of dictionaries with results or raises ValueError for invalid input.
+    Includes raw volume for charting (even if not used on frontend, kept for consistency/future).
+
+    With magnitude="log10" the series is also tracked as log10 magnitudes, so rows past the
+    float range keep real values instead of "Infinity". Each row then carries "volume_log10",
+    and "volume_liters_raw" is None where the volume no longer fits in a float.
+    fields limits the rows to the selected fields (see parse_row_fields); the others are never computed.
+    With columnar=True the results are returned as a dict of one list per field instead of rows.
+    rule (an expression in v and i) or growth_percent replace the built-in compounding rule.
+    """
+    try:
+        inputs = parse_calculation_inputs(initial_volume_str, unit, iterations_str, time_rate_liters_per_unit, time_unit, magnitude, fields=fields, rule=rule, growth_percent=growth_percent)
+        if columnar:
+            return calculate_columns(inputs, 0, inputs.iterations)
+        return calculate_rows(inputs, 0, inputs.iterations)
+
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during calculation: {e}", exc_info=True)
+        raise Exception("An internal error occurred during calculation.")
+
+
+def finite_json(value):
+    """
+    Returns a copy of a JSON-serializable value with every non-finite float replaced by None.
+    """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: finite_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite_json(item) for item in value]
+    return value
+
+
+def _scenario_error(error):
+    """
+    Returns the outcome of a batch scenario that failed: its own message for invalid input,
+    a generic one (logged) for anything unexpected.
+    """
+    if isinstance(error, (ValueError, TypeError)):
+        return {"error": str(error)}
+    logger.error(f"An unexpected error occurred during a batch scenario: {error}", exc_info=True)
+    return {"error": "An internal error occurred during calculation."}
+
+
+def perform_batch_calculation(scenarios):
+    """
+    Evaluates many calculations in one pass. scenarios is a list of dicts with the
+    perform_calculation fields (initial_volume, unit, iterations, time_rate, time_unit, magnitude,
+    fields, rule, growth_percent).
+
+    The series of all valid scenarios are laid out back to back as one ragged
+    scenarios × iterations array, computed with a single ldexp, and formatted, described
+    and matched to fill targets together before being split per scenario.
+    Returns a list aligned with scenarios holding {"results": rows} or {"error": message},
+    so one bad scenario, whether it fails validation or while its rows are assembled, does not
+    fail the batch. Raises ValueError if the batch as a whole
+    is too large.
+    """
+    outcomes = [None] * len(scenarios)
+    valid = []
+    for index, scenario in enumerate(scenarios):
+        try:
+            if not isinstance(scenario, dict):
+                raise ValueError("Each scenario must be an object of calculation fields.")
+            inputs = parse_calculation_inputs(
+                scenario.get('initial_volume', ''),
+                scenario.get('unit') or 'litres',
+                scenario.get('iterations', ''),
+                scenario.get('time_rate'),
+                scenario.get('time_unit'),
+                scenario.get('magnitude') or 'float',
+                fields=scenario.get('fields'),
+                rule=scenario.get('rule'),
+                growth_percent=scenario.get('growth_percent'),
+            )
+        except (ValueError, TypeError) as e:
+            outcomes[index] = {"error": str(e)}
+            continue
+        valid.append((index, inputs))
+
+    if not valid:
+        return outcomes
+
+    lengths = np.array([inputs.iterations for _, inputs in valid], dtype=np.int64)
+    if lengths.sum() > MAX_BATCH_ROWS:
+        raise ValueError(f"A batch cannot produce more than {MAX_BATCH_ROWS:,} rows in total.")
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    count_rows(int(offsets[-1]))
+
+    first_volumes = np.array([first_iteration_volume(inputs.initial_volume_liters) for _, inputs in valid])
+    exponents = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+    with np.errstate(over='ignore'):
+        volumes = np.ldexp(np.repeat(first_volumes, lengths), exponents)
+    # Scenarios with a custom rule overwrite their slice with that rule's series
+    for position, (index, inputs) in enumerate(valid):
+        if inputs.rule is not None:
+            try:
+                volumes[offsets[position]:offsets[position + 1]] = inputs.rule.series(inputs.initial_volume_liters, inputs.iterations)
+            except Exception as e:
+                outcomes[index] = _scenario_error(e)
+    columns = volume_columns(volumes, set().union(*(row_fields(inputs) for _, inputs in valid)))
+
+    for position, (index, inputs) in enumerate(valid):
+        if outcomes[index] is not None:
+            continue
+        lo, hi = offsets[position], offsets[position + 1]
+        try:
+            outcomes[index] = {"results": assemble_rows(inputs, 0, volumes[lo:hi], {name: column[lo:hi] for name, column in columns.items()})}
+        except Exception as e:
+            outcomes[index] = _scenario_error(e)
+    return outcomes
@@ -0,0 +1,425 @@
+"""
+Exports for the Water Volume Compounder.
+
+Writes columnar calculation results as CSV, Excel (.xlsx) or Parquet, either streamed chunk by
+chunk into a response or, through ExportJobQueue, in the background: a job is computed in a local
+process pool and the finished file is spooled to disk, next to a small JSON status file that any
+web worker can read, so large exports never hold up a request thread. Only the calculation core
+is imported, never Flask. openpyxl and pyarrow are only imported by the first export that needs
+them, which keeps them out of the web app's start-up time and memory until then (see
+load_export_libraries for preloading them instead).
+"""
+import csv
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO, StringIO
+
+from calculator import iter_calculation_column_chunks
+from metrics import METRICS, stage
+
+# Parquet export is optional; checking for pyarrow does not import it
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+logger = logging.getLogger(__name__)
+
+# Columns written by the export routes, in order, with their spreadsheet headers.
+EXPORT_COLUMNS = [
+    ("iteration", "Iteration"),
+    ("volume_liters", "Volume (Litres)"),
+    ("volume_gallons", "Volume (Gallons)"),
+    ("description", "Comparison"),
+    ("time_to_fill", "Time to Fill (Estimate)"),
+]
+# Headers for the other row fields an export can select with fields=
+EXPORT_HEADERS = dict(EXPORT_COLUMNS, **{
+    "volume_liters_raw": "Volume (Litres, Numeric)",
+    "time_to_fill_seconds": "Time to Fill (Seconds)",
+    "volume_log10": "Volume (log10 Litres)",
+    "volume_cubic_meters": "Volume (m³)",
+    "volume_cubic_kilometers": "Volume (km³)",
+    "volume_acre_feet": "Volume (Acre-Feet)",
+    "volume_imperial_gallons": "Volume (Imperial Gallons)",
+})
+# Row fields exported as text; the rest are numbers
+EXPORT_TEXT_FIELDS = {"volume_liters", "volume_gallons", "description", "time_to_fill"}
+EXPORT_FILENAME = "water_volume_compounding_results"
+EXPORT_SHEET_NAME = "Water Volume Compounding"
+EXPORT_STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class _ChunkSink:
+    """
+    Minimal write-only file object that buffers what a writer produces until drain() is called.
+    tell() reports the total bytes written, so formats that record offsets (Parquet) stay valid
+    even though the buffer is emptied as it is streamed.
+    """
+
+    def __init__(self):
+        self.buffer = BytesIO()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+def export_columns(fields=None):
+    """
+    Returns the (field, header) columns of an export: EXPORT_COLUMNS by default, or the
+    selected row fields in order.
+    """
+    if not fields:
+        return EXPORT_COLUMNS
+    return [(field, EXPORT_HEADERS[field]) for field in fields]
+
+
+def _chunk_records(chunk, columns):
+    return zip(*(chunk[key] for key, _ in columns))
+
+
+def stream_csv_export(chunks, columns=EXPORT_COLUMNS):
+    """
+    Yields a CSV export of columnar result chunks as encoded chunks while the rows are being generated.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for _, header in columns])
+    for chunk in chunks:
+        with stage("export_write"):
+            writer.writerows(_chunk_records(chunk, columns))
+        if buffer.tell() >= EXPORT_STREAM_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_xlsx_export(chunks, columns=EXPORT_COLUMNS):
+    """
+    Yields an .xlsx export of columnar result chunks. openpyxl's write-only mode streams rows to disk
+    as they are appended; the finished archive is spooled to a temporary file (in memory
+    while small) and sent from there, so memory stays flat as the row count grows.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(EXPORT_SHEET_NAME)
+    worksheet.append([header for _, header in columns])
+    for chunk in chunks:
+        with stage("export_write"):
+            for record in _chunk_records(chunk, columns):
+                worksheet.append(record)
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_STREAM_CHUNK_BYTES * 16) as spool:
+        with stage("export_save"):
+            workbook.save(spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(EXPORT_STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_parquet_export(chunks, columns=EXPORT_COLUMNS):
+    """
+    Yields a Parquet export of columnar result chunks, writing each chunk's columns as one
+    row group and sending its bytes as soon as it is written. Requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("iteration", pa.int64())] + [
+        (key, pa.string() if key in EXPORT_TEXT_FIELDS else pa.float64()) for key, _ in columns[1:]
+    ])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in chunks:
+            with stage("export_write"):
+                writer.write_table(pa.table({key: chunk[key] for key in schema.names}, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def load_export_libraries():
+    """
+    Imports the export libraries now instead of on the first export. A preloading server calls
+    this before forking, so its workers share the modules instead of each importing them.
+    """
+    importlib.import_module("openpyxl")
+    if PARQUET_AVAILABLE:
+        importlib.import_module("pyarrow.parquet")
+
+
+EXPORT_FORMATS = {
+    "xlsx": (stream_xlsx_export, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    "csv": (stream_csv_export, 'text/csv'),
+    "parquet": (stream_parquet_export, 'application/vnd.apache.parquet'),
+}
+
+
+# Export job states, in order; a job ends as done or failed
+EXPORT_JOB_STATES = ("queued", "running", "done", "failed")
+# A running job refreshes heartbeat_at in its status file at most this often
+EXPORT_HEARTBEAT_SECONDS = 5
+# A running job whose heartbeat is older than this is taken to have died with its pool process
+EXPORT_STALE_SECONDS = 60
+
+
+class ExportQueueFull(Exception):
+    """
+    Raised when too many export jobs are already pending in this process.
+    """
+
+
+def _write_json_atomic(path, value):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _observe_chunks(chunks, on_chunk):
+    for chunk in chunks:
+        on_chunk()
+        yield chunk
+
+
+def write_export_file(export_format, inputs, columns, path, on_chunk=None):
+    """
+    Writes a whole export of validated inputs to path atomically and returns its size in bytes.
+    on_chunk, if given, is called as every chunk of results is computed.
+    """
+    stream_export, _ = EXPORT_FORMATS[export_format]
+    chunks = iter_calculation_column_chunks(inputs)
+    if on_chunk is not None:
+        chunks = _observe_chunks(chunks, on_chunk)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in stream_export(chunks, columns):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+def run_export_job(spool_dir, job):
+    """
+    Runs one export job in a pool process, recording its progress in the job's status file and
+    refreshing its heartbeat while it writes.
+    """
+    status_path = os.path.join(spool_dir, f"{job['id']}.json")
+    now = time.time()
+    job = dict(job, status="running", started_at=now, heartbeat_at=now, worker_pid=os.getpid())
+    inputs, columns = job.pop("inputs"), job.pop("columns")
+    _write_json_atomic(status_path, job)
+
+    def heartbeat():
+        now = time.time()
+        if now - job["heartbeat_at"] >= EXPORT_HEARTBEAT_SECONDS:
+            job["heartbeat_at"] = now
+            _write_json_atomic(status_path, job)
+
+    try:
+        size = write_export_file(job["format"], inputs, columns, os.path.join(spool_dir, job["filename"]), heartbeat)
+        job.update(status="done", size=size)
+    except Exception as e:
+        logger.error(f"Export job {job['id']} failed: {e}", exc_info=True)
+        job.update(status="failed", error=str(e))
+    job["finished_at"] = time.time()
+    _write_json_atomic(status_path, job)
+    METRICS.write_snapshot()
+    return job
+
+
+class ExportJobQueue:
+    """
+    Background exports. Jobs are computed in a local process pool (started on first use) and
+    spooled to spool_dir as <job id>.<format>, with their state in <job id>.json, so status and
+    downloads can be answered by any process sharing the directory. Job IDs are chosen by the
+    caller from the normalized inputs, so resubmitting an identical export reuses its job.
+    Jobs older than ttl_seconds are removed, and at most max_pending jobs submitted by this
+    process may be queued or running at once.
+
+    A queued or running job records the pid of the process that submitted it (owner_pid) and,
+    once running, a heartbeat. If the job is not pending in this process and its owner has
+    exited, its heartbeat is older than EXPORT_STALE_SECONDS, or it was ours but its pool broke,
+    it is marked failed, so pollers stop waiting and resubmitting it starts it again.
+    """
+
+    def __init__(self, spool_dir, workers, max_pending, ttl_seconds):
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.pool = None
+        self.pending = {}
+        # Guards pool and pending, which request threads share
+        self.lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _status_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.json")
+
+    def _read_status(self, job_id):
+        try:
+            with open(self._status_path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_pending(self, job_id):
+        with self.lock:
+            future = self.pending.get(job_id)
+            return future is not None and not future.done()
+
+    def _is_stale(self, job):
+        if job["status"] not in ("queued", "running") or self._is_pending(job["id"]):
+            return False
+        owner_pid = job.get("owner_pid")
+        if owner_pid is None or owner_pid == os.getpid() or not _pid_alive(owner_pid):
+            return True
+        return job["status"] == "running" and time.time() - job["heartbeat_at"] > EXPORT_STALE_SECONDS
+
+    def _fail(self, job, error):
+        # The status file is re-read first, in case the job finished after it was last read
+        latest = self._read_status(job["id"])
+        if latest is None or latest["status"] not in ("queued", "running"):
+            return latest
+        latest.update(status="failed", error=error, finished_at=time.time())
+        _write_json_atomic(self._status_path(job["id"]), latest)
+        logger.warning(f"Export job {job['id']} failed: {error}")
+        return latest
+
+    def status(self, job_id):
+        """
+        Returns the job's status dict, or None if there is no such job. A stale queued or running
+        job is marked failed first.
+        """
+        job = self._read_status(job_id)
+        if job is not None and self._is_stale(job):
+            job = self._fail(job, "The export was interrupted before it finished. Please submit it again.")
+        return job
+
+    def file_path(self, job):
+        return os.path.join(self.spool_dir, job["filename"])
+
+    def submit(self, job_id, export_format, inputs, columns):
+        """
+        Queues an export and returns its status dict right away. An existing job with the same ID
+        is returned as is unless it failed. Raises ExportQueueFull.
+        """
+        self.prune()
+        job = self.status(job_id)
+        if job is not None and job["status"] != "failed":
+            if job["status"] != "done" or os.path.exists(self.file_path(job)):
+                return job
+
+        with self.lock:
+            if job_id in self.pending and not self.pending[job_id].done():
+                return self._read_status(job_id)
+            finished = [(key, future) for key, future in self.pending.items() if future.done()]
+            self.pending = {key: future for key, future in self.pending.items() if not future.done()}
+            if len(self.pending) >= self.max_pending:
+                raise ExportQueueFull(f"Too many exports are in progress (at most {self.max_pending}). Please retry shortly.")
+
+            job = {
+                "id": job_id,
+                "format": export_format,
+                "status": "queued",
+                "filename": f"{job_id}.{export_format}",
+                "submitted_at": time.time(),
+                "owner_pid": os.getpid(),
+            }
+            _write_json_atomic(self._status_path(job_id), job)
+            try:
+                self.pending[job_id] = self._pool().submit(run_export_job, self.spool_dir, dict(job, inputs=inputs, columns=columns))
+            except BrokenProcessPool:
+                # A pool process died and took the pool with it; start a fresh one
+                self._reset_pool()
+                self.pending[job_id] = self._pool().submit(run_export_job, self.spool_dir, dict(job, inputs=inputs, columns=columns))
+
+        # Jobs whose pool process died never wrote their final status
+        for key, future in finished:
+            if not future.cancelled() and future.exception() is not None:
+                self._fail({"id": key}, f"The export worker process failed: {future.exception()}")
+        return job
+
+    def _pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def _reset_pool(self):
+        # Every job left in the broken pool has failed too, and is marked so by status()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = None
+        self.pending = {key: future for key, future in self.pending.items() if not future.done()}
+
+    def prune(self):
+        """
+        Removes the status files and exports of jobs submitted more than ttl_seconds ago, except
+        jobs this process is still running.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith(".json"):
+                continue
+            job = self.status(name[:-len(".json")])
+            if job is None or job["submitted_at"] >= cutoff:
+                continue
+            if self._is_pending(job["id"]):
+                continue
+            for path in (self.file_path(job), self._status_path(job["id"])):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        jobs = [self.status(name[:-len(".json")]) for name in os.listdir(self.spool_dir) if name.endswith(".json")]
+        counts = {state: 0 for state in EXPORT_JOB_STATES}
+        for job in jobs:
+            if job is not None:
+                counts[job["status"]] += 1
+        with self.lock:
+            pending_in_process = sum(not future.done() for future in self.pending.values())
+        return dict(counts, pending_in_process=pending_in_process, workers=self.workers)
@@ -0,0 +1,27 @@
+"""
+gunicorn settings for the Water Volume Compounder, read automatically by `gunicorn app:app` when
+started from this directory.
+
+The app is preloaded: the master process imports app.py and builds the app once, with the
+reference tables, formatters and compiled template, then forks the workers, which share all of it
+copy-on-write and start serving at once. Set WVC_PRELOAD_APP=0 to load the app in every worker
+instead (gunicorn's --reload needs this). Every worker logs its start-up report when it is ready.
+"""
+import os
+
+preload_app = os.environ.get("WVC_PRELOAD_APP", "1") != "0"
+
+
+def post_worker_init(worker):
+    from app import STARTUP
+    from metrics import process_memory
+
+    rss = process_memory()["rss_bytes"]
+    worker.log.info(
+        "Worker %s ready: app import %.0f ms, create_app %.0f ms%s, RSS %s",
+        worker.pid,
+        STARTUP["import_seconds"] * 1000,
+        STARTUP["create_app_seconds"] * 1000,
+        " (preloaded)" if STARTUP["pid"] != worker.pid else "",
+        "unknown" if rss is None else f"{rss / 2**20:.1f} MiB",
+    )
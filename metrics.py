@@ -0,0 +1,269 @@
+"""
+Hot-path instrumentation for the Water Volume Compounder.
+
+Code marks the stages of its work with `with stage("name"):` or the @timed("name") decorator:
+input parsing, the volume series, number formatting, comparisons, fill times, row assembly,
+serialization and export writing. Every stage's duration goes into a per-process latency
+histogram, and into the current request's timings when one is being recorded (which is how the
+web app fills its Server-Timing header). Counters record rows computed and bytes sent. A stage
+costs two perf_counter calls and one short lock, and stages wrap whole vectorized chunks, never
+single rows, so instrumentation stays on in production. While a memory profile is running
+(profiling.py), the end of every stage is also a checkpoint in it.
+
+METRICS.render() returns everything in the Prometheus text format. With a snapshot directory
+(WVC_METRICS_DIR), every process also writes its metrics there at most once per
+snapshot_interval seconds, and render() adds up all processes' snapshots, so any gunicorn
+worker can answer for all of them and for the export pool. Only the standard library is used.
+"""
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from profiling import checkpoint
+
+# Latency histogram bucket upper bounds, in seconds
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Metric names (without the prefix) with their Prometheus type and help text
+METRIC_DEFINITIONS = {
+    "stage_seconds": ("histogram", "Time spent in each stage of a calculation or export (stages may nest)."),
+    "request_seconds": ("histogram", "Time to handle a request up to its response headers, by endpoint."),
+    "requests_total": ("counter", "Requests handled, by endpoint and status code."),
+    "rows_computed_total": ("counter", "Result rows computed."),
+    "response_bytes_total": ("counter", "Response body bytes sent, by endpoint."),
+}
+
+_request_timings = ContextVar("request_timings", default=None)
+
+try:
+    import resource
+except ImportError: # Peak memory is only reported on Unix
+    resource = None
+
+
+class MetricsRegistry:
+    """
+    Per-process histograms and counters keyed by metric name and a tuple of label pairs.
+    """
+
+    def __init__(self, prefix="wvc", snapshot_dir=None, snapshot_interval=1.0, enabled=True):
+        self.prefix = prefix
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.last_snapshot = 0.0
+        if snapshot_dir is not None:
+            os.makedirs(snapshot_dir, exist_ok=True)
+
+    def reset(self):
+        """
+        Forgets everything recorded so far. Runs in forked children (e.g. export pool processes),
+        so they do not report their parent's metrics a second time.
+        """
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.last_snapshot = 0.0
+
+    def observe(self, name, labels, seconds):
+        """
+        Records one duration in the histogram for name and labels (a tuple of (label, value) pairs).
+        """
+        index = bisect.bisect_left(STAGE_BUCKETS, seconds)
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [0] * (len(STAGE_BUCKETS) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+        self._maybe_snapshot()
+
+    def increment(self, name, labels=(), amount=1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + amount
+        self._maybe_snapshot()
+
+    def _maybe_snapshot(self):
+        if self.snapshot_dir is not None and time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self.write_snapshot()
+
+    def snapshot(self):
+        """
+        Returns this process's metrics as a JSON-serializable dict.
+        """
+        with self.lock:
+            return {
+                "histograms": [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+            }
+
+    def write_snapshot(self):
+        """
+        Writes this process's metrics to <snapshot_dir>/<pid>.json atomically.
+        """
+        if self.snapshot_dir is None:
+            return
+        self.last_snapshot = time.monotonic()
+        path = os.path.join(self.snapshot_dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _snapshots(self):
+        if self.snapshot_dir is None:
+            return [self.snapshot()]
+        self.write_snapshot()
+        snapshots = []
+        for name in os.listdir(self.snapshot_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.snapshot_dir, name), encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """
+        Returns all metrics (summed over every process's snapshot) in the Prometheus text format.
+        """
+        histograms = {}
+        counters = {}
+        for snapshot in self._snapshots():
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                histograms[key] = [a + b for a, b in zip(total, values)]
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+
+        lines = []
+        for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            if metric_type == "histogram":
+                for (metric, labels), values in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(STAGE_BUCKETS + (float("inf"),), values[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {values[-1]!r}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {cumulative}")
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{full_name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+METRICS = MetricsRegistry(
+    snapshot_dir=os.environ.get("WVC_METRICS_DIR") or None,
+    enabled=os.environ.get("WVC_METRICS_ENABLED", "1") != "0",
+)
+os.register_at_fork(after_in_child=METRICS.reset)
+
+
+class stage:
+    """
+    Context manager timing one stage of work into the stage_seconds histogram and the
+    current request's timings.
+    """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        checkpoint(self.name)
+        if not METRICS.enabled:
+            return
+        elapsed = time.perf_counter() - self.start
+        METRICS.observe("stage_seconds", (("stage", self.name),), elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as the given stage.
+    """
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count_rows(rows):
+    if METRICS.enabled:
+        METRICS.increment("rows_computed_total", amount=rows)
+
+
+def start_request_timings():
+    """
+    Starts recording stage timings for the current request (thread or context) and returns the
+    dict they accumulate in, as stage name -> seconds.
+    """
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def request_timings():
+    return _request_timings.get()
+
+
+def server_timing_header(timings, total=None):
+    """
+    Formats stage timings (seconds) as a Server-Timing header value, in milliseconds.
+    """
+    entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+def process_memory():
+    """
+    Returns this process's resident memory now and at its peak so far, in bytes, as
+    {"rss_bytes", "peak_rss_bytes"}; either is None where the platform does not report it.
+    """
+    rss = None
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    peak = None
+    if resource is not None:
+        # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {"rss_bytes": rss, "peak_rss_bytes": peak}
@@ -0,0 +1,197 @@
+"""
+Opt-in memory profiling for the Water Volume Compounder.
+
+A profile traces one piece of work (in the web app, one request and its response body) with
+tracemalloc and reports how much it allocated: the peak above what was allocated when it started,
+what was still allocated when it finished, the live memory after each stage (see metrics.stage)
+and the top allocation sites at the high-water mark and at the end. Short-lived allocations, such
+as the rows of a chunk that are serialized and dropped, only show up in the peak and in the sites
+at the high-water mark, which is why snapshots are also taken at stage boundaries as memory grows.
+
+tracemalloc slows every allocation in the process and is process-wide, so it only runs while a
+profile does, one profile runs at a time per process, and allocations made meanwhile by other
+threads are counted too: profile on a quiet worker. Only the standard library is used.
+"""
+import itertools
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextvars import ContextVar
+
+PROFILE_TOP_SITES = 10
+# Most recent reports kept per process
+PROFILE_KEEP_REPORTS = 50
+# A new high-water snapshot is taken once live memory grows by this fraction over the last one
+PROFILE_SNAPSHOT_GROWTH = 0.25
+PROFILE_MIN_SNAPSHOT_BYTES = 64 * 1024
+
+_active_profile = ContextVar("memory_profile", default=None)
+# Allocation sites left out of reports: the profiler's own. They are skipped after grouping, as
+# Snapshot.filter_traces matches every trace in Python and would dominate a large profile.
+_IGNORED_FILES = {tracemalloc.__file__, __file__, "<unknown>"}
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot()
+
+
+def _top_sites(snapshot, baseline, top):
+    """
+    Returns the top allocation sites (file:line) by bytes allocated in snapshot but not in baseline.
+    """
+    sites = []
+    for statistic in snapshot.compare_to(baseline, "lineno"):
+        frame = statistic.traceback[0]
+        if statistic.size_diff <= 0 or frame.filename in _IGNORED_FILES:
+            continue
+        sites.append({"site": f"{frame.filename}:{frame.lineno}", "bytes": statistic.size_diff, "blocks": statistic.count_diff})
+        if len(sites) == top:
+            break
+    return sites
+
+
+class MemoryProfile:
+    """
+    One running profile. checkpoint(stage) is called at the end of every stage while it runs.
+    """
+
+    def __init__(self, profile_id, label, top):
+        self.id = profile_id
+        self.label = label
+        self.top = top
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.baseline_snapshot = _snapshot()
+        self.baseline_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self.stages = {}
+        self.high_water_bytes = 0
+        self.high_water_stage = None
+        self.high_water_snapshot = None
+
+    def checkpoint(self, stage):
+        live = tracemalloc.get_traced_memory()[0] - self.baseline_bytes
+        self.stages[stage] = max(self.stages.get(stage, live), live)
+        if live >= max(self.high_water_bytes * (1 + PROFILE_SNAPSHOT_GROWTH), PROFILE_MIN_SNAPSHOT_BYTES):
+            # Taking a snapshot is cheap and is not itself traced; grouping it into sites is
+            # slow, so that waits for the report
+            self.high_water_bytes = live
+            self.high_water_stage = stage
+            self.high_water_snapshot = _snapshot()
+
+    def report(self):
+        current, peak = tracemalloc.get_traced_memory()
+        final_snapshot = _snapshot()
+        final_sites = _top_sites(final_snapshot, self.baseline_snapshot, self.top)
+        high_water_sites = final_sites
+        if self.high_water_snapshot is not None:
+            high_water_sites = _top_sites(self.high_water_snapshot, self.baseline_snapshot, self.top)
+        return {
+            "id": self.id,
+            "label": self.label,
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "duration_seconds": time.perf_counter() - self.started,
+            "peak_bytes": peak - self.baseline_bytes,
+            "retained_bytes": current - self.baseline_bytes,
+            "high_water_stage": self.high_water_stage,
+            "stage_live_bytes": self.stages,
+            "top_sites_at_high_water": high_water_sites,
+            "top_sites_retained": final_sites,
+        }
+
+
+class MemoryProfiler:
+    """
+    Starts and finishes profiles, at most one at a time, and keeps the most recent reports.
+    frames is the traceback depth tracemalloc records (sites are reported by their innermost frame).
+    """
+
+    def __init__(self, frames=1, top=PROFILE_TOP_SITES, keep=PROFILE_KEEP_REPORTS):
+        self.frames = frames
+        self.top = top
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+        self.ids = itertools.count(1)
+        self.reports = OrderedDict()
+        self.started_tracing = False
+
+    def start(self, label):
+        """
+        Starts profiling the current thread or context and returns the profile, or None if
+        another profile is already running in this process.
+        """
+        if not self.running.acquire(blocking=False):
+            return None
+        try:
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start(self.frames)
+            profile = MemoryProfile(f"{os.getpid()}-{next(self.ids)}", label, self.top)
+        except BaseException:
+            self._stop_tracing()
+            raise
+        _active_profile.set(profile)
+        return profile
+
+    def finish(self, profile):
+        """
+        Finishes a profile started by start() and returns its report.
+        """
+        try:
+            _active_profile.set(None)
+            report = profile.report()
+        finally:
+            self._stop_tracing()
+        with self.lock:
+            self.reports[report["id"]] = report
+            while len(self.reports) > self.keep:
+                self.reports.popitem(last=False)
+        return report
+
+    def _stop_tracing(self):
+        # Tracing started outside the profiler (e.g. PYTHONTRACEMALLOC) is left running
+        if self.started_tracing:
+            tracemalloc.stop()
+        self.started_tracing = False
+        self.running.release()
+
+    def get(self, profile_id):
+        with self.lock:
+            return self.reports.get(profile_id)
+
+    def recent(self):
+        """
+        Returns the kept reports, newest first, without their allocation sites.
+        """
+        with self.lock:
+            reports = list(reversed(self.reports.values()))
+        return [{key: value for key, value in report.items() if not key.startswith("top_sites")} for report in reports]
+
+
+PROFILER = MemoryProfiler(frames=int(os.environ.get("WVC_MEMORY_PROFILE_FRAMES", 1)))
+
+
+def checkpoint(stage):
+    """
+    Records the end of a stage in the current context's profile, if one is running.
+    """
+    profile = _active_profile.get()
+    if profile is not None:
+        profile.checkpoint(stage)
+
+
+def format_report(report):
+    """
+    Formats a report as one log line: peak and retained memory and the top site at the high-water mark.
+    """
+    sites = report["top_sites_at_high_water"]
+    top_site = f"{sites[0]['site']} ({sites[0]['bytes'] / 1024:.1f} KiB)" if sites else "none"
+    return (
+        f"Memory profile {report['id']} {report['label']}: peak {report['peak_bytes'] / 1024:.1f} KiB, "
+        f"retained {report['retained_bytes'] / 1024:.1f} KiB, high water after {report['high_water_stage'] or 'n/a'}, "
+        f"top site {top_site}"
+    )
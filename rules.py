@@ -0,0 +1,357 @@
+"""
+Custom compounding rules for the Water Volume Compounder.
+
+A rule gives each iteration's volume from the previous one: an arithmetic expression in v (the
+previous volume, in litres) and i (the iteration number, from 1), e.g. "v * 1.05 + 1000" or
+"v * 2 if i % 2 else v". Starting from v = the initial volume, iteration i's volume is the rule
+applied to iteration i-1's. Expressions are parsed with ast and checked against a small grammar
+(no names besides v, i, pi and e; no attribute access; only whitelisted math functions), never
+evaluated with eval. A rule must be linear in v, v_i = a(i) * v_{i-1} + b(i), which is what lets
+the whole series be computed as array operations (cumulative products and sums) instead of
+stepping through it row by row. Compiled rules are cached by expression text.
+"""
+import ast
+import math
+import numpy as np
+from functools import lru_cache
+
+MAX_RULE_LENGTH = 200
+MAX_RULE_NODES = 100
+# Iterations per block when a series has to be computed piecewise (see CompoundingRule.series).
+# Small enough that a factor of 2^±3 per iteration keeps the products in the normal float range.
+SERIES_BLOCK_SIZE = 256
+# Most the terms of a closed-form prefix sum may exceed its value by before it is recomputed
+# step by step; the relative error is at most about this times the float epsilon.
+SERIES_CANCELLATION_LIMIT = 1e3
+_FLOAT_TINY = np.finfo(np.float64).tiny
+_FLOAT_MAX = np.finfo(np.float64).max
+
+RULE_CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+}
+RULE_FUNCTIONS = {
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log2": np.log2,
+    "log10": np.log10,
+    "abs": np.abs,
+    "floor": np.floor,
+    "ceil": np.ceil,
+    "min": np.minimum,
+    "max": np.maximum,
+}
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+}
+_COMPARISONS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+
+def _constant(value):
+    return lambda i: value
+
+
+class _Affine:
+    """
+    A compiled subexpression a(i) * v + b(i). a and b are functions of the iteration array,
+    or None where the coefficient is identically zero.
+    """
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    @property
+    def constant(self):
+        return self.a is None
+
+    def value(self):
+        return self.b or _constant(0.0)
+
+
+def _combine(first, second, operator):
+    if first is None:
+        return second if operator is np.add or second is None else (lambda i: operator(0.0, second(i)))
+    if second is None:
+        return first
+    return lambda i: operator(first(i), second(i))
+
+
+def _scale(term, factor, operator):
+    if term is None:
+        return None
+    return lambda i: operator(term(i), factor(i))
+
+
+class _RuleCompiler:
+    """
+    Turns a parsed rule expression into an _Affine, rejecting anything outside the rule grammar.
+    """
+
+    def compile(self, node):
+        method = getattr(self, f"_compile_{type(node).__name__}", None)
+        if method is None:
+            raise ValueError(f"'{type(node).__name__}' is not allowed in a compounding rule.")
+        return method(node)
+
+    def _compile_constant_part(self, node, what):
+        term = self.compile(node)
+        if not term.constant:
+            raise ValueError(f"{what} cannot depend on v; the rule must be linear in v (e.g. 'v * 1.05 + 1000').")
+        return term.value()
+
+    def _compile_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError("Only numbers are allowed as constants in a compounding rule.")
+        return _Affine(None, _constant(float(node.value)))
+
+    def _compile_Name(self, node):
+        if node.id == "v":
+            return _Affine(_constant(1.0), None)
+        if node.id == "i":
+            return _Affine(None, lambda i: i)
+        if node.id in RULE_CONSTANTS:
+            return _Affine(None, _constant(RULE_CONSTANTS[node.id]))
+        raise ValueError(f"Unknown name '{node.id}' in compounding rule. Use v (previous volume) and i (iteration).")
+
+    def _compile_UnaryOp(self, node):
+        operand = self.compile(node.operand)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(node.op, ast.USub):
+            return _Affine(_scale(operand.a, _constant(-1.0), np.multiply), _scale(operand.b, _constant(-1.0), np.multiply))
+        if isinstance(node.op, ast.Not):
+            value = self._compile_constant_part(node.operand, "A condition")
+            return _Affine(None, lambda i: np.logical_not(value(i)))
+        raise ValueError("Unsupported unary operator in compounding rule.")
+
+    def _compile_BinOp(self, node):
+        operator = _BINARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            raise ValueError("Unsupported operator in compounding rule.")
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        if operator in (np.add, np.subtract):
+            return _Affine(_combine(left.a, right.a, operator), _combine(left.b, right.b, operator))
+        if operator is np.multiply:
+            if left.constant:
+                left, right = right, left
+            if not right.constant:
+                raise ValueError("v cannot be multiplied by itself; the rule must be linear in v (e.g. 'v * 1.05 + 1000').")
+            factor = right.value()
+            return _Affine(_scale(left.a, factor, np.multiply), _scale(left.b, factor, np.multiply))
+        if operator is np.divide:
+            divisor = self._compile_constant_part(node.right, "A divisor")
+            return _Affine(_scale(left.a, divisor, np.divide), _scale(left.b, divisor, np.divide))
+        # **, // and % only apply to the parts that do not involve v
+        if not (left.constant and right.constant):
+            raise ValueError("**, // and % cannot involve v; the rule must be linear in v (e.g. 'v * 1.05 + 1000').")
+        base, other = left.value(), right.value()
+        return _Affine(None, lambda i: operator(base(i), other(i)))
+
+    def _compile_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in RULE_FUNCTIONS or node.keywords:
+            raise ValueError(f"Only these functions are allowed in a compounding rule: {', '.join(RULE_FUNCTIONS)}.")
+        function = RULE_FUNCTIONS[node.func.id]
+        arguments = [self._compile_constant_part(argument, "A function argument") for argument in node.args]
+        expected = 2 if function in (np.minimum, np.maximum) else 1
+        if len(arguments) != expected:
+            raise ValueError(f"{node.func.id}() takes {expected} argument(s) in a compounding rule.")
+        return _Affine(None, lambda i: function(*(argument(i) for argument in arguments)))
+
+    def _compile_Compare(self, node):
+        operands = [self._compile_constant_part(operand, "A condition") for operand in [node.left] + node.comparators]
+        operators = [_COMPARISONS.get(type(op)) for op in node.ops]
+        if None in operators:
+            raise ValueError("Unsupported comparison in compounding rule.")
+
+        def compare(i):
+            values = [operand(i) for operand in operands]
+            result = True
+            for operator, left, right in zip(operators, values, values[1:]):
+                result = np.logical_and(result, operator(left, right))
+            return result
+        return _Affine(None, compare)
+
+    def _compile_BoolOp(self, node):
+        values = [self._compile_constant_part(value, "A condition") for value in node.values]
+        operator = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+        def combine(i):
+            result = values[0](i)
+            for value in values[1:]:
+                result = operator(result, value(i))
+            return result
+        return _Affine(None, combine)
+
+    def _compile_IfExp(self, node):
+        test = self._compile_constant_part(node.test, "A condition")
+        body = self.compile(node.body)
+        orelse = self.compile(node.orelse)
+
+        def choose(first, second):
+            if first is None and second is None:
+                return None
+            first, second = first or _constant(0.0), second or _constant(0.0)
+            return lambda i: np.where(test(i), first(i), second(i))
+        return _Affine(choose(body.a, orelse.a), choose(body.b, orelse.b))
+
+
+def _closed_form(initial_volume, a, b, check=True):
+    """
+    Computes v_n = a_n · v_{n-1} + b_n from v_0 = initial_volume as P_n · (v_0 + Σ b_k / P_k),
+    P = cumprod(a). With check, returns None where that is not accurate: when P leaves the
+    normal float range (b_k / P_k would overflow, or P loses precision) or when the sum
+    cancels, i.e. its terms are much larger than its value (e.g. "v * 2 - 1" from 1, where
+    v_0 + Σ b_k / P_k shrinks to 2^-n).
+    """
+    with np.errstate(all='ignore'):
+        products = np.cumprod(a)
+        if check:
+            magnitudes = np.abs(products)
+            if not (magnitudes.min() >= _FLOAT_TINY and magnitudes.max() <= _FLOAT_MAX):
+                return None
+        if b is None:
+            return initial_volume * products
+        terms = b / products
+        totals = initial_volume + np.cumsum(terms)
+        if check:
+            # A running sum of magnitudes, so its last entry is the largest (or NaN)
+            bounds = abs(initial_volume) + np.cumsum(np.abs(terms))
+            if not (math.isfinite(bounds[-1]) and np.all(bounds <= SERIES_CANCELLATION_LIMIT * np.abs(totals))):
+                return None
+        return products * totals
+
+
+def _step(initial_volume, a, b):
+    """
+    Steps the recurrence v_n = a_n · v_{n-1} + b_n one iteration at a time.
+    """
+    volumes = np.empty(len(a), dtype=np.float64)
+    volume = initial_volume
+    if b is None:
+        for index, factor in enumerate(a.tolist()):
+            volume = factor * volume
+            volumes[index] = volume
+        return volumes
+    for index, (factor, addend) in enumerate(zip(a.tolist(), b.tolist())):
+        volume = factor * volume + addend
+        volumes[index] = volume
+    return volumes
+
+
+class CompoundingRule:
+    """
+    A compiled compounding rule, v_i = a(i) * v_{i-1} + b(i). text is the normalized expression,
+    which is what cache keys use.
+    """
+
+    def __init__(self, text, multiplier, addend):
+        self.text = text
+        self._multiplier = multiplier or _constant(0.0)
+        self._addend = addend
+
+    def __reduce__(self):
+        # The compiled coefficient functions are closures; other processes recompile from the text
+        return compile_rule, (self.text,)
+
+    def coefficients(self, stop):
+        """
+        Returns the a and b coefficient arrays for iterations 1..stop (b is None if always zero).
+        """
+        iterations = np.arange(1, stop + 1, dtype=np.float64)
+        with np.errstate(all='ignore'):
+            a = np.broadcast_to(np.asarray(self._multiplier(iterations), dtype=np.float64), iterations.shape)
+            b = None
+            if self._addend is not None:
+                b = np.broadcast_to(np.asarray(self._addend(iterations), dtype=np.float64), iterations.shape)
+                if not b.any():
+                    b = None
+        return a, b
+
+    def series(self, initial_volume_liters, stop, start=0):
+        """
+        Computes the volumes of iterations start+1..stop. There is no closed form per row, so the
+        prefix 1..start is computed too, but as whole-array operations: a cumulative product
+        for multiplicative rules, and v_n = P_n · (v_0 + Σ b_k / P_k) with P = cumprod(a)
+        otherwise (see _closed_form). Where that is not accurate over the whole series, it is
+        applied in blocks of SERIES_BLOCK_SIZE iterations, each anchored at the previous
+        block's last volume, and only blocks where even that fails are stepped through in a loop.
+        """
+        a, b = self.coefficients(stop)
+        volumes = _closed_form(initial_volume_liters, a, b)
+        if volumes is not None:
+            return volumes[start:stop]
+        volumes = np.empty(stop, dtype=np.float64)
+        volume = initial_volume_liters
+        for block_start in range(0, stop, SERIES_BLOCK_SIZE):
+            if not math.isfinite(volume):
+                # Once the series has overflowed, the rest is ±inf or NaN however it is computed
+                rest = slice(block_start, stop)
+                volumes[rest] = _closed_form(volume, a[rest], None if b is None else b[rest], check=False)
+                break
+            block = slice(block_start, min(block_start + SERIES_BLOCK_SIZE, stop))
+            block_a, block_b = a[block], None if b is None else b[block]
+            block_volumes = _closed_form(volume, block_a, block_b)
+            if block_volumes is None:
+                block_volumes = _step(volume, block_a, block_b)
+            volumes[block] = block_volumes
+            volume = float(block_volumes[-1])
+        return volumes[start:stop]
+
+    def log10_series(self, initial_volume_liters, log10_initial_volume_liters, stop, start=0):
+        """
+        Computes log10 of the volumes of iterations start+1..stop. Multiplicative rules with
+        positive factors are summed in log space and never overflow; other rules take log10
+        of the float series.
+        """
+        a, b = self.coefficients(stop)
+        with np.errstate(all='ignore'):
+            if b is None and np.all(a > 0):
+                return (log10_initial_volume_liters + np.cumsum(np.log10(a)))[start:stop]
+            return np.log10(self.series(initial_volume_liters, stop, start))
+
+
+@lru_cache(maxsize=256)
+def compile_rule(text):
+    """
+    Parses and compiles a compounding rule expression, cached by its text.
+    Raises ValueError if the expression is not a valid rule.
+    """
+    text = text.strip()
+    if not text:
+        raise ValueError("The compounding rule is empty.")
+    if len(text) > MAX_RULE_LENGTH:
+        raise ValueError(f"A compounding rule cannot be longer than {MAX_RULE_LENGTH} characters.")
+    try:
+        tree = ast.parse(text, mode="eval")
+    except SyntaxError:
+        raise ValueError(f"'{text}' is not a valid compounding rule expression.")
+    if sum(1 for _ in ast.walk(tree)) > MAX_RULE_NODES:
+        raise ValueError("The compounding rule is too complex.")
+    compiled = _RuleCompiler().compile(tree.body)
+    return CompoundingRule(ast.unparse(tree), compiled.a, compiled.b)
+
+
+def growth_rule(growth_percent):
+    """
+    Returns the rule for a fixed growth percentage per iteration, e.g. 5 for v * 1.05.
+    """
+    growth_percent = float(growth_percent)
+    if not math.isfinite(growth_percent):
+        raise ValueError("Growth percentage must be a finite number.")
+    return compile_rule(f"v * {1 + growth_percent / 100!r}")
@@ -0,0 +1,318 @@
+"""
+Parameter sweeps for the Water Volume Compounder.
+
+Sweeps a grid of initial volumes × fill rates × time units and, for every combination, records the
+first iteration that reaches each reference body and the time to fill that body from empty at the
+fill rate. The grid is split into chunks of consecutive combinations; each chunk is computed as one
+vectorized NumPy pass in a worker process and written to its own part file, so a sweep of millions
+of combinations runs on every core with flat memory. A manifest records the grid, so an interrupted
+sweep picks up where it stopped when rerun with the same arguments.
+
+Example:
+    python sweep.py --volume-range 1 1e6 1000000 --rates 10 1000 --time-units second hour --output sweep_out
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from calculator import GALLONS_TO_LITERS, REFERENCE_INDEX, TIME_UNIT_SECONDS, first_iterations_reaching
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Parquet output is optional
+    pa = None
+    pq = None
+
+SWEEP_FORMATS = ("csv", "parquet")
+SWEEP_CHUNK_SIZE = 100_000
+SWEEP_MANIFEST = "manifest.json"
+# Bumped whenever the part file layout changes, so old sweeps are not resumed into new ones.
+SWEEP_VERSION = "1"
+
+
+def expand_axis(spec):
+    """
+    Expands an axis spec into a float64 array. A spec is a list of values, {"values": [...]},
+    {"linspace": [start, stop, count]} or {"logspace": [start, stop, count]} (start and stop are
+    the values themselves, not their exponents).
+    """
+    if isinstance(spec, (list, tuple)):
+        spec = {"values": list(spec)}
+    if "values" in spec:
+        values = np.asarray(spec["values"], dtype=np.float64)
+    elif "linspace" in spec:
+        start, stop, count = spec["linspace"]
+        values = np.linspace(float(start), float(stop), int(count))
+    elif "logspace" in spec:
+        start, stop, count = spec["logspace"]
+        if float(start) <= 0 or float(stop) <= 0:
+            raise ValueError("A logspace axis needs positive start and stop values.")
+        values = np.geomspace(float(start), float(stop), int(count))
+    else:
+        raise ValueError("An axis needs one of 'values', 'linspace' or 'logspace'.")
+    if values.ndim != 1 or values.size == 0:
+        raise ValueError("An axis needs at least one value.")
+    return values
+
+
+def reference_column_names():
+    """
+    Returns one column slug per reference body, in REFERENCE_INDEX order (sorted by volume).
+    """
+    names = []
+    seen = set()
+    for name in REFERENCE_INDEX.reference_names:
+        slug = re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_") or "reference"
+        candidate = slug
+        suffix = 2
+        while candidate in seen:
+            candidate = f"{slug}_{suffix}"
+            suffix += 1
+        seen.add(candidate)
+        names.append(candidate)
+    return names
+
+
+class SweepGrid:
+    """
+    An initial volumes × fill rates × time units grid. Only the axis specs are stored (and pickled
+    to workers); the axes are expanded on first use. Combination k is row k of the C-ordered grid.
+    """
+
+    def __init__(self, volumes, rates, time_units, unit="litres"):
+        if unit not in ("litres", "gallons"):
+            raise ValueError("Unit must be 'litres' or 'gallons'.")
+        time_units = list(time_units)
+        unknown = [t for t in time_units if t not in TIME_UNIT_SECONDS]
+        if not time_units or unknown:
+            raise ValueError(f"Time units must be among: {', '.join(TIME_UNIT_SECONDS)}.")
+        self.volume_spec = volumes
+        self.rate_spec = rates
+        self.time_units = time_units
+        self.unit = unit
+        self._axes = None
+
+    def axes(self):
+        if self._axes is None:
+            self._axes = (expand_axis(self.volume_spec), expand_axis(self.rate_spec), np.array(self.time_units))
+        return self._axes
+
+    @property
+    def shape(self):
+        volumes, rates, time_units = self.axes()
+        return (volumes.size, rates.size, time_units.size)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_axes"] = None
+        return state
+
+    def describe(self):
+        """
+        Returns the JSON-able identity of the sweep, stored in the manifest and checked on resume.
+        """
+        return {
+            "version": SWEEP_VERSION,
+            "volumes": self.volume_spec,
+            "rates": self.rate_spec,
+            "time_units": self.time_units,
+            "unit": self.unit,
+            "references": [[name, volume] for name, volume in zip(REFERENCE_INDEX.reference_names, REFERENCE_INDEX.reference_volumes.tolist())],
+        }
+
+
+def compute_sweep_chunk(grid, start, stop):
+    """
+    Computes combinations start..stop-1 of the grid as an ordered dict of columns:
+    the inputs, then <reference>_first_iteration (0 if never reached) and <reference>_fill_seconds
+    (time to fill from empty at the rate; NaN unless the rate is positive) for every reference body.
+    """
+    volumes, rates, time_units = grid.axes()
+    volume_idx, rate_idx, time_unit_idx = np.unravel_index(np.arange(start, stop), grid.shape)
+
+    # Iterations depend only on the volume, and a chunk spans a contiguous run of volumes.
+    first_volume_idx = volume_idx[0]
+    chunk_volumes = volumes[first_volume_idx:volume_idx[-1] + 1]
+    chunk_volumes_liters = chunk_volumes * GALLONS_TO_LITERS if grid.unit == 'gallons' else chunk_volumes
+    iterations = first_iterations_reaching(chunk_volumes_liters[:, None], REFERENCE_INDEX.reference_volumes)
+    iterations = iterations[volume_idx - first_volume_idx]
+
+    row_rates = rates[rate_idx]
+    unit_seconds = np.array([TIME_UNIT_SECONDS[t] for t in time_units], dtype=np.float64)[time_unit_idx]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        seconds_per_liter = np.where(row_rates > 0, unit_seconds / row_rates, np.nan)
+    fill_seconds = REFERENCE_INDEX.reference_volumes[None, :] * seconds_per_liter[:, None]
+
+    columns = {
+        "initial_volume": volumes[volume_idx],
+        "unit": np.full(stop - start, grid.unit),
+        "initial_volume_liters": chunk_volumes_liters[volume_idx - first_volume_idx],
+        "time_rate": row_rates,
+        "time_unit": time_units[time_unit_idx],
+    }
+    for j, slug in enumerate(reference_column_names()):
+        columns[f"{slug}_first_iteration"] = iterations[:, j]
+        columns[f"{slug}_fill_seconds"] = fill_seconds[:, j]
+    return columns
+
+
+def write_sweep_part(columns, path, fmt):
+    """
+    Writes one chunk's columns to path atomically: a partial file never has the final name,
+    so resuming only ever skips complete parts.
+    """
+    tmp_path = path + ".tmp"
+    if fmt == "parquet":
+        pq.write_table(pa.table(columns), tmp_path)
+    else:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns.keys())
+            writer.writerows(zip(*(column.tolist() for column in columns.values())))
+    os.replace(tmp_path, path)
+
+
+def sweep_part_path(output_dir, index, fmt):
+    return os.path.join(output_dir, f"part-{index:05d}.{fmt}")
+
+
+def _run_sweep_chunk(grid, output_dir, fmt, index, start, stop):
+    write_sweep_part(compute_sweep_chunk(grid, start, stop), sweep_part_path(output_dir, index, fmt), fmt)
+    return index, stop - start
+
+
+def _prepare_output(grid, output_dir, fmt, chunk_size, overwrite):
+    """
+    Creates the output directory and manifest, or checks an existing manifest for a resume.
+    """
+    manifest = dict(grid.describe(), format=fmt, chunk_size=chunk_size)
+    manifest_path = os.path.join(output_dir, SWEEP_MANIFEST)
+    os.makedirs(output_dir, exist_ok=True)
+    if os.path.exists(manifest_path) and not overwrite:
+        with open(manifest_path, encoding="utf-8") as f:
+            existing = json.load(f)
+        if existing != json.loads(json.dumps(manifest)):
+            raise ValueError(f"{output_dir} holds a different sweep. Use another output directory or overwrite it.")
+        return
+    for name in os.listdir(output_dir):
+        if name.startswith("part-"):
+            os.remove(os.path.join(output_dir, name))
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def run_sweep(grid, output_dir, fmt="csv", chunk_size=SWEEP_CHUNK_SIZE, workers=None, overwrite=False, progress=None):
+    """
+    Runs the sweep into output_dir as part-NNNNN.<fmt> files, skipping parts already written by an
+    earlier run of the same sweep. progress, if given, is called after every chunk with a dict of
+    chunks_done, chunks_total, rows_done, rows_total, rows_resumed (skipped as already written)
+    and elapsed_seconds.
+    Returns the final progress dict.
+    """
+    if fmt not in SWEEP_FORMATS:
+        raise ValueError(f"Unknown sweep format '{fmt}'. Use one of: {', '.join(SWEEP_FORMATS)}.")
+    if fmt == "parquet" and pa is None:
+        raise ValueError("Parquet output needs the optional pyarrow package.")
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be positive.")
+    _prepare_output(grid, output_dir, fmt, chunk_size, overwrite)
+
+    total = grid.size
+    chunks = [(index, start, min(start + chunk_size, total)) for index, start in enumerate(range(0, total, chunk_size))]
+    pending = [chunk for chunk in chunks if not os.path.exists(sweep_part_path(output_dir, chunk[0], fmt))]
+    status = {
+        "chunks_done": len(chunks) - len(pending),
+        "chunks_total": len(chunks),
+        "rows_done": total - sum(stop - start for _, start, stop in pending),
+        "rows_total": total,
+        "rows_resumed": total - sum(stop - start for _, start, stop in pending),
+        "elapsed_seconds": 0.0,
+    }
+    started = time.perf_counter()
+
+    def chunk_done(rows):
+        status["chunks_done"] += 1
+        status["rows_done"] += rows
+        status["elapsed_seconds"] = time.perf_counter() - started
+        if progress:
+            progress(dict(status))
+
+    if workers == 1 or len(pending) <= 1:
+        for index, start, stop in pending:
+            chunk_done(_run_sweep_chunk(grid, output_dir, fmt, index, start, stop)[1])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_sweep_chunk, grid, output_dir, fmt, index, start, stop) for index, start, stop in pending]
+            for future in as_completed(futures):
+                chunk_done(future.result()[1])
+    status["elapsed_seconds"] = time.perf_counter() - started
+    return status
+
+
+def _print_progress(status):
+    rows_new = status["rows_done"] - status["rows_resumed"]
+    rate = rows_new / status["elapsed_seconds"] if status["elapsed_seconds"] else 0
+    remaining = status["rows_total"] - status["rows_done"]
+    eta = f"{remaining / rate:.0f}s" if rate else "?"
+    sys.stderr.write(
+        f"\r{status['chunks_done']}/{status['chunks_total']} chunks, "
+        f"{status['rows_done']:,}/{status['rows_total']:,} rows, "
+        f"{status['elapsed_seconds']:.1f}s elapsed, ETA {eta}   "
+    )
+    sys.stderr.flush()
+
+
+def _axis_from_args(values, value_range, spacing):
+    if value_range:
+        return {spacing: [value_range[0], value_range[1], int(value_range[2])]}
+    return {"values": values}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep initial volumes × fill rates × time units and record when each reference body is reached.")
+    volumes = parser.add_mutually_exclusive_group(required=True)
+    volumes.add_argument("--volumes", type=float, nargs="+", help="Initial volumes to sweep.")
+    volumes.add_argument("--volume-range", type=float, nargs=3, metavar=("START", "STOP", "COUNT"), help="Range of initial volumes.")
+    rates = parser.add_mutually_exclusive_group(required=True)
+    rates.add_argument("--rates", type=float, nargs="+", help="Fill rates (liters per time unit) to sweep.")
+    rates.add_argument("--rate-range", type=float, nargs=3, metavar=("START", "STOP", "COUNT"), help="Range of fill rates.")
+    parser.add_argument("--spacing", choices=("logspace", "linspace"), default="logspace", help="Spacing of --volume-range and --rate-range (default: logspace).")
+    parser.add_argument("--time-units", nargs="+", default=["second"], choices=list(TIME_UNIT_SECONDS))
+    parser.add_argument("--unit", choices=("litres", "gallons"), default="litres", help="Unit of the initial volumes.")
+    parser.add_argument("--output", required=True, help="Output directory for the part files and manifest.")
+    parser.add_argument("--format", choices=SWEEP_FORMATS, default="csv")
+    parser.add_argument("--chunk-size", type=int, default=SWEEP_CHUNK_SIZE, help="Combinations per part file.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core).")
+    parser.add_argument("--overwrite", action="store_true", help="Discard an existing sweep in the output directory.")
+    parser.add_argument("--quiet", action="store_true", help="Do not report progress.")
+    args = parser.parse_args(argv)
+
+    try:
+        grid = SweepGrid(
+            _axis_from_args(args.volumes, args.volume_range, args.spacing),
+            _axis_from_args(args.rates, args.rate_range, args.spacing),
+            args.time_units,
+            args.unit,
+        )
+        status = run_sweep(grid, args.output, args.format, args.chunk_size, args.workers, args.overwrite, None if args.quiet else _print_progress)
+    except ValueError as e:
+        parser.error(str(e))
+    if not args.quiet:
+        sys.stderr.write("\n")
+    print(f"Wrote {status['rows_total']:,} rows in {status['chunks_total']} parts to {args.output} ({status['elapsed_seconds']:.1f}s).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture
+def client():
+    from app import create_app
+
+    return create_app({"TESTING": True}).test_client()
@@ -0,0 +1,82 @@
+from calculator import parse_calculation_inputs
+
+
+def test_batch_answers_every_scenario_despite_malformed_ones(client):
+    response = client.post("/calculate_batch", json=[
+        {"initial_volume": 1, "iterations": 3, "fields": [1]},
+        {"initial_volume": 1, "iterations": 3, "time_rate": [1], "time_unit": "Hour"},
+        {"initial_volume": 1, "iterations": 3, "time_rate": 10, "time_unit": "Hour"},
+    ])
+    assert response.status_code == 200
+    outcomes = response.get_json()["scenarios"]
+    assert "error" in outcomes[0] and "error" in outcomes[1]
+    assert len(outcomes[2]["results"]) == 3
+
+
+def test_parquet_button_is_only_shown_when_parquet_export_is_available(client, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "PARQUET_AVAILABLE", False)
+    assert b'id="exportParquetBtn"' not in client.get("/").data
+    monkeypatch.setattr(app, "PARQUET_AVAILABLE", True)
+    assert b'id="exportParquetBtn"' in client.get("/").data
+
+
+def test_cache_keys_and_etags_depend_on_the_reference_tables(client, monkeypatch):
+    import app
+
+    url = "/api/calculate?initial_volume=1&iterations=3"
+    etag = client.get(url).headers["ETag"]
+    key = app.calculation_cache_key("rows", parse_calculation_inputs("1", "litres", "3"))
+    assert app.REFERENCE_INDEX.fingerprint in key
+
+    monkeypatch.setattr(app, "CALCULATION_VERSION", "3-othercatalog")
+    assert client.get(url).headers["ETag"] != etag
+
+
+def test_columnar_results_hold_one_array_per_selected_field(client):
+    rows = client.get("/api/calculate?initial_volume=1&iterations=4&fields=volume_liters_raw").get_json()
+    columns = client.get("/api/calculate?initial_volume=1&iterations=4&fields=volume_liters_raw&format=columnar").get_json()
+    assert rows == [{"iteration": i + 1, "volume_liters_raw": 2.0 ** i} for i in range(4)]
+    assert columns == {
+        "fields": ["iteration", "volume_liters_raw"],
+        "length": 4,
+        "columns": {"iteration": [1, 2, 3, 4], "volume_liters_raw": [1.0, 2.0, 4.0, 8.0]},
+    }
+
+
+def test_unknown_field_is_a_400(client):
+    response = client.get("/api/calculate?initial_volume=1&iterations=4&fields=nope")
+    assert response.status_code == 400
+    assert "Unknown field" in response.get_json()["error"]
+
+
+def test_overflowed_volumes_are_null_in_json(client):
+    response = client.get("/api/calculate?initial_volume=1&iterations=1100&fields=volume_liters_raw&format=columnar")
+    assert b"Infinity" not in response.data
+    assert response.get_json()["columns"]["volume_liters_raw"][-1] is None
+
+
+def test_get_api_answers_a_matching_etag_with_304(client):
+    url = "/api/calculate?initial_volume=3&iterations=5"
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers["ETag"]
+    assert "public" in first.headers["Cache-Control"]
+    again = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+    # Equivalent inputs normalize to the same ETag
+    assert client.get("/api/calculate?initial_volume=3.0&iterations=5").headers["ETag"] == first.headers["ETag"]
+
+
+def test_busy_admission_is_a_429_with_retry_after(client, monkeypatch):
+    import app
+
+    controller = app.AdmissionController(cpu_budget_seconds=1, memory_budget_bytes=2**30, queue_timeout_seconds=0.05, max_queued=1)
+    monkeypatch.setattr(app, "ADMISSION", controller)
+    with controller.admit(app.CalculationCost(1, 0)):
+        response = client.get("/api/calculate?initial_volume=41&iterations=5")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert controller.stats()["rejected"] == 1
+    assert client.get("/api/calculate?initial_volume=41&iterations=5").status_code == 200
@@ -0,0 +1,56 @@
+import json
+from io import StringIO
+
+import batch
+from batch import JsonlWriter, read_scenarios, run_batch
+
+
+def _strict_loads(line):
+    def reject(constant):
+        raise ValueError(f"bare {constant} in JSONL output")
+    return json.loads(line, parse_constant=reject)
+
+
+def run_jsonl(text, **kwargs):
+    output = StringIO()
+    counts = run_batch(read_scenarios(StringIO(text), "jsonl"), JsonlWriter(output), workers=1, **kwargs)
+    return counts, [_strict_loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_malformed_lines_fail_as_their_own_scenarios():
+    (written, errors), records = run_jsonl(
+        '{"initial_volume": 1, "iterations": 2}\n'
+        'not json\n'
+        '{"initial_volume": 1, "iterations": 2, "fields": [1]}\n'
+        '{"initial_volume": 1, "iterations": 2, "time_rate": [1], "time_unit": "Hour"}\n'
+        '{"initial_volume": 2, "iterations": 2}\n'
+    )
+    assert (written, errors) == (5, 3)
+    assert [record["scenario"] for record in records] == [1, 2, 3, 4, 5]
+    assert [("error" in record) for record in records] == [False, True, True, True, False]
+
+
+def test_a_chunk_that_raises_is_split_down_to_the_failing_scenario(monkeypatch):
+    perform_batch_calculation = batch.perform_batch_calculation
+
+    def fail_on_gallons(scenarios):
+        if any(scenario.get("unit") == "gallons" for scenario in scenarios):
+            raise RuntimeError("boom")
+        return perform_batch_calculation(scenarios)
+    monkeypatch.setattr(batch, "perform_batch_calculation", fail_on_gallons)
+
+    (written, errors), records = run_jsonl(
+        '{"initial_volume": 1, "iterations": 2}\n'
+        '{"initial_volume": 1, "iterations": 2, "unit": "gallons"}\n'
+        '{"initial_volume": 1, "iterations": 2}\n'
+    )
+    assert (written, errors) == (3, 1)
+    assert records[1] == {"scenario": 2, "error": "boom"}
+    assert len(records[2]["results"]) == 2
+
+
+def test_overflowed_volumes_are_written_as_null():
+    _, records = run_jsonl('{"initial_volume": 1, "iterations": 1100, "fields": "volume_liters_raw"}\n')
+    volumes = [row["volume_liters_raw"] for row in records[0]["results"]]
+    assert volumes[0] == 1.0
+    assert volumes[-1] is None
@@ -0,0 +1,70 @@
+import pytest
+
+import calculator
+from calculator import parse_calculation_inputs, parse_fill_rate, parse_row_fields, perform_batch_calculation
+
+
+def test_row_fields_from_a_string_or_a_list():
+    assert parse_row_fields("volume_liters_raw, description") == ("iteration", "volume_liters_raw", "description")
+    assert parse_row_fields(["description", "volume_liters_raw"]) == ("iteration", "volume_liters_raw", "description")
+    assert parse_row_fields("") is None
+
+
+@pytest.mark.parametrize("fields", [[1], ["volume_liters_raw", None], {"volume_liters_raw": 1}, 5])
+def test_non_string_row_fields_are_a_value_error(fields):
+    with pytest.raises(ValueError):
+        parse_row_fields(fields)
+
+
+def test_unknown_row_field_is_a_value_error():
+    with pytest.raises(ValueError, match="Unknown field"):
+        parse_row_fields("volume_liters_raw,nope")
+
+
+@pytest.mark.parametrize("rate, expected", [("5", (5.0, None)), (2.5, (2.5, None)), ("fast", (None, "Invalid rate")), (None, (None, None))])
+def test_fill_rate(rate, expected):
+    assert parse_fill_rate(rate, "Hour") == expected
+
+
+@pytest.mark.parametrize("rate", [[1], {"rate": 1}, True])
+def test_non_numeric_fill_rate_is_rejected_while_parsing(rate):
+    with pytest.raises(ValueError):
+        parse_fill_rate(rate, "Hour")
+    with pytest.raises(ValueError):
+        parse_calculation_inputs("1", "litres", "3", rate, "Hour")
+
+
+def test_batch_reports_malformed_scenarios_as_their_own_errors():
+    outcomes = perform_batch_calculation([
+        {"initial_volume": 1, "iterations": 3, "fields": [1]},
+        {"initial_volume": 1, "iterations": 3, "time_rate": [1], "time_unit": "Hour"},
+        "not a scenario",
+        {"initial_volume": 1, "iterations": 3},
+    ])
+    assert all("error" in outcome for outcome in outcomes[:3])
+    assert [row["volume_liters_raw"] for row in outcomes[3]["results"]] == [1.0, 2.0, 4.0]
+
+
+def test_batch_scenario_failing_during_assembly_fails_alone(monkeypatch):
+    assemble_rows = calculator.assemble_rows
+
+    def fail_on_gallons(inputs, *args):
+        if inputs.unit == "gallons":
+            raise TypeError("cannot assemble")
+        return assemble_rows(inputs, *args)
+    monkeypatch.setattr(calculator, "assemble_rows", fail_on_gallons)
+
+    outcomes = perform_batch_calculation([
+        {"initial_volume": 1, "iterations": 2, "unit": "gallons"},
+        {"initial_volume": 1, "iterations": 2},
+    ])
+    assert outcomes[0] == {"error": "cannot assemble"}
+    assert len(outcomes[1]["results"]) == 2
+
+
+def test_reference_fingerprint_follows_the_reference_tables(tmp_path):
+    catalog = tmp_path / "catalog.csv"
+    catalog.write_text("name,volume_liters\nthe town reservoir,5e9\n", encoding="utf-8")
+    built_in = calculator.VolumeReferenceIndex(calculator.WATER_BODY_VOLUMES, calculator.PLANET_VOLUMES)
+    assert built_in.fingerprint == calculator.REFERENCE_INDEX.fingerprint
+    assert calculator.load_reference_catalog(str(catalog)).fingerprint != built_in.fingerprint
@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import SharedStream, SingleFlight
+
+
+def test_identical_streams_arriving_while_the_first_waits_for_admission_share_it():
+    single_flight = SingleFlight()
+    admitted = threading.Event()
+    opened = []
+
+    def open_stream():
+        # Stands in for ADMISSION.admit blocking until a slot frees up
+        opened.append(1)
+        admitted.wait(5)
+        return SharedStream(iter([b"a", b"b", b"c"]), max_joinable_bytes=1024)
+
+    def read(_):
+        reader = single_flight.stream("rows", open_stream)
+        try:
+            return b"".join(reader)
+        finally:
+            reader.close()
+
+    with ThreadPoolExecutor(10) as pool:
+        results = [pool.submit(read, n) for n in range(10)]
+        time.sleep(0.3)
+        admitted.set()
+        assert [result.result() for result in results] == [b"abc"] * 10
+    stats = single_flight.stats()
+    assert len(opened) == 1
+    assert (stats["streams_started"], stats["streams_coalesced"], stats["streams_in_flight"]) == (1, 9, 0)
+
+
+def test_callers_waiting_on_a_stream_that_fails_to_open_get_its_error():
+    single_flight = SingleFlight()
+    rejected = threading.Event()
+
+    class Rejected(Exception):
+        pass
+
+    def open_stream():
+        rejected.wait(5)
+        raise Rejected("busy")
+
+    with ThreadPoolExecutor(5) as pool:
+        results = [pool.submit(single_flight.stream, "rows", open_stream) for _ in range(5)]
+        time.sleep(0.3)
+        rejected.set()
+        for result in results:
+            with pytest.raises(Rejected):
+                result.result()
+    assert single_flight.stats()["streams_started"] == 0
+    assert single_flight.stats()["streams_in_flight"] == 0
+
+    # The key is free again afterwards
+    reader = single_flight.stream("rows", lambda: SharedStream(iter([b"x"]), max_joinable_bytes=1024))
+    assert list(reader) == [b"x"]
+
+
+def test_a_stream_past_its_joinable_size_is_not_joined():
+    single_flight = SingleFlight()
+    first = single_flight.stream("rows", lambda: SharedStream(iter([b"aaaa", b"bbbb", b"cccc"]), max_joinable_bytes=2))
+    assert next(first) == b"aaaa"
+    second = single_flight.stream("rows", lambda: SharedStream(iter([b"new"]), max_joinable_bytes=2))
+    assert list(second) == [b"new"]
+    assert list(first) == [b"bbbb", b"cccc"]
+    assert single_flight.stats()["streams_started"] == 2
+
+
+def test_do_runs_identical_calls_once():
+    single_flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return b"body"
+
+    with ThreadPoolExecutor(8) as pool:
+        results = [pool.submit(single_flight.do, "key", compute) for _ in range(8)]
+        time.sleep(0.3)
+        release.set()
+        assert {result.result() for result in results} == {b"body"}
+    assert len(calls) == 1
+    assert single_flight.stats()["coalesced"] == 7
@@ -0,0 +1,61 @@
+import csv
+import os
+import time
+from io import StringIO
+
+import pytest
+
+from calculator import iter_calculation_column_chunks, parse_calculation_inputs
+from exports import ExportJobQueue, _write_json_atomic, export_columns, stream_csv_export
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = ExportJobQueue(str(tmp_path), workers=1, max_pending=2, ttl_seconds=3600)
+    yield queue
+    if queue.pool is not None:
+        queue.pool.shutdown()
+
+
+def _write_status(queue, job_id, **fields):
+    job = dict(id=job_id, format="csv", filename=f"{job_id}.csv", submitted_at=time.time(), **fields)
+    _write_json_atomic(queue._status_path(job_id), job)
+
+
+def test_csv_export_streams_the_selected_columns():
+    inputs = parse_calculation_inputs("1", "litres", "3", fields="volume_liters_raw")
+    columns = export_columns(inputs.fields)
+    text = b"".join(stream_csv_export(iter_calculation_column_chunks(inputs), columns)).decode("utf-8")
+    assert list(csv.reader(StringIO(text))) == [[header for _, header in columns], ["1", "1.0"], ["2", "2.0"], ["3", "4.0"]]
+
+
+def test_job_runs_to_done_and_an_identical_submission_reuses_it(queue):
+    inputs = parse_calculation_inputs("1", "litres", "50")
+    job = queue.submit("job1", "csv", inputs, export_columns())
+    assert job["status"] == "queued" and job["owner_pid"] == os.getpid()
+    queue.pending["job1"].result(timeout=60)
+    done = queue.status("job1")
+    assert done["status"] == "done"
+    assert os.path.getsize(queue.file_path(done)) == done["size"]
+    assert queue.submit("job1", "csv", inputs, export_columns()) == done
+
+
+def test_job_whose_owner_exited_is_failed_and_can_be_resubmitted(queue):
+    _write_status(queue, "orphan", status="running", owner_pid=2**22 + 1, heartbeat_at=time.time())
+    assert queue.status("orphan")["status"] == "failed"
+    job = queue.submit("orphan", "csv", parse_calculation_inputs("1", "litres", "5"), export_columns())
+    assert job["status"] == "queued"
+    queue.pending["orphan"].result(timeout=60)
+    assert queue.status("orphan")["status"] == "done"
+
+
+def test_job_of_this_process_that_is_not_pending_is_failed(queue):
+    _write_status(queue, "lost", status="queued", owner_pid=os.getpid())
+    assert queue.status("lost")["status"] == "failed"
+
+
+def test_running_job_with_a_stale_heartbeat_is_failed(queue):
+    _write_status(queue, "stuck", status="running", owner_pid=os.getppid(), heartbeat_at=time.time() - 3600)
+    _write_status(queue, "busy", status="running", owner_pid=os.getppid(), heartbeat_at=time.time())
+    assert queue.status("stuck")["status"] == "failed"
+    assert queue.status("busy")["status"] == "running"
@@ -0,0 +1,80 @@
+import math
+
+import numpy as np
+import pytest
+
+from calculator import parse_compounding_rule, perform_batch_calculation
+from rules import compile_rule
+
+
+def stepped(rule_text, initial_volume, stop):
+    """The rule's volumes computed one iteration at a time in plain Python, as the reference."""
+    rule = compile_rule(rule_text)
+    a, b = rule.coefficients(stop)
+    b = [0.0] * stop if b is None else b.tolist()
+    volumes = []
+    volume = initial_volume
+    for factor, addend in zip(a.tolist(), b):
+        volume = factor * volume + addend
+        volumes.append(volume)
+    return np.array(volumes)
+
+
+@pytest.mark.parametrize("rule_text, initial_volume, stop, limit", [
+    ("v*0.5 + 1", 10.0, 1060, 2.0),
+    ("v*0.9 + 1", 10.0, 20_000, 10.0),
+    ("v*0.999 + 3", 0.0, 100_000, 3000.0),
+])
+def test_contracting_rules_converge_over_long_runs(rule_text, initial_volume, stop, limit):
+    volumes = compile_rule(rule_text).series(initial_volume, stop)
+    assert np.all(np.isfinite(volumes))
+    assert volumes[-1] == pytest.approx(limit, rel=1e-9)
+    np.testing.assert_allclose(volumes, stepped(rule_text, initial_volume, stop), rtol=1e-12)
+
+
+@pytest.mark.parametrize("rule_text, initial_volume, stop", [
+    ("v*2 - 1", 1.0, 60),
+    ("v*2 - 1", 1.0, 5000),
+    ("v * 1.05 - 1000", 20_000.0, 2000),
+    ("v * 1.01 - 100", 5000.0, 2000),
+])
+def test_cancelling_rules_match_stepping(rule_text, initial_volume, stop):
+    volumes = compile_rule(rule_text).series(initial_volume, stop)
+    expected = stepped(rule_text, initial_volume, stop)
+    finite = np.isfinite(expected)
+    np.testing.assert_array_equal(np.isfinite(volumes), finite)
+    np.testing.assert_allclose(volumes[finite], expected[finite], rtol=1e-12)
+
+
+def test_fixed_point_rule_stays_at_its_fixed_point():
+    volumes = compile_rule("v*2 - 1").series(1.0, 60)
+    np.testing.assert_array_equal(volumes, np.ones(60))
+
+
+def test_window_of_a_long_contracting_series():
+    rule = compile_rule("v*0.5 + 1")
+    np.testing.assert_allclose(rule.series(10.0, 5000, start=4990), np.full(10, 2.0))
+
+
+def test_overflowing_series_matches_stepping():
+    volumes = compile_rule("v * 1.05 + 1000").series(1000.0, 50_000)
+    expected = stepped("v * 1.05 + 1000", 1000.0, 50_000)
+    finite = np.isfinite(expected)
+    np.testing.assert_array_equal(np.isfinite(volumes), finite)
+    np.testing.assert_allclose(volumes[finite], expected[finite], rtol=1e-12)
+    assert math.isinf(volumes[-1])
+
+
+@pytest.mark.parametrize("rule", [5, 1.5, ["v * 2"], {"rule": "v * 2"}])
+def test_non_string_rule_is_a_value_error(rule):
+    with pytest.raises(ValueError):
+        parse_compounding_rule(rule=rule)
+
+
+def test_non_string_rule_fails_only_its_batch_scenario():
+    outcomes = perform_batch_calculation([
+        {"initial_volume": 1, "iterations": 3, "rule": 5},
+        {"initial_volume": 1, "iterations": 3, "rule": "v * 2"},
+    ])
+    assert "error" in outcomes[0]
+    assert [row["volume_liters_raw"] for row in outcomes[1]["results"]] == [2.0, 4.0, 8.0]